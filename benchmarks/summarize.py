@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
+"""Summarize hyperfine benchmark results as speedups over a baseline.
+
+Read hyperfine's JSON output for each benchmark, classify every command
+into a mode (like `brili` or `brilift-jit`), and print a CSV with each
+mode's mean time and its speedup over the baseline mode. The harmonic
+and geometric mean speedups go to stderr.
+
+With `--history`, also append the results to a SQLite database, and with
+`--trend`, print how a mode's speedup changed over past runs instead.
+"""
+import argparse
 import json
 import sys
 import os
 import csv
 import statistics
 import re
+import random
+import sqlite3
+import subprocess
+import time
 from collections import defaultdict
 
 MODES = {
@@ -15,57 +30,227 @@ MODES = {
 }
 BASELINE = 'brili'
 
+# Resamples for bootstrap confidence intervals.
+BOOTSTRAP_ITERATIONS = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    commit_id TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    bench TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    mean REAL NOT NULL,
+    stddev REAL,
+    speedup REAL
+);
+CREATE INDEX IF NOT EXISTS results_by_mode ON results (mode, run);
+"""
+
+
+def bench_files(paths):
+    """Expand directories into the JSON files they contain."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                for name in sorted(names):
+                    if name.endswith('.json'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def classify(command, modes):
+    """Find the first mode whose pattern matches a command, or None."""
+    for mode, pat in modes.items():
+        if re.search(pat, command):
+            return mode
+    return None
+
 
-def get_results(bench_files):
-    for fn in bench_files:
+def get_results(files, modes):
+    """Load one benchmark at a time. For each file, generate the
+    benchmark's name and a list of (mode, result) pairs.
+    """
+    for fn in files:
         with open(fn) as f:
             bench_data = json.load(f)
 
         bench, _ = os.path.basename(fn).split('.', 1)
+        results = []
         for res in bench_data["results"]:
-            for mode, pat in MODES.items():
-                if re.search(pat, res['command']):
-                    break
+            mode = classify(res['command'], modes)
+            if mode is None:
+                print('{}: skipping unknown command: {}'.format(
+                    fn, res['command']
+                ), file=sys.stderr)
             else:
-                assert False, "unknown benchmark command"
+                results.append((mode, res))
+        yield bench, results
 
-            yield bench, mode, res
 
+def bootstrap(values, stat):
+    """Compute a statistic of some values and a 95% confidence interval
+    for it by resampling.
+    """
+    rng = random.Random(0)
+    stats = sorted(
+        stat(rng.choices(values, k=len(values)))
+        for _ in range(BOOTSTRAP_ITERATIONS)
+    )
+    low = stats[int(0.025 * (len(stats) - 1))]
+    high = stats[int(0.975 * (len(stats) - 1))]
+    return stat(values), low, high
+
+
+MEANS = {
+    'harmonic': statistics.harmonic_mean,
+    'geometric': statistics.geometric_mean,
+}
+
+
+def print_means(speedups):
+    """Print the mean speedups of each mode to stderr."""
+    for mode, speedup_list in speedups.items():
+        print('{}:'.format(mode), ', '.join(
+            '{} {:.2f}x (95% CI {:.2f}-{:.2f})'.format(
+                name, *bootstrap(speedup_list, func)
+            )
+            for name, func in MEANS.items()
+        ), file=sys.stderr)
 
-def summarize(bench_files):
-    means = defaultdict(dict)
-    results = list(get_results(bench_files))
-    for bench, mode, res in results:
-        means[bench][mode] = res['mean']
+
+def git_commit():
+    """Get the current git commit, or None outside a repository."""
+    try:
+        out = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def open_history(path):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def summarize(files, modes, baseline, db=None, commit=None):
+    if db:
+        run_id = db.execute(
+            'INSERT INTO runs (timestamp, commit_id) VALUES (?, ?)',
+            (time.strftime('%Y-%m-%dT%H:%M:%S%z'), commit),
+        ).lastrowid
 
     writer = csv.DictWriter(
         sys.stdout,
         ['bench', 'mode', 'mean', 'stddev', 'speedup'],
     )
     writer.writeheader()
-    speedups = {k: [] for k in MODES}
-    for bench, mode, res in results:
-        speedup = means[bench][BASELINE] / res['mean']
-        print('{} {} {:.2f}x'.format(bench, mode, speedup), file=sys.stderr)
-        speedups[mode].append(speedup)
-
-        writer.writerow({
-            'bench': bench,
-            'mode': mode,
-            'mean': res['mean'],
-            'stddev': res['stddev'],
-            'speedup': speedup,
-        })
-
-    # Filter out modes which don't have data, and thus no speedups.
-    speedups = {k: v for k, v in speedups.items() if v}
+    speedups = defaultdict(list)
+    for bench, results in get_results(files, modes):
+        base = [res['mean'] for mode, res in results if mode == baseline]
+        if not base:
+            print('{}: no {} baseline'.format(bench, baseline),
+                  file=sys.stderr)
 
-    for mode, speedup_list in speedups.items():
-        print('{}: {:.2f}x'.format(
-            mode,
-            statistics.harmonic_mean(speedup_list)
-        ), file=sys.stderr)
+        for mode, res in results:
+            speedup = None
+            if base and res['mean']:
+                speedup = base[0] / res['mean']
+                print('{} {} {:.2f}x'.format(bench, mode, speedup),
+                      file=sys.stderr)
+                speedups[mode].append(speedup)
+
+            writer.writerow({
+                'bench': bench,
+                'mode': mode,
+                'mean': res['mean'],
+                'stddev': res['stddev'],
+                'speedup': speedup,
+            })
+            if db:
+                db.execute(
+                    'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                    (run_id, bench, mode, res['mean'], res['stddev'],
+                     speedup),
+                )
+
+    if db:
+        db.commit()
+    print_means(speedups)
+
+
+def trend(db, mode, last):
+    """Print a CSV of a mode's mean speedups in each of the last runs."""
+    runs = db.execute(
+        'SELECT id, timestamp, commit_id FROM runs '
+        'ORDER BY id DESC LIMIT ?', (last,)
+    ).fetchall()
+
+    writer = csv.writer(sys.stdout)
+    header = ['timestamp', 'commit', 'benchmarks']
+    for name in MEANS:
+        header += [name, name + '_low', name + '_high']
+    writer.writerow(header)
+    for run_id, timestamp, commit in reversed(runs):
+        speedups = [row[0] for row in db.execute(
+            'SELECT speedup FROM results '
+            'WHERE run = ? AND mode = ? AND speedup IS NOT NULL',
+            (run_id, mode),
+        )]
+        if not speedups:
+            continue
+        row = [timestamp, commit, len(speedups)]
+        for func in MEANS.values():
+            row += ['{:.4f}'.format(x) for x in bootstrap(speedups, func)]
+        writer.writerow(row)
+
+
+def parse_mode(text):
+    name, sep, pat = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('expected NAME=REGEX')
+    return name, pat
 
 
 if __name__ == '__main__':
-    summarize(sys.argv[1:])
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='*',
+                        help='hyperfine JSON files, or directories of them')
+    parser.add_argument('-m', '--mode', action='append', default=[],
+                        type=parse_mode, metavar='NAME=REGEX',
+                        help='classify commands matching REGEX as NAME '
+                        '(checked before the built-in modes; repeatable)')
+    parser.add_argument('-b', '--baseline', default=BASELINE,
+                        help='mode to compute speedups over '
+                        '(default: %(default)s)')
+    parser.add_argument('--history', metavar='DB',
+                        help='append results to this SQLite database')
+    parser.add_argument('--commit',
+                        help='commit to record in the history '
+                        '(default: the current git HEAD)')
+    parser.add_argument('--trend', metavar='MODE',
+                        help="print MODE's speedup over past runs "
+                        'in the history instead')
+    parser.add_argument('--last', type=int, default=30,
+                        help='runs to show with --trend '
+                        '(default: %(default)s)')
+    args = parser.parse_args()
+
+    db = open_history(args.history) if args.history else None
+    if args.trend:
+        if db is None:
+            parser.error('--trend needs --history')
+        trend(db, args.trend, args.last)
+    else:
+        modes = dict(args.mode)
+        modes.update((k, v) for k, v in MODES.items() if k not in modes)
+        commit = args.commit or (git_commit() if db else None)
+        summarize(bench_files(args.files), modes, args.baseline, db, commit)
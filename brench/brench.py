@@ -8,7 +8,23 @@ import re
 import csv
 import sys
 import os
-from concurrent import futures
+import time
+import json
+import shlex
+import shutil
+import hashlib
+import tempfile
+import functools
+import itertools
+import asyncio
+import signal
+import math
+import statistics
+import random
+import io
+import traceback
+import base64
+import resource
 import glob
 
 __version__ = "1.0.0"
@@ -16,49 +32,826 @@ __version__ = "1.0.0"
 ARGS_RE = r"ARGS: (.*)"
 
 
-def run_pipe(cmds, input, timeout):
-    """Execute a pipeline of shell commands.
+class Stage:
+    """A node in the prefix tree of run pipelines.
 
-    Send the given input (text) string into the first command, then pipe
-    the output of each command into the next command in the sequence.
-    Collect and return the stdout and stderr from the final command.
+    Every node stands for one command in a pipeline. `runs` lists the
+    runs whose pipeline ends with this command, and `children` maps the
+    next command of the longer pipelines to their nodes.
     """
-    procs = []
-    for cmd in cmds:
-        last = len(procs) == len(cmds) - 1
-        proc = subprocess.Popen(
-            cmd,
-            shell=True,
-            text=True,
-            stdin=procs[-1].stdout if procs else subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE if last else subprocess.DEVNULL,
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.runs = []
+        self.children = {}
+        self.through = set()  # Runs whose pipelines include this node.
+
+
+def pipeline_tree(runs):
+    """Merge the pipelines of a set of runs into a prefix tree, so stages
+    that several runs start with can run once. Return the root, a
+    `Stage` without a command.
+    """
+    root = Stage(None)
+    for name, run in runs.items():
+        node = root
+        node.through.add(name)
+        for cmd in run["pipeline"]:
+            if cmd not in node.children:
+                node.children[cmd] = Stage(cmd)
+            node = node.children[cmd]
+            node.through.add(name)
+        node.runs.append(name)
+    return root
+
+
+# Characters that mean a command needs a shell to run.
+SHELL_CHARS = set("|&;<>()$`\\*?[]#~{}\n")
+
+
+def command_argv(cmd):
+    """Split a command into the arguments to `exec` it directly, without a
+    shell. Return None if it uses shell features like pipes, redirection,
+    variables, globs, or environment assignments.
+    """
+    if SHELL_CHARS & set(cmd):
+        return None
+    try:
+        argv = shlex.split(cmd)
+    except ValueError:
+        return None
+    if not argv or "=" in argv[0]:
+        return None
+    return argv
+
+
+async def wait_fd(fd, write=False):
+    """Wait until a file descriptor is ready to read (or to `write`)."""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    if write:
+        add, remove = loop.add_writer, loop.remove_writer
+    else:
+        add, remove = loop.add_reader, loop.remove_reader
+    add(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        remove(fd)
+
+
+async def feed(pipe, data):
+    """Write bytes to a pipe as it can take them, then close it."""
+    fd = pipe.fileno()
+    os.set_blocking(fd, False)
+    view = memoryview(data)
+    try:
+        while view:
+            try:
+                view = view[os.write(fd, view) :]
+            except BlockingIOError:
+                await wait_fd(fd, write=True)
+            except BrokenPipeError:
+                break
+    finally:
+        pipe.close()
+
+
+async def drain(pipe, hasher=None, keep=True):
+    """Read bytes from a pipe until it is closed. Feed them to `hasher`
+    as they arrive, if there is one, and return them if `keep` is set.
+    """
+    fd = pipe.fileno()
+    os.set_blocking(fd, False)
+    chunks = []
+    try:
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                await wait_fd(fd)
+                continue
+            if not chunk:
+                break
+            if hasher:
+                hasher.update(chunk)
+            if keep:
+                chunks.append(chunk)
+    finally:
+        pipe.close()
+    return b"".join(chunks) if keep else None
+
+
+async def wait_exit(pid):
+    """Wait for a child process to exit, but leave it to be reaped."""
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # No process file descriptors, so wait in a thread instead.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, os.waitid, os.P_PID, pid, os.WEXITED | os.WNOWAIT
         )
-        procs.append(proc)
+        return
+    try:
+        await wait_fd(fd)
+    finally:
+        os.close(fd)
+
 
+def kill_group(pid):
+    """Kill every process in a process group."""
     try:
-        # Send stdin and collect stdout.
-        procs[0].stdin.write(input)
-        procs[0].stdin.close()
-        return procs[-1].communicate(timeout=timeout)
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+# The fields of a stage's resource usage.
+USAGE_FIELDS = ("wall", "user", "sys", "rss")
+
+
+async def run_stage(cmd, input, timeout, keep=True):
+    """Execute a single command with the given input bytes.
+
+    The command runs directly if it can and through a shell if it needs
+    one, in a process group of its own. Its input and output stream
+    concurrently. When it finishes or the `timeout` expires, every
+    process left in its group is killed. Return its stdout (as bytes, or
+    None unless `keep` is set), the SHA-256 digest of its stdout, its
+    stderr (as text), and its resource usage: a dictionary with its
+    `wall`-clock, `user` CPU, and `sys` CPU seconds and its peak `rss`
+    in kilobytes. Raise `asyncio.TimeoutError` if it takes too long.
+    """
+    start = time.monotonic()
+    popen = functools.partial(
+        subprocess.Popen,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    argv = command_argv(cmd)
+    try:
+        proc = popen(argv) if argv else popen(cmd, shell=True)
+    except OSError:
+        # Let the shell report a missing program.
+        proc = popen(cmd, shell=True)
+
+    hasher = hashlib.sha256()
+    try:
+        _, stdout, stderr, _ = await asyncio.wait_for(
+            asyncio.gather(
+                feed(proc.stdin, input),
+                drain(proc.stdout, hasher, keep),
+                drain(proc.stderr),
+                wait_exit(proc.pid),
+            ),
+            timeout,
+        )
     finally:
-        for proc in procs:
-            proc.kill()
+        # The exited process keeps its group's ID until it is reaped.
+        kill_group(proc.pid)
+        await wait_exit(proc.pid)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+    # macOS reports bytes; Linux reports kilobytes.
+    rss = rusage.ru_maxrss
+    usage = {
+        "wall": time.monotonic() - start,
+        "user": rusage.ru_utime,
+        "sys": rusage.ru_stime,
+        "rss": rss // 1024 if sys.platform == "darwin" else rss,
+    }
+    return stdout, hasher.hexdigest(), stderr.decode(), usage
+
+
+async def run_pipeline(cmds, input, timeout):
+    """Run the commands of a pipeline one after another on some input
+    bytes, and return the last one's stdout.
+    """
+    for cmd in cmds:
+        input, _, _, _ = await run_stage(cmd, input, timeout)
+    return input
+
+
+def digest(text):
+    """Hash a run's output, so outputs can be compared without keeping
+    them around.
+    """
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def file_digest(path):
+    """Hash the contents of a file like `digest`, a block at a time.
+    Return None if the file does not exist.
+    """
+    hasher = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(65536), b""):
+                hasher.update(block)
+    except FileNotFoundError:
+        return None
+    return hasher.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def tool_stamps(cmd):
+    """Identify the versions of the files a command runs: its program
+    (found on the `PATH`) and any other word in it that names a file,
+    like a script. A Python script probably imports modules that sit next
+    to it, so every `.py` file in a script's directory counts, too. Each
+    file is identified by its path, modification time, and size.
+    """
+    try:
+        words = shlex.split(cmd)
+    except ValueError:
+        words = cmd.split()
+
+    paths = []
+    for i, word in enumerate(words):
+        path = word if os.path.isfile(word) else None
+        if path is None and i == 0:
+            path = shutil.which(word)
+        if path:
+            paths.append(path)
+            if path.endswith(".py"):
+                folder = os.path.dirname(path) or "."
+                paths += sorted(
+                    os.path.join(folder, name)
+                    for name in os.listdir(folder)
+                    if name.endswith(".py") and name != os.path.basename(path)
+                )
+
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stamps.append([os.path.abspath(path), st.st_mtime_ns, st.st_size])
+    return stamps
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "brench")
+
 
+class Cache:
+    """An on-disk cache of run results.
 
-def run_bench(pipeline, fn, timeout):
-    """Run a single benchmark pipeline."""
+    Each entry is a small JSON file named by the hash of everything that
+    could change the result. Reading an entry marks it as recently used,
+    and `evict` deletes the least recently used entries until the cache
+    fits in `max_size` bytes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, bench_hash, cmds, extract):
+        """Compute the key for running a pipeline (with `{args}` already
+        filled in) on a benchmark with the given content hash.
+        """
+        data = [
+            __version__,
+            bench_hash,
+            cmds,
+            [tool_stamps(cmd) for cmd in cmds],
+            extract,
+        ]
+        return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+    def get(self, key):
+        fn = os.path.join(self.path, key + ".json")
+        try:
+            with open(fn) as f:
+                record = json.load(f)
+            os.utime(fn)
+        except (OSError, ValueError):
+            return None
+        return record
+
+    def put(self, key, record):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, os.path.join(self.path, key + ".json"))
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".json"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def load_durations(path):
+    """Load how long each benchmark took the last time it ran, as a
+    dictionary mapping benchmark paths to seconds.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_durations(path, durations):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def bench_args(text):
+    """Find the arguments for a benchmark in an `ARGS:` comment."""
+    match = re.search(ARGS_RE, text)
+    return match.group(1) if match else ""
+
+
+def first_diff(expected, actual):
+    """Find the first line where two outputs differ. Return its number
+    (counting from 1) and both versions of the line (None past the end
+    of an output), or None if they are the same.
+    """
+    lines = itertools.zip_longest(expected.splitlines(), actual.splitlines())
+    for i, (a, b) in enumerate(lines, 1):
+        if a != b:
+            return i, a, b
+    return None
+
+
+async def locate_diff(fn, runs, name, golden, timeout):
+    """Run a benchmark's pipeline for run `name` again and describe where
+    its output first differs from the `golden` one: either the name of
+    another run, to run again too, or the path of an expected output.
+    """
+    with open(fn) as f:
+        in_data = f.read()
+    args = bench_args(in_data)
+
+    async def output(run):
+        cmds = [c.format(args=args) for c in runs[run]["pipeline"]]
+        try:
+            out = await run_pipeline(cmds, in_data.encode(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return out.decode(errors="replace")
+
+    if golden in runs:
+        expected = await output(golden)
+    else:
+        with open(golden, errors="replace") as f:
+            expected = f.read()
+    actual = await output(name)
+    if expected is None or actual is None:
+        return "timed out when run again"
+    diff = first_diff(expected, actual)
+    if diff is None:
+        return "matched when run again"
+    line, a, b = diff
+    return "line {}: expected {!r}, got {!r}".format(line, a, b)
+
+
+def bench_name(fn):
+    """The name of a benchmark in the output: its file's base name."""
+    return os.path.splitext(os.path.basename(fn))[0]
+
+
+def estimate_costs(files, durations):
+    """Estimate how long each benchmark will take from its last duration.
+    Benchmarks that have never run are assumed to take the average time.
+    """
+    known = [durations[fn] for fn in files if fn in durations]
+    default = statistics.mean(known) if known else 1.0
+    return {fn: durations.get(fn, default) for fn in files}
+
+
+def shard_files(files, cost, index, count):
+    """Split benchmarks into `count` shards with about the same total
+    cost, and return the files in shard number `index` (counting from 1)
+    in their original order. Benchmarks go, most costly first, to the
+    shard with the least total cost so far.
+    """
+    loads = [0.0] * count
+    owner = {}
+    for fn in sorted(files, key=lambda fn: (-cost[fn], fn)):
+        i = loads.index(min(loads))
+        loads[i] += cost[fn]
+        owner[fn] = i
+    return [fn for fn in files if owner[fn] == index - 1]
+
+
+def pass_stage(cmd, scripts):
+    """If a command runs one of the pass `scripts` with Python, return
+    the script and its arguments. Otherwise, return None.
+    """
+    argv = command_argv(cmd)
+    if argv and len(argv) > 1 and os.path.basename(argv[0]) in PYTHONS:
+        script = os.path.normpath(argv[1])
+        if script in scripts:
+            return script, argv[2:]
+    return None
+
+
+# Commands that run pass scripts.
+PYTHONS = ("python", "python3")
+
+
+class WorkerPool:
+    """Long-lived Python processes that run pass scripts.
+
+    Each worker (see `serve_passes`) runs one script at a time, so a
+    stage that runs a pass becomes a function call instead of a fresh
+    interpreter that has to import everything again. The pool starts
+    workers as they are needed, up to `size` at once.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.idle = None
+
+    async def acquire(self):
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+        if self.idle.empty() and self.count < self.size:
+            self.count += 1
+            return await asyncio.create_subprocess_exec(
+                sys.executable,
+                os.path.abspath(__file__),
+                "worker",
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                limit=2**31,
+                start_new_session=True,
+            )
+        return await self.idle.get()
+
+    async def discard(self, worker):
+        kill_group(worker.pid)
+        await worker.wait()
+        self.count -= 1
+
+    async def run(self, script, argv, input, timeout, keep=True):
+        """Run a pass script in a worker, like `run_stage`, and return the
+        same things. Its `user` and `sys` times are this pass's, but its
+        `rss` is the worker's peak over every pass it has run.
+        """
+        start = time.monotonic()
+        worker = await self.acquire()
+        request = {
+            "script": script,
+            "argv": argv,
+            "input": base64.b64encode(input).decode(),
+        }
+
+        async def exchange():
+            worker.stdin.write(json.dumps(request).encode() + b"\n")
+            await worker.stdin.drain()
+            return await worker.stdout.readline()
+
+        try:
+            line = await asyncio.wait_for(exchange(), timeout)
+        except BaseException:
+            # A worker in the middle of a request cannot be reused.
+            await self.discard(worker)
+            raise
+        if line:
+            reply = json.loads(line)
+            self.idle.put_nowait(worker)
+        else:
+            await self.discard(worker)
+            reply = {"stdout": "", "stderr": "worker crashed", "usage": {}}
+
+        stdout = base64.b64decode(reply["stdout"])
+        usage = {"wall": time.monotonic() - start, "user": 0.0, "sys": 0.0, "rss": 0}
+        usage.update(reply["usage"])
+        return (
+            stdout if keep else None,
+            hashlib.sha256(stdout).hexdigest(),
+            reply["stderr"],
+            usage,
+        )
+
+    async def close(self):
+        while self.idle and not self.idle.empty():
+            worker = self.idle.get_nowait()
+            worker.stdin.close()
+            await worker.wait()
+
+
+def serve_passes():
+    """Run pass scripts for a `WorkerPool`.
+
+    Each line of standard input is a JSON request with a `script`, its
+    `argv`, and its `input` (in base64). Run the script as if it were the
+    main program, and reply with a line of JSON with its `stdout` (in
+    base64), `stderr`, and resource `usage`.
+
+    Scripts are compiled once, and the modules they import stay loaded
+    for later requests. But modules imported from a script's directory
+    are forgotten when a script from another directory runs, so that its
+    own modules of the same names (like two `cfg.py` files) do not get
+    mixed up.
+    """
+    requests, replies = sys.stdin, sys.stdout
+    path = list(sys.path)
+    codes = {}
+    current = None  # The directory of the last script.
+    for line in requests:
+        request = json.loads(line)
+        script = request["script"]
+        if script not in codes:
+            with open(script) as f:
+                codes[script] = compile(f.read(), script, "exec")
+
+        folder = os.path.dirname(os.path.abspath(script))
+        if current is not None and folder != current:
+            for name, module in list(sys.modules.items()):
+                file = getattr(module, "__file__", None) or ""
+                if os.path.abspath(file).startswith(current + os.sep):
+                    del sys.modules[name]
+        current = folder
+
+        # Text streams over bytes, encoded like a separate process's.
+        stdout, stderr = io.BytesIO(), io.StringIO()
+        sys.stdin = io.TextIOWrapper(
+            io.BytesIO(base64.b64decode(request["input"])),
+            encoding=sys.__stdin__.encoding,
+            errors=sys.__stdin__.errors,
+        )
+        # Keep a reference: collecting the wrapper would close `stdout`.
+        text = sys.stdout = io.TextIOWrapper(
+            stdout,
+            encoding=sys.__stdout__.encoding,
+            errors=sys.__stdout__.errors,
+            write_through=True,
+        )
+        sys.stderr = stderr
+        sys.argv = [script] + request["argv"]
+        sys.path = [folder] + path
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            exec(codes[script], {"__name__": "__main__", "__file__": script})
+        except SystemExit as exc:
+            if exc.code is not None and not isinstance(exc.code, int):
+                print(exc.code, file=stderr)
+        except Exception:
+            traceback.print_exc()
+        text.flush()
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        sys.stdin, sys.stdout, sys.stderr = sys.__stdin__, replies, sys.__stderr__
+
+        rss = after.ru_maxrss
+        reply = {
+            "stdout": base64.b64encode(stdout.getvalue()).decode(),
+            "stderr": stderr.getvalue(),
+            "usage": {
+                "user": after.ru_utime - before.ru_utime,
+                "sys": after.ru_stime - before.ru_stime,
+                "rss": rss // 1024 if sys.platform == "darwin" else rss,
+            },
+        }
+        replies.write(json.dumps(reply) + "\n")
+        replies.flush()
+
+
+async def run_tree(
+    tree, in_data, args, timeout, extract, skip=(), pool=None, scripts=()
+):
+    """Run every pipeline in a prefix tree once on a benchmark's text.
+
+    Each stage runs once, and its output goes to all the stages that
+    follow it in some pipeline. The `timeout` applies to each pipeline
+    as a whole. Stages that only the runs in `skip` need do not run at all.
+    Stages that run one of the pass `scripts` run in the worker `pool`.
+    Return a dictionary mapping run names to records with the `digest`
+    of the run's standard output, its `result` according to `extract`,
+    and the resource usage of each of its `stages`, or to None for runs
+    that timed out.
+    """
+    results = {}
+
+    def timed_out(node):
+        results.update((name, None) for name in node.runs)
+        for child in node.children.values():
+            timed_out(child)
+
+    async def visit(node, input, elapsed, path):
+        for child in node.children.values():
+            if child.through.issubset(skip):
+                continue
+            cmd = child.cmd.format(args=args)
+            # A final stage's output only matters for its hash, unless we
+            # need to search it for the result.
+            keep = bool(child.children) or isinstance(extract, str)
+            script = pool and pass_stage(cmd, scripts)
+            try:
+                if script:
+                    stdout, out_hash, stderr, usage = await pool.run(
+                        *script, input, timeout - elapsed, keep
+                    )
+                else:
+                    stdout, out_hash, stderr, usage = await run_stage(
+                        cmd, input, timeout - elapsed, keep
+                    )
+            except asyncio.TimeoutError:
+                timed_out(child)
+                continue
+            if elapsed + usage["wall"] > timeout:
+                timed_out(child)
+                continue
+            stages = path + [dict(usage, cmd=cmd)]
+            for name in child.runs:
+                if name not in skip:
+                    results[name] = {
+                        "digest": out_hash,
+                        "result": extract_result(extract, stdout, stderr, stages),
+                        "stages": stages,
+                    }
+            await visit(child, stdout, elapsed + usage["wall"], stages)
+
+    await visit(tree, in_data.encode(), 0.0, [])
+    return results
+
+
+async def run_bench(
+    tree,
+    runs,
+    fn,
+    timeout,
+    extract,
+    cache=None,
+    refresh=(),
+    trials=1,
+    warmup=0,
+    pool=None,
+    scripts=(),
+):
+    """Run every pipeline in a prefix tree on a single benchmark.
+
+    Run the whole tree `warmup` times without recording anything, then
+    `trials` times. Return a dictionary mapping run names to records with
+    the `digest` of the run's standard output (from its first trial), the
+    `result` of the first trial, the list of all the trials' `samples`,
+    and the list of each trial's per-stage resource `usage`. A run that
+    timed out in any trial maps to None.
+
+    With a `cache`, runs that have a cached record are skipped (unless
+    they are listed in `refresh`), as are stages that only those runs
+    need. Pass `scripts` run in the worker `pool`, if there is one.
+    """
     # Load the benchmark.
     with open(fn) as f:
         in_data = f.read()
 
-    # Extract arguments.
-    match = re.search(ARGS_RE, in_data)
-    args = match.group(1) if match else ""
+    args = bench_args(in_data)
+
+    results = {}
+    keys = {}
+    if cache is not None:
+        bench_hash = digest(in_data)
+        for name, run in runs.items():
+            cmds = [c.format(args=args) for c in run["pipeline"]]
+            keys[name] = cache.key(bench_hash, cmds, extract)
+            if name not in refresh:
+                record = cache.get(keys[name])
+                if record is not None:
+                    record["samples"] = [record["result"]]
+                    record["usage"] = []
+                    results[name] = record
+    cached = set(results)
+
+    for trial in range(warmup + trials):
+        fresh = await run_tree(
+            tree, in_data, args, timeout, extract, cached, pool, scripts
+        )
+        if trial < warmup:
+            continue
+        for name, record in fresh.items():
+            if record is None:
+                results[name] = None
+            elif name not in results:
+                record["samples"] = [record["result"]]
+                record["usage"] = [record.pop("stages")]
+                results[name] = record
+            elif results[name] is not None:
+                results[name]["samples"].append(record["result"])
+                results[name]["usage"].append(record["stages"])
+
+    if cache is not None:
+        for name, record in results.items():
+            if name not in cached and record is not None:
+                cache.put(keys[name], {
+                    "digest": record["digest"],
+                    "result": record["result"],
+                })
+    return results
+
+
+# Built-in ways to measure a run, for `extract` tables in the config.
+BUILTIN_EXTRACTORS = ("wall",)
+
+
+def find_stage(stages, name):
+    """Find a stage in a pipeline by `name`: either its position (counting
+    from 0, or from -1 at the end) or a word in its command, where a path
+    also matches its last component (so `lvn.py` finds
+    `python3 ../examples/lvn.py`). Return None if no stage matches.
+    """
+    try:
+        return stages[int(name)]
+    except ValueError:
+        pass
+    except IndexError:
+        return None
+    for stage in stages:
+        for word in stage["cmd"].split():
+            if name in (word, os.path.basename(word)):
+                return stage
+    return None
+
+
+def extract_result(extract, stdout, stderr, stages):
+    """Measure a finished run. `extract` is either a regular expression
+    to search for in the output or a table: `{builtin = "wall"}` reports
+    the total wall-clock seconds of the pipeline's `stages`, and
+    `{stage = NAME, field = FIELD}` reports one of the `USAGE_FIELDS` of
+    a single stage.
+    """
+    if isinstance(extract, str):
+        return get_result([stdout.decode(), stderr], extract)
+    elif "stage" in extract:
+        stage = find_stage(stages, extract["stage"])
+        if stage is None:
+            return None
+        value = stage[extract["field"]]
+        return str(value) if isinstance(value, int) else "{:.6f}".format(value)
+    return "{:.6f}".format(sum(stage["wall"] for stage in stages))
+
+
+# Two-sided 95% critical values of Student's t distribution, indexed by
+# degrees of freedom minus one. Beyond the table, use the normal value.
+T_95 = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+)
+
+
+def summarize(samples):
+    """Compute the mean, median, standard deviation, minimum, and a 95%
+    confidence interval for the mean of some numeric samples. Return
+    None if any sample is not a number.
+    """
+    try:
+        values = [float(x) for x in samples]
+    except (TypeError, ValueError):
+        return None
+    n = len(values)
+    mean = statistics.mean(values)
+    stddev = statistics.stdev(values) if n > 1 else 0.0
+    t = T_95[n - 2] if 1 < n <= len(T_95) + 1 else 1.960
+    half = t * stddev / math.sqrt(n)
+    return {
+        "mean": mean,
+        "median": statistics.median(values),
+        "stddev": stddev,
+        "min": min(values),
+        "ci95_low": mean - half,
+        "ci95_high": mean + half,
+    }
+
+
+STAT_COLUMNS = ["mean", "median", "stddev", "min", "ci95_low", "ci95_high"]
+
 
-    # Run pipeline.
-    cmds = [c.format(args=args) for c in pipeline]
-    return run_pipe(cmds, in_data, timeout)
+def format_number(value):
+    """Format a statistic without losing precision: exactly as an integer
+    if it is one, or else as the shortest string that round-trips.
+    """
+    if value.is_integer() and abs(value) < 2**53:
+        return str(int(value))
+    return repr(value)
 
 
 def get_result(strings, extract_re):
@@ -70,81 +863,336 @@ def get_result(strings, extract_re):
     return None
 
 
-@click.command()
+class DefaultGroup(click.Group):
+    """A command group that runs its `run` subcommand when the first
+    argument does not name another one, so `brench CONFIG` still works.
+    """
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands:
+            if args[0] not in ("--help", "--version"):
+                args = ["run"] + args
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup)
+@click.version_option(__version__)
+def brench():
+    """Simple comparative benchmark runner."""
+
+
+@brench.command()
 @click.option(
     "-j",
     "--jobs",
     default=None,
     type=int,
-    help="parallel threads to use (default: suitable for machine)",
+    help="benchmarks to run at once (default: number of CPUs)",
 )
 @click.option("-p", "--plot", is_flag=True, help="plot the results")
+@click.option("--no-cache", is_flag=True, help="do not read or write cached results")
+@click.option(
+    "--refresh",
+    metavar="RUN",
+    multiple=True,
+    help="rerun RUN even if its results are cached (repeatable)",
+)
+@click.option(
+    "--cache-size",
+    default=100,
+    type=int,
+    help="most megabytes of cached results to keep (default: 100)",
+)
+@click.option(
+    "-n",
+    "--trials",
+    default=1,
+    type=click.IntRange(min=1),
+    help="times to run each pipeline and record the result (default: 1)",
+)
+@click.option(
+    "-w",
+    "--warmup",
+    default=0,
+    type=click.IntRange(min=0),
+    help="times to run each pipeline before recording (default: 0)",
+)
+@click.option(
+    "-m",
+    "--metric",
+    metavar="stage:NAME:FIELD",
+    help="report a stage's wall, user, sys, or rss instead of extracting",
+)
+@click.option(
+    "--usage",
+    type=click.File("w"),
+    help="write every stage's resource usage to a JSON lines file",
+)
+@click.option(
+    "--shard",
+    metavar="I/N",
+    help="run only the I-th of N shards of the benchmarks, balanced by cost",
+)
+@click.option(
+    "--costs",
+    type=click.File(),
+    help="JSON file of benchmark durations to balance shards by",
+)
+@click.option(
+    "--out-files",
+    is_flag=True,
+    help="check outputs against each benchmark's .out file, not the first run",
+)
+@click.option(
+    "--diff",
+    is_flag=True,
+    help="rerun incorrect runs and report where their output differs",
+)
+@click.option(
+    "--no-workers",
+    is_flag=True,
+    help="run [passes] in fresh processes, not long-lived workers",
+)
 @click.argument("config_path", metavar="CONFIG", type=click.Path(exists=True))
 @click.argument("files", nargs=-1, type=click.Path(exists=True))
-def brench(config_path, files, jobs, plot):
+def run(
+    config_path,
+    files,
+    jobs,
+    plot,
+    no_cache,
+    refresh,
+    cache_size,
+    trials,
+    warmup,
+    metric,
+    usage,
+    shard,
+    costs,
+    out_files,
+    diff,
+    no_workers,
+):
     """Run a batch of benchmarks and emit a CSV of results."""
     with open(config_path) as f:
         config = tomlkit.loads(f.read())
 
-    # Use configured file list, if none is specified via the CLI.
+    # Use configured file list, if none is specified via the CLI. Sort
+    # it by name, so it comes out the same on every machine.
     if not files and "benchmarks" in config:
         files = glob.glob(config["benchmarks"], recursive=True)
+        files.sort(key=lambda fn: (bench_name(fn), fn))
+    files = [os.path.normpath(fn) for fn in files]
+
+    # Every shard must split the files the same way, so they cannot use
+    # the history on their own machines to do it.
+    if shard:
+        match = re.fullmatch(r"(\d+)/(\d+)", shard)
+        if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+            raise click.BadParameter(
+                "expected I/N with 1 <= I <= N", param_hint="--shard"
+            )
+        try:
+            shard_costs = estimate_costs(files, json.load(costs) if costs else {})
+        except ValueError:
+            raise click.BadParameter("not a JSON file", param_hint="--costs")
+        files = shard_files(files, shard_costs, *map(int, match.groups()))
+
+    # Estimate how long each benchmark takes from past runs.
+    durations_path = os.path.join(default_cache_dir(), "durations")
+    durations = load_durations(durations_path)
+    cost = estimate_costs(files, durations)
 
     timeout = config.get("timeout", 5)
+    # Pass scripts, which can be pipeline stages on their own (`lvn -p`)
+    # or run with Python (`python3 ../examples/lvn.py -p`).
+    passes = {name: str(path) for name, path in config.get("passes", {}).items()}
+    scripts = {os.path.normpath(path) for path in passes.values()}
+
+    def expand(cmd):
+        name, _, rest = cmd.partition(" ")
+        if name in passes:
+            return " ".join(["python3", shlex.quote(passes[name]), rest]).strip()
+        return cmd
+
+    runs = {
+        name: dict(run, pipeline=[expand(cmd) for cmd in run["pipeline"]])
+        for name, run in config["runs"].items()
+    }
+    for name in refresh:
+        if name not in runs:
+            raise click.BadParameter(
+                "no run named {}".format(name), param_hint="--refresh"
+            )
+
+    if metric:
+        kind, _, rest = metric.partition(":")
+        name, _, field = rest.rpartition(":")
+        if kind != "stage" or not name or field not in USAGE_FIELDS:
+            raise click.BadParameter(
+                "expected stage:NAME:FIELD, where FIELD is one of: {}".format(
+                    ", ".join(USAGE_FIELDS)
+                ),
+                param_hint="--metric",
+            )
+        extract = {"stage": name, "field": field}
+    else:
+        extract = config["extract"]
+    if isinstance(extract, str):
+        extract = str(extract)
+    else:
+        extract = {k: str(v) for k, v in extract.items()}
+        if "stage" in extract:
+            if extract.get("field") not in USAGE_FIELDS:
+                raise click.UsageError(
+                    "extract field must be one of: {}".format(", ".join(USAGE_FIELDS))
+                )
+        elif extract.get("builtin") not in BUILTIN_EXTRACTORS:
+            raise click.UsageError(
+                "extract must be a regex, a stage, or a builtin: {}".format(
+                    ", ".join(BUILTIN_EXTRACTORS)
+                )
+            )
+
+    # Measurements go stale, so only cache single runs of a regex.
+    cache = None
+    if not no_cache and trials == 1 and isinstance(extract, str):
+        cache = Cache(default_cache_dir(), cache_size * 1024 * 1024)
 
     rows = []
-    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
-        # Submit jobs.
-        futs = {}
-        for fn in files:
-            for name, run in config["runs"].items():
-                futs[(fn, name)] = pool.submit(run_bench, run["pipeline"], fn, timeout)
+    tree = pipeline_tree(runs)
+
+    async def run_all():
+        # At most `jobs` benchmarks run at once.
+        limit = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+        # A worker's peak memory covers every pass it has run, and its CPU
+        # time leaves out starting Python, so measure stages as fresh
+        # processes instead.
+        pool = None
+        measuring = usage or isinstance(extract, dict) and "stage" in extract
+        if scripts and not no_workers and not measuring:
+            pool = WorkerPool(jobs or os.cpu_count() or 1)
+
+        async def limited(fn):
+            async with limit:
+                start = time.monotonic()
+                results = await run_bench(
+                    tree,
+                    runs,
+                    fn,
+                    timeout,
+                    extract,
+                    cache,
+                    refresh,
+                    trials,
+                    warmup,
+                    pool,
+                    scripts,
+                )
+                # Times with cached results would be misleadingly short.
+                if all(r is None or r["usage"] for r in results.values()):
+                    durations[fn] = time.monotonic() - start
+                return results
+
+        # Start every benchmark, the longest first, so that a slow one
+        # does not start late and hold everything up at the end.
+        tasks = {}
+        for fn in sorted(files, key=lambda fn: -cost[fn]):
+            tasks[fn] = asyncio.ensure_future(limited(fn))
 
         # Collect results and print CSV.
         writer = csv.writer(sys.stdout)
-        writer.writerow(["benchmark", "run", "result"])
+        header = ["benchmark", "run", "result"]
+        if trials > 1:
+            header += STAT_COLUMNS + ["samples"]
+        if shard:
+            header.append("path")  # For `merge` to sort by.
+        writer.writerow(header)
         for fn in files:
-            first_out = None
-            for name in config["runs"]:
-                try:
-                    stdout, stderr = futs[(fn, name)].result()
-                except subprocess.TimeoutExpired:
-                    stdout, stderr = "", ""
+            results = await tasks[fn]
+
+            # Check against the expected output, or else the first run.
+            first_out = golden = None
+            if out_files:
+                golden = os.path.splitext(fn)[0] + ".out"
+                first_out = file_digest(golden)
+                if first_out is None:
+                    golden = None
+            for name in runs:
+                record = results[name]
+                if record is None:
+                    record = {"digest": digest(""), "result": None}
                     status = "timeout"
                 else:
                     status = None
 
                 # Check correctness.
                 if first_out is None:
-                    first_out = stdout
-                elif stdout != first_out and not status:
+                    first_out = record["digest"]
+                    golden = name
+                elif record["digest"] != first_out and not status:
                     status = "incorrect"
+                    if diff:
+                        where = await locate_diff(fn, runs, name, golden, timeout)
+                        msg = "{}: {} differs from {}: {}"
+                        click.echo(msg.format(fn, name, golden, where), err=True)
 
-                # Extract the figure of merit.
-                result = get_result([stdout, stderr], config["extract"])
+                # The extracted figure of merit.
+                result = record["result"]
                 if not result and not status:
                     status = "missing"
 
                 # Report the result.
-                bench, _ = os.path.splitext(os.path.basename(fn))
+                bench = bench_name(fn)
                 row = [bench, name, status if status else result]
-                writer.writerow(row)
+                if trials > 1:
+                    stats = None if status else summarize(record["samples"])
+                    if stats:
+                        row[2] = format_number(stats["median"])
+                        row += [format_number(stats[c]) for c in STAT_COLUMNS]
+                    else:
+                        row += [""] * len(STAT_COLUMNS)
+                    row.append("" if status else " ".join(record["samples"]))
+                writer.writerow(row + [fn] if shard else row)
                 rows.append(row)
 
+                # Log the resources each stage used.
+                if usage and not status:
+                    for trial, stages in enumerate(record["usage"]):
+                        for i, stage in enumerate(stages):
+                            entry = {
+                                "benchmark": bench,
+                                "run": name,
+                                "trial": trial,
+                                "stage": i,
+                                "cmd": stage["cmd"],
+                            }
+                            entry.update((f, stage[f]) for f in USAGE_FIELDS)
+                            usage.write(json.dumps(entry) + "\n")
+
+        if pool:
+            await pool.close()
+
+    asyncio.run(run_all())
+    save_durations(durations_path, durations)
+
+    if cache is not None:
+        cache.evict()
+
     if plot:
         import matplotlib.pyplot as plt
         import numpy as np
 
         def parse(x):
             try:
-                return int(x)
+                return float(x)
             except ValueError:
                 return 0
 
         # Group the rows
         # {kind: {benchmark: result}}
         data = {}
-        for bench, kind, result in rows:
+        for bench, kind, result, *_ in rows:
             data.setdefault(kind, {})[bench] = parse(result)
 
         # Sort the benchmarks by the first kind
@@ -172,5 +1220,231 @@ def brench(config_path, files, jobs, plot):
         plt.show()
 
 
+@brench.command()
+@click.argument("shards", nargs=-1, required=True, type=click.File())
+def merge(shards):
+    """Combine the CSVs from several shards of a run into one, in the
+    order one run over all the benchmarks would have produced.
+    """
+    header = None
+    rows = []
+    for f in shards:
+        reader = csv.reader(f)
+        shard_header = next(reader, None)
+        if header is None:
+            header = shard_header
+        elif shard_header != header:
+            raise click.ClickException(
+                "{} has different columns than {}".format(f.name, shards[0].name)
+            )
+        rows += list(reader)
+    if not header or header[-1] != "path":
+        raise click.ClickException("not the output of brench --shard")
+
+    # Put the benchmarks in the order of a run over a glob, by name and
+    # then path, and drop the paths. Each benchmark's runs stay in their
+    # original order.
+    rows.sort(key=lambda row: (row[0], row[-1]))
+    writer = csv.writer(sys.stdout)
+    writer.writerow(header[:-1])
+    writer.writerows(row[:-1] for row in rows)
+
+
+@brench.command(hidden=True)
+def worker():
+    """Serve pass requests for a worker pool."""
+    serve_passes()
+
+
+def load_results(f):
+    """Load benchmark results from a brench CSV or from a JSON list of
+    objects with the same fields (where `samples` can be a list). Return
+    a dictionary mapping (benchmark, run) pairs to lists of numeric
+    samples, or to the status (like `timeout`) for results that are not
+    numbers.
+    """
+    if f.name.endswith(".json"):
+        rows = json.load(f)
+    else:
+        rows = list(csv.DictReader(f))
+
+    results = {}
+    for row in rows:
+        samples = row.get("samples") or [row["result"]]
+        if isinstance(samples, str):
+            samples = samples.split()
+        try:
+            values = [float(x) for x in samples]
+        except (TypeError, ValueError):
+            values = str(row["result"])
+        results[row["benchmark"], row["run"]] = values
+    return results
+
+
+def percentiles(values, low=0.025, high=0.975):
+    values = sorted(values)
+    return (
+        values[int(low * (len(values) - 1))],
+        values[int(high * (len(values) - 1))],
+    )
+
+
+def resample(rng, values):
+    """Draw a bootstrap resample: as many values, with replacement."""
+    return [rng.choice(values) for _ in values]
+
+
+def bootstrap_ratio(rng, base, cur, iterations):
+    """The ratio of the means of two sets of samples, with a bootstrap
+    95% confidence interval.
+    """
+    ratios = [
+        statistics.mean(resample(rng, cur)) / statistics.mean(resample(rng, base))
+        for _ in range(iterations)
+    ]
+    return statistics.mean(cur) / statistics.mean(base), percentiles(ratios)
+
+
+def bootstrap_geomean(rng, pairs, iterations):
+    """The geometric mean of the ratios of some (baseline, current) sample
+    pairs, with a bootstrap 95% confidence interval that resamples both
+    the benchmarks and each one's samples.
+    """
+    geomeans = []
+    for _ in range(iterations):
+        geomeans.append(
+            statistics.geometric_mean(
+                statistics.mean(resample(rng, cur))
+                / statistics.mean(resample(rng, base))
+                for base, cur in resample(rng, pairs)
+            )
+        )
+    ratio = statistics.geometric_mean(
+        statistics.mean(cur) / statistics.mean(base) for base, cur in pairs
+    )
+    return ratio, percentiles(geomeans)
+
+
+@brench.command()
+@click.option(
+    "-t",
+    "--threshold",
+    default=0.05,
+    type=click.FloatRange(min=0),
+    help="smallest slowdown that counts as a regression (default: 0.05)",
+)
+@click.option(
+    "--iterations",
+    default=1000,
+    type=click.IntRange(min=1),
+    help="bootstrap resamples for confidence intervals (default: 1000)",
+)
+@click.option("--seed", default=0, type=int, help="bootstrap random seed")
+@click.option("-a", "--all", "show_all", is_flag=True, help="list every benchmark")
+@click.argument("baseline", type=click.File())
+@click.argument("current", type=click.File())
+def compare(baseline, current, threshold, iterations, seed, show_all):
+    """Compare results against a baseline and fail on regressions.
+
+    Reads a BASELINE and a CURRENT result file (CSV from brench, or JSON)
+    and prints a Markdown summary. Results are costs, where lower is
+    better. Exits with status 1 if any run regressed (or a benchmark
+    failed or vanished), or else with status 2 if some results could not
+    be compared because they are not positive.
+    """
+    rng = random.Random(seed)
+    try:
+        base_results = load_results(baseline)
+        cur_results = load_results(current)
+    except (KeyError, ValueError) as exc:
+        print("error: malformed results: {}".format(exc), file=sys.stderr)
+        sys.exit(2)
+
+    # Compare every benchmark that both have, by run.
+    runs = {}
+    problems = []
+    bad = []
+    for key, cur in cur_results.items():
+        base = base_results.get(key)
+        if base is None:
+            continue
+        bench, run = key
+        runs.setdefault(run, [])
+        if isinstance(base, str):
+            continue
+        if isinstance(cur, str):
+            problems.append((bench, run, cur))
+        elif min(base) <= 0 or min(cur) <= 0:
+            # Ratios need positive costs.
+            bad.append((bench, run, "not positive"))
+        else:
+            runs[run].append((bench, base, cur))
+    for (bench, run), base in base_results.items():
+        if (bench, run) not in cur_results and not isinstance(base, str):
+            problems.append((bench, run, "vanished"))
+
+    regressed = bool(problems)
+    limit = 1 + threshold
+
+    def flag(ci):
+        nonlocal regressed
+        if ci[0] > limit:
+            regressed = True
+            return "**regression**"
+        elif ci[1] < 1 / limit:
+            return "improvement"
+        return ""
+
+    print("| run | benchmarks | geomean ratio | 95% CI | |")
+    print("|---|---:|---:|---|---|")
+    details = []
+    for run, entries in runs.items():
+        if not entries:
+            print("| {} | 0 | | | |".format(run))
+            continue
+        pairs = [(base, cur) for _, base, cur in entries]
+        ratio, ci = bootstrap_geomean(rng, pairs, iterations)
+        print(
+            "| {} | {} | {:.3f} | {:.3f}–{:.3f} | {} |".format(
+                run, len(entries), ratio, ci[0], ci[1], flag(ci)
+            )
+        )
+        for bench, base, cur in entries:
+            ratio, ci = bootstrap_ratio(rng, base, cur, iterations)
+            note = flag(ci)
+            if note or show_all:
+                details.append((run, bench, base, cur, ratio, ci, note))
+
+    if details:
+        print()
+        print("| run | benchmark | baseline | current | ratio | 95% CI | |")
+        print("|---|---|---:|---:|---:|---|---|")
+        for run, bench, base, cur, ratio, ci, note in details:
+            print(
+                "| {} | {} | {} | {} | {:.3f} | {:.3f}–{:.3f} | {} |".format(
+                    run,
+                    bench,
+                    format_number(statistics.mean(base)),
+                    format_number(statistics.mean(cur)),
+                    ratio,
+                    ci[0],
+                    ci[1],
+                    note,
+                )
+            )
+
+    if problems or bad:
+        print()
+        print("| run | benchmark | status |")
+        print("|---|---|---|")
+        for bench, run, status in problems + bad:
+            print("| {} | {} | {} |".format(run, bench, status))
+
+    if regressed:
+        sys.exit(1)
+    elif bad:
+        sys.exit(2)
+
+
 if __name__ == "__main__":
     brench()
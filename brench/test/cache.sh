@@ -0,0 +1,22 @@
+# A second run comes from the cache until the config changes or a run is
+# refreshed.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+export XDG_CACHE_HOME="$tmp/cache"
+cat > "$tmp/cache.toml" <<TOML
+benchmarks = '$PWD/bench/[fs][au]*.bril'
+extract = 'total_dyn_inst: (\d+)'
+
+[runs.baseline]
+pipeline = ["bril2json", "sh -c 'echo ran >> $tmp/log; cat'", "brili -p {args}"]
+TOML
+for i in 1 2; do
+  brench "$tmp/cache.toml" | sort
+  echo "ran $(wc -l < "$tmp/log") times"
+done
+brench --refresh baseline "$tmp/cache.toml" > /dev/null
+echo "ran $(wc -l < "$tmp/log") times after --refresh"
+sed -i 's/brili -p/brili  -p/' "$tmp/cache.toml"
+brench "$tmp/cache.toml" > /dev/null
+echo "ran $(wc -l < "$tmp/log") times after changing a command"
+rm -r "$tmp"
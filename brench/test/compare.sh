@@ -0,0 +1,32 @@
+# Regressions exit with status 1, and results that cannot be compared
+# with status 2.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+cat > "$tmp/base.csv" <<CSV
+benchmark,run,result
+fact,opt,100
+sum,opt,100
+loop,opt,100
+CSV
+cat > "$tmp/same.csv" <<CSV
+benchmark,run,result
+fact,opt,100
+sum,opt,100
+loop,opt,100
+CSV
+cat > "$tmp/slower.csv" <<CSV
+benchmark,run,result
+fact,opt,200
+sum,opt,100
+CSV
+cat > "$tmp/zero.csv" <<CSV
+benchmark,run,result
+fact,opt,100
+sum,opt,50
+loop,opt,0
+CSV
+for cur in same slower zero; do
+  brench compare "$tmp/base.csv" "$tmp/$cur.csv"
+  echo "$cur: exit $?"
+done
+rm -r "$tmp"
@@ -0,0 +1,22 @@
+# Merging the shards of a run gives the same CSV as running everything,
+# in the same order, even with two benchmarks of the same name.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+cat > "$tmp/merge.toml" <<TOML
+benchmarks = '$PWD/bench/**/*.bril'
+extract = 'total_dyn_inst: (\d+)'
+
+[runs.baseline]
+pipeline = ["bril2json", "brili -p {args}"]
+
+[runs.again]
+pipeline = ["bril2json", "brili -p {args}"]
+TOML
+for i in 1 2 3; do
+  brench --no-cache --shard $i/3 "$tmp/merge.toml" > "$tmp/$i.csv"
+  echo "shard $i: $(tail -n +2 "$tmp/$i.csv" | cut -d, -f1,3 | tr '\r\n' '  ')"
+done
+brench merge "$tmp/3.csv" "$tmp/2.csv" "$tmp/1.csv" > "$tmp/merged.csv"
+cat "$tmp/merged.csv"
+brench --no-cache "$tmp/merge.toml" | cmp - "$tmp/merged.csv" && echo same
+rm -r "$tmp"
@@ -0,0 +1,22 @@
+# A run whose output differs is incorrect, whether it is checked against
+# the first run or against a .out file, and --diff says where it differs.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+cat > "$tmp/outfiles.toml" <<TOML
+benchmarks = '$PWD/bench/[fs][au]*.bril'
+extract = 'total_dyn_inst: (\d+)'
+
+[runs.baseline]
+pipeline = ["bril2json", "brili -p {args}"]
+
+[runs.broken]
+pipeline = ["sed s/mul/add/", "bril2json", "brili -p {args}"]
+TOML
+for flags in "" "--out-files"; do
+  echo "flags: $flags"
+  brench --no-cache -j 1 --diff $flags "$tmp/outfiles.toml" \
+    > "$tmp/out.csv" 2> "$tmp/err.txt"
+  sort "$tmp/out.csv"
+  sed "s|$PWD/||g" "$tmp/err.txt"
+done
+rm -r "$tmp"
@@ -0,0 +1 @@
+COUNT = 10
@@ -0,0 +1,23 @@
+# Runs that start with the same stages share them, so the common prefix
+# runs once per benchmark.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+cat > "$tmp/share.toml" <<TOML
+benchmarks = '$PWD/bench/[fs][au]*.bril'
+extract = 'total_dyn_inst: (\d+)'
+
+[runs.plain]
+pipeline = ["bril2json", "sh -c 'echo ran >> $tmp/log; cat'", "brili -p {args}"]
+
+[runs.roundtrip]
+pipeline = [
+  "bril2json",
+  "sh -c 'echo ran >> $tmp/log; cat'",
+  "bril2txt",
+  "bril2json",
+  "brili -p {args}",
+]
+TOML
+brench --no-cache "$tmp/share.toml" | sort
+echo "prefix ran $(wc -l < "$tmp/log") times"
+rm -r "$tmp"
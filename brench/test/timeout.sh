@@ -0,0 +1,18 @@
+# A stage that runs past the timeout is killed, and the run is a timeout.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+cat > "$tmp/timeout.toml" <<TOML
+benchmarks = '$PWD/bench/slow.bril'
+extract = 'total_dyn_inst: (\d+)'
+timeout = 1
+
+[runs.fast]
+pipeline = ["bril2json", "brili -p {args}"]
+
+[runs.slow]
+pipeline = ["bril2json", "sh -c 'sleep 30; cat'", "brili -p {args}"]
+TOML
+start=$(date +%s)
+brench --no-cache "$tmp/timeout.toml" | sort
+[ $(($(date +%s) - start)) -lt 20 ] && echo "killed in time"
+rm -r "$tmp"
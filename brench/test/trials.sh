@@ -0,0 +1,24 @@
+# Several trials give the median as the result, summary statistics, and
+# every sample, after throwing away the warmup runs.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+cat > "$tmp/trials.toml" <<TOML
+benchmarks = '$PWD/bench/[fs][au]*.bril'
+extract = 'total_dyn_inst: (\d+)'
+
+[runs.baseline]
+pipeline = ["bril2json", "sh -c 'echo ran >> $tmp/log; cat'", "brili -p {args}"]
+TOML
+brench --no-cache -n 3 -w 1 "$tmp/trials.toml" | sort
+echo "ran $(wc -l < "$tmp/log") times"
+
+# Wall-clock times vary, so only check which columns hold numbers.
+cat > "$tmp/wall.toml" <<TOML
+benchmarks = '$PWD/bench/fact.bril'
+extract = { builtin = "wall" }
+
+[runs.baseline]
+pipeline = ["bril2json", "brili {args}"]
+TOML
+brench -n 2 "$tmp/wall.toml" | sed -E '2,$ s/-?[0-9][0-9.e+-]*/N/g'
+rm -r "$tmp"
@@ -0,0 +1,25 @@
+# --usage writes a record for each stage, and --metric reports one
+# stage's usage. The numbers vary, so only check their shape.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+cat > "$tmp/usage.toml" <<TOML
+benchmarks = '$PWD/bench/fact.bril'
+extract = 'total_dyn_inst: (\d+)'
+
+[runs.baseline]
+pipeline = ["bril2json", "brili -p {args}"]
+TOML
+brench --no-cache --usage "$tmp/usage.jsonl" "$tmp/usage.toml"
+python3 - "$tmp/usage.jsonl" <<PY
+import json, sys
+for line in open(sys.argv[1]):
+    record = json.loads(line)
+    print(sorted(record))
+    print(record["benchmark"], record["run"], record["trial"],
+          record["stage"], record["cmd"])
+PY
+for metric in stage:brili:rss stage:0:user stage:-1:wall stage:nope:sys; do
+  echo "$metric"
+  brench --no-cache -m $metric "$tmp/usage.toml" | sed -E 's/,[0-9][^,]*$/,N/'
+done
+rm -r "$tmp"
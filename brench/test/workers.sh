@@ -0,0 +1,34 @@
+# Passes give the same results in workers as in separate processes, even
+# when two pass directories have modules with the same name, and stages
+# are measured in separate processes.
+cd "$(dirname "$0")"
+tmp=$(mktemp -d)
+export MARK_LOG="$tmp/log"
+cat > "$tmp/workers.toml" <<TOML
+benchmarks = '$PWD/bench/[fs][au]*.bril'
+extract = 'total_dyn_inst: (\d+)'
+
+[passes]
+left = '$PWD/passes/left/mark.py'
+right = '$PWD/passes/right/mark.py'
+
+[runs.left]
+pipeline = ["bril2json", "left", "brili -p {args}"]
+
+[runs.right]
+pipeline = ["bril2json", "python3 $PWD/passes/right/mark.py", "brili -p {args}"]
+
+[runs.both]
+pipeline = ["bril2json", "left", "right", "left", "brili -p {args}"]
+TOML
+brench --no-cache -j 1 "$tmp/workers.toml" | sort > "$tmp/workers.csv"
+cat "$tmp/workers.csv"
+echo "workers: $(sort -u "$tmp/log" | wc -l) process(es)"
+rm "$tmp/log"
+brench --no-cache -j 1 --no-workers "$tmp/workers.toml" | sort |
+  cmp - "$tmp/workers.csv" && echo "same without workers"
+echo "no workers: $(sort -u "$tmp/log" | wc -l) processes"
+rm "$tmp/log"
+brench --no-cache -j 1 -m stage:mark.py:rss "$tmp/workers.toml" > /dev/null
+echo "measuring: $(sort -u "$tmp/log" | wc -l) processes"
+rm -r "$tmp"
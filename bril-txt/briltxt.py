@@ -5,11 +5,20 @@ human-editable representation of Bril programs. There are two commands:
 `bril2txt`, which takes a Bril program in its (canonical) JSON format and
 pretty-prints it in the text format, and `bril2json`, which parses the
 format and emits the ordinary JSON representation.
+
+It also has a linker for programs that use the import extension. The
+`brillink` command reads a Bril file (text or JSON), finds all the modules
+it imports, and emits a single JSON program with no imports.
 """
 
 import lark
 import sys
 import json
+import argparse
+import hashlib
+import os
+import re
+import tempfile
 
 __version__ = '0.0.1'
 
@@ -17,7 +26,10 @@ __version__ = '0.0.1'
 # Text format parser.
 
 GRAMMAR = r"""
-start: (struct | func)*
+start: (imp | struct | func)*
+
+imp: "from" ESCAPED_STRING "import" imp_func ("," imp_func)* ";"
+imp_func: FUNC ["as" FUNC]
 
 struct: STRUCT IDENT "=" "{" mbr* "}"
 mbr: IDENT ":" type ";"
@@ -54,6 +66,7 @@ LABEL: "." IDENT
 COMMENT: /#.*/
 
 
+%import common.ESCAPED_STRING
 %import common.SIGNED_INT
 %import common.SIGNED_FLOAT
 %import common.WS
@@ -86,17 +99,29 @@ class JSONTransformer(lark.Transformer):
         self.include_pos = include_pos
 
     def start(self, items):
+        imports = [i for i in items if 'path' in i]
         structs = [i for i in items if 'mbrs' in i]
-        funcs = [i for i in items if 'mbrs' not in i]
+        funcs = [i for i in items if 'instrs' in i]
+        out = {'functions': funcs}
         if structs:
-            return {
-                'structs': structs,
-                'functions': funcs,
-            }
-        else:
-            return {
-                'functions': funcs,
-            }
+            out['structs'] = structs
+        if imports:
+            out['imports'] = imports
+        return out
+
+    def imp(self, items):
+        path = items.pop(0)
+        return {
+            'path': json.loads(str(path)),
+            'functions': items,
+        }
+
+    def imp_func(self, items):
+        name, alias = items
+        out = {'name': str(name)[1:]}  # Strip `@`.
+        if alias:
+            out['alias'] = str(alias)[1:]
+        return out
 
     def func(self, items):
         name, args, typ = items[:3]
@@ -230,14 +255,27 @@ class JSONTransformer(lark.Transformer):
         return value
 
 
+_parser = None
+
+
+def parse_program(txt, include_pos=False):
+    """Parse a Bril program and return its JSON data.
+
+    Optionally include source position information.
+    """
+    global _parser
+    if _parser is None:
+        _parser = lark.Lark(GRAMMAR, maybe_placeholders=True)
+    tree = _parser.parse(txt)
+    return JSONTransformer(include_pos).transform(tree)
+
+
 def parse_bril(txt, include_pos=False):
     """Parse a Bril program and return a JSON string.
 
     Optionally include source position information.
     """
-    parser = lark.Lark(GRAMMAR, maybe_placeholders=True)
-    tree = parser.parse(txt)
-    data = JSONTransformer(include_pos).transform(tree)
+    data = parse_program(txt, include_pos)
     return json.dumps(data, indent=2, sort_keys=True)
 
 
@@ -328,11 +366,203 @@ def print_func(func):
     print('}')
 
 
+def print_import(imp):
+    print('from {} import {};'.format(
+        json.dumps(imp['path']),
+        ', '.join(
+            '@{} as @{}'.format(f['name'], f['alias']) if 'alias' in f
+            else '@{}'.format(f['name'])
+            for f in imp['functions']
+        ),
+    ))
+
+
 def print_prog(prog):
+    for imp in prog.get('imports', []):
+        print_import(imp)
     for func in prog['functions']:
         print_func(func)
 
 
+# Linking.
+
+class LinkError(Exception):
+    """A problem with a program's imports."""
+
+
+def default_cache_dir():
+    """Get the directory where `brillink` caches parsed modules."""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'bril', 'modules')
+
+
+def load_module(path, cache_dir=None):
+    """Load a Bril program from a `.json` or `.bril` file.
+
+    With a `cache_dir`, parsed text files are stored there under a hash
+    of their contents, so a file that has not changed is parsed only once.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.json'):
+        return json.loads(data.decode())
+    if not path.endswith('.bril'):
+        raise LinkError('unknown file extension: {}'.format(path))
+    if cache_dir is None:
+        return parse_program(data.decode())
+
+    # The grammar is part of the key so that changing it invalidates
+    # old entries.
+    key = hashlib.sha256(GRAMMAR.encode() + b'\0' + data).hexdigest()
+    cache_path = os.path.join(cache_dir, key + '.json')
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    program = parse_program(data.decode())
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(program, f)
+        os.replace(tmp, cache_path)
+    except OSError:
+        pass  # The cache is only an optimization.
+    return program
+
+
+def _module_prefix(path):
+    """Make a function-name prefix for the module at `path`."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stem = re.sub(r'[^A-Za-z0-9_]', '_', stem)
+    if not stem or stem[0].isdigit():
+        stem = '_' + stem
+    return stem + '.'
+
+
+class Linker:
+    """Combine a program and every module it imports, directly or
+    indirectly, into one program without imports.
+
+    An import's path is looked up relative to the directory of the file
+    that contains it and then in each of the `libs` directories. The
+    top-level program keeps its function names; functions from imported
+    modules get their module's name as a prefix, like `lib.func`. Each
+    module is loaded once, no matter how many modules import it, and
+    modules may import each other in cycles.
+    """
+
+    def __init__(self, libs=(), cache_dir=None):
+        self.libs = list(libs)
+        self.cache_dir = cache_dir
+        self.modules = {}  # Canonical path -> original name -> new name.
+        self.taken = set()
+        self.functions = []
+        self.structs = {}
+
+    def link(self, program, path):
+        """Link `program`, which was loaded from the file at `path`, and
+        return the combined program.
+        """
+        self.add(program, os.path.realpath(path), '')
+        out = {'functions': self.functions}
+        if self.structs:
+            out['structs'] = list(self.structs.values())
+        return out
+
+    def fresh(self, name):
+        """Claim an unused function name, starting with `name`."""
+        new = name
+        i = 2
+        while new in self.taken:
+            new = '{}.{}'.format(name, i)
+            i += 1
+        self.taken.add(new)
+        return new
+
+    def locate(self, path, importer):
+        """Find the canonical path of the module that `importer` refers to
+        as `path`.
+        """
+        dirs = [os.path.dirname(importer)] + self.libs
+        for d in dirs:
+            candidate = os.path.join(d, path)
+            if os.path.isfile(candidate):
+                return os.path.realpath(candidate)
+        raise LinkError('module "{}" not found (imported from {})'.format(
+            path, importer,
+        ))
+
+    def add(self, program, path, prefix):
+        """Add a module and, recursively, everything it imports."""
+        names = {}
+        for func in program['functions']:
+            if func['name'] in names:
+                raise LinkError('function @{} defined twice in {}'.format(
+                    func['name'], path,
+                ))
+            names[func['name']] = self.fresh(prefix + func['name'])
+
+        # Register the module before visiting its imports so that a cycle
+        # back to it finds its names instead of loading it again.
+        self.modules[path] = names
+
+        for struct in program.get('structs', []):
+            old = self.structs.setdefault(struct['name'], struct)
+            if old != struct:
+                raise LinkError('conflicting definitions of struct {}'.format(
+                    struct['name'],
+                ))
+
+        scope = dict(names)
+        for imp in program.get('imports', []):
+            target = self.locate(imp['path'], path)
+            if target not in self.modules:
+                self.add(load_module(target, self.cache_dir), target,
+                         _module_prefix(target))
+            exported = self.modules[target]
+            for func in imp['functions']:
+                if func['name'] not in exported:
+                    raise LinkError('{} has no function @{}'.format(
+                        imp['path'], func['name'],
+                    ))
+                local = func.get('alias', func['name'])
+                if local in scope:
+                    raise LinkError('@{} is defined twice in {}'.format(
+                        local, path,
+                    ))
+                scope[local] = exported[func['name']]
+
+        for func in program['functions']:
+            self.functions.append(self.rename(func, scope, path))
+
+    def rename(self, func, scope, path):
+        """Rename a function and the functions it calls according to
+        `scope`.
+        """
+        instrs = []
+        for instr in func['instrs']:
+            if 'funcs' in instr:
+                instr = dict(instr)
+                try:
+                    instr['funcs'] = [scope[f] for f in instr['funcs']]
+                except KeyError as exc:
+                    raise LinkError('undefined function @{} in {}'.format(
+                        exc.args[0], path,
+                    ))
+            instrs.append(instr)
+        return dict(func, name=scope[func['name']], instrs=instrs)
+
+
+def link_file(path, libs=(), cache_dir=None):
+    """Load the program at `path` and link it with its imports."""
+    program = load_module(path, cache_dir)
+    return Linker(libs, cache_dir).link(program, path)
+
+
 # Command-line entry points.
 
 def bril2json():
@@ -341,3 +571,23 @@ def bril2json():
 
 def bril2txt():
     print_prog(json.load(sys.stdin))
+
+
+def brillink():
+    parser = argparse.ArgumentParser(
+        description='Link a Bril program with the modules it imports.',
+    )
+    parser.add_argument('file', help='a .bril or .json program')
+    parser.add_argument('-l', '--libs', nargs='*', default=[],
+                        help='directories to search for imported modules')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always parse imported text files')
+    opts = parser.parse_args()
+
+    cache_dir = None if opts.no_cache else default_cache_dir()
+    try:
+        program = link_file(opts.file, opts.libs, cache_dir)
+    except (LinkError, OSError) as exc:
+        print('error: {}'.format(exc), file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(program, indent=2, sort_keys=True))
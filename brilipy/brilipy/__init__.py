@@ -0,0 +1,81 @@
+"""A Bril interpreter in Python, for running programs in-process.
+"""
+import sys
+import threading
+from io import StringIO
+
+from .interp import BrilError, Interpreter
+from .bytecode import Machine
+from .pycompile import Program
+from .profile import Profiler
+
+__version__ = '0.1.0'
+
+# Ways to execute a program. Each takes a program and an output stream
+# and has a `run(args)` method that returns the dynamic instruction count.
+BACKENDS = {
+    'closure': Interpreter,
+    'bytecode': Machine,
+    'python': Program,
+}
+
+
+# Every backend implements a Bril `call` with a Python call, so deeply
+# recursive Bril programs need a deep Python stack.
+RECURSION_LIMIT = 1000000
+STACK_SIZE = 512 * 1024 * 1024
+
+
+def deep_stack(fn, *args):
+    """Call `fn(*args)` on a thread with a stack big enough for deeply
+    recursive Bril programs, and return its result (or raise its
+    exception).
+    """
+    result = []
+    error = []
+
+    def target():
+        try:
+            result.append(fn(*args))
+        except BaseException as exc:
+            error.append(exc)
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    size = threading.stack_size(STACK_SIZE)
+    try:
+        thread = threading.Thread(target=target)
+        thread.start()
+    finally:
+        threading.stack_size(size)
+    try:
+        thread.join()
+    finally:
+        sys.setrecursionlimit(limit)
+    if error:
+        raise error[0]
+    return result[0]
+
+
+def run(program, args=(), backend='closure'):
+    """Run a Bril program (as parsed JSON). Return the `print` output as a
+    string and a dictionary of counts, currently just `total_dyn_inst`.
+    """
+    out = StringIO()
+    count = deep_stack(BACKENDS[backend](program, out).run, list(args))
+    return out.getvalue(), {'total_dyn_inst': count}
+
+
+def profile(program, args=()):
+    """Run a Bril program like `run`, and also return its block, edge,
+    and call-site profile (see `profile.py`).
+    """
+    out = StringIO()
+    profiler = Profiler(program, out)
+    count = deep_stack(profiler.run, list(args))
+    return out.getvalue(), {'total_dyn_inst': count}, profiler.result()
+
+
+from .cli import main  # noqa: E402
+
+__all__ = ['BrilError', 'BACKENDS', 'run', 'profile', 'main']
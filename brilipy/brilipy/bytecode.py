@@ -0,0 +1,628 @@
+"""A register bytecode backend for the Python Bril interpreter.
+
+Each function is compiled to a flat `array('q')` of small integers.
+Variables become slots in a per-call register list, labels become code
+offsets, and constants live in a per-function pool. Every instruction is
+an opcode followed by its operands; the dispatch loop in `Machine.execute`
+decodes them with a chain of integer comparisons, ordered so that the
+most frequent instructions come first.
+
+Unset slots hold None. Reads of variables that might be undefined,
+according to a static analysis, are preceded by a `CHECK` instruction,
+so well-formed code pays nothing for them.
+
+Common instruction pairs get *superinstructions*. A comparison whose
+result is immediately used by a `br` becomes a single compare-and-branch
+instruction (which still writes the comparison's destination).
+
+The semantics are the same as `interp.py`'s, including the dynamic
+instruction count, which counts each superinstruction as the two Bril
+instructions it replaces.
+"""
+import sys
+from array import array
+
+from .interp import (
+    BrilError, Heap, Pointer, ARG_COUNTS, INT_MIN, INT_MAX,
+    wrap, trunc_div, float_div, format_value, const_value, int2char,
+    parse_arg, undefined_reads, _utf16,
+)
+
+# Opcodes. Operands are register slots (r), constant pool indices (k),
+# code offsets (t), function indices (f), label numbers (l), or counts
+# (n). The dispatch loop relies on the numbering to test some groups of
+# opcodes with a single range comparison.
+ID = 0            # ID rd ra
+CONST = 1         # CONST rd k
+ADD = 2           # ADD rd ra rb
+SUB = 3
+MUL = 4
+JMP = 5           # JMP t
+BR = 6            # BR ra t t
+LT_BR = 7         # LT_BR rd ra rb t t
+LE_BR = 8
+GT_BR = 9
+GE_BR = 10
+EQ_BR = 11
+DIV = 12          # DIV rd ra rb
+LT = 13           # LT rd ra rb
+LE = 14
+GT = 15
+GE = 16
+EQ = 17
+NOT = 18          # NOT rd ra
+AND = 19          # AND rd ra rb
+OR = 20
+LOAD = 21         # LOAD rd rp
+STORE = 22        # STORE rp ra
+PTRADD = 23       # PTRADD rd rp ra
+CALL = 24         # CALL rd f n r...  (rd = -1 for no result)
+RET = 25          # RET ra  (ra = -1 for no value)
+PRINT = 26        # PRINT n r...
+PHI = 27          # PHI rd n (l r)...
+LABEL = 28        # LABEL l  (only in functions with phi-nodes)
+FADD = 29         # FADD rd ra rb
+FSUB = 30
+FMUL = 31
+FDIV = 32
+FLT = 33
+FLE = 34
+FGT = 35
+FGE = 36
+FEQ = 37
+ALLOC = 38        # ALLOC rd ra
+FREE = 39         # FREE rp
+NOP = 40
+CEQ = 41          # CEQ rd ra rb
+CLT = 42
+CLE = 43
+CGT = 44
+CGE = 45
+CHAR2INT = 46     # CHAR2INT rd ra
+INT2CHAR = 47
+SPECULATE = 48
+COMMIT = 49
+GUARD = 50        # GUARD ra t
+ERROR = 51        # ERROR k  (report the message in the constant pool)
+END = 52          # Fall off the end of the function.
+CHECK = 53        # CHECK ra k  (fail with message k if ra is undefined)
+
+SIMPLE_OPS = {
+    'add': ADD, 'sub': SUB, 'mul': MUL, 'div': DIV,
+    'lt': LT, 'le': LE, 'gt': GT, 'ge': GE, 'eq': EQ,
+    'and': AND, 'or': OR,
+    'fadd': FADD, 'fsub': FSUB, 'fmul': FMUL, 'fdiv': FDIV,
+    'flt': FLT, 'fle': FLE, 'fgt': FGT, 'fge': FGE, 'feq': FEQ,
+    'ceq': CEQ, 'clt': CLT, 'cle': CLE, 'cgt': CGT, 'cge': CGE,
+    'ptradd': PTRADD,
+    'id': ID, 'not': NOT, 'char2int': CHAR2INT, 'int2char': INT2CHAR,
+    'load': LOAD, 'alloc': ALLOC,
+    'store': STORE, 'free': FREE,
+    'nop': NOP, 'speculate': SPECULATE, 'commit': COMMIT,
+}
+
+# Comparisons that fuse with a following `br`.
+COMPARE_BRANCH = {
+    'lt': LT_BR, 'le': LE_BR, 'gt': GT_BR, 'ge': GE_BR, 'eq': EQ_BR,
+}
+
+LABEL_COUNTS = {'jmp': 1, 'br': 2, 'guard': 1}
+
+
+class Code(object):
+    """A compiled function: its bytecode, constant pool, and frame
+    layout.
+    """
+
+    def __init__(self, func):
+        self.name = func['name']
+        self.type = func.get('type')
+        self.param_types = [a['type'] for a in func.get('args', [])]
+        self.nparams = len(self.param_types)
+        self.code = array('q')
+        self.consts = []
+        self.nslots = 0
+        self.slot_names = []
+
+
+class Compiler(object):
+    """Compile one function to bytecode. `duplicates` holds the names of
+    the functions that are defined more than once.
+    """
+
+    def __init__(self, func, func_index, funcs, duplicates):
+        self.func = func
+        self.func_index = func_index
+        self.funcs = funcs
+        self.duplicates = duplicates
+        self.out = Code(func)
+        self.slots = {}
+        self.label_nums = {}
+        self.label_offsets = {}
+        self.fixups = []  # (code position, label name)
+        for arg in func.get('args', []):
+            self.slot(arg['name'])
+
+    def slot(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+        return self.slots[name]
+
+    def const(self, value):
+        self.out.consts.append(value)
+        return len(self.out.consts) - 1
+
+    def label_num(self, name):
+        return self.label_nums.setdefault(name, len(self.label_nums))
+
+    def emit(self, *words):
+        self.out.code.extend(words)
+
+    def emit_target(self, label):
+        self.fixups.append((len(self.out.code), label))
+        self.out.code.append(-1)
+
+    def error(self, message):
+        self.emit(ERROR, self.const(message))
+
+    def check(self, names):
+        for name in names:
+            self.emit(CHECK, self.slot(name),
+                      self.const('undefined variable {}'.format(name)))
+
+    def compile(self):
+        instrs = self.func['instrs']
+        has_phi = any(i.get('op') == 'phi' for i in instrs)
+        unsafe = undefined_reads(self.func)
+        i = 0
+        while i < len(instrs):
+            instr = instrs[i]
+            if 'label' in instr:
+                self.label_offsets.setdefault(instr['label'],
+                                              len(self.out.code))
+                if has_phi:
+                    self.emit(LABEL, self.label_num(instr['label']))
+            else:
+                self.check(unsafe[i])
+                nxt = instrs[i + 1] if i + 1 < len(instrs) else None
+                # A fused `br` reads only the comparison's destination,
+                # which is defined by then.
+                if self.fuse(instr, nxt):
+                    i += 1
+                else:
+                    self.compile_instr(instr)
+            i += 1
+        self.emit(END)
+
+        code = self.out.code
+        for pos, label in self.fixups:
+            if label in self.label_offsets:
+                code[pos] = self.label_offsets[label]
+            else:
+                # Jump to an error stub.
+                code[pos] = len(code)
+                self.error('label {} not found'.format(label))
+        self.out.nslots = len(self.slots)
+        self.out.slot_names = sorted(self.slots, key=self.slots.get)
+        return self.out
+
+    def fuse(self, instr, nxt):
+        """Emit a compare-and-branch superinstruction if `instr` is a
+        comparison and `nxt` branches on its result.
+        """
+        if instr.get('op') not in COMPARE_BRANCH or nxt is None or \
+                nxt.get('op') != 'br' or \
+                nxt.get('args') != [instr.get('dest')] or \
+                len(instr.get('args', [])) != 2 or \
+                len(nxt.get('labels', [])) != 2:
+            return False
+        lhs, rhs = instr['args']
+        self.emit(COMPARE_BRANCH[instr['op']], self.slot(instr['dest']),
+                  self.slot(lhs), self.slot(rhs))
+        self.emit_target(nxt['labels'][0])
+        self.emit_target(nxt['labels'][1])
+        return True
+
+    def compile_instr(self, instr):
+        op = instr['op']
+        args = instr.get('args', [])
+        dest = instr.get('dest')
+        if op != 'const':
+            if op not in ARG_COUNTS:
+                return self.error('unknown opcode {}'.format(op))
+            count = ARG_COUNTS[op]
+            if count is not None and len(args) != count:
+                return self.error('{} takes {} argument(s); got {}'.format(
+                    op, count, len(args)))
+        labels = instr.get('labels', [])
+        if op in LABEL_COUNTS and len(labels) != LABEL_COUNTS[op]:
+            return self.error('expecting {} labels; found {}'.format(
+                LABEL_COUNTS[op], len(labels)))
+
+        if op == 'const':
+            try:
+                value = const_value(instr)
+            except BrilError as exc:
+                return self.error(str(exc))
+            self.emit(CONST, self.slot(dest), self.const(value))
+        elif op in SIMPLE_OPS:
+            if op == 'alloc' and not isinstance(instr.get('type'), dict):
+                return self.error('cannot allocate non-pointer type {}'.format(
+                    instr.get('type')))
+            words = [SIMPLE_OPS[op]]
+            if dest is not None:
+                words.append(self.slot(dest))
+            words += [self.slot(a) for a in args]
+            self.emit(*words)
+        elif op == 'jmp':
+            self.emit(JMP)
+            self.emit_target(labels[0])
+        elif op == 'br':
+            self.emit(BR, self.slot(args[0]))
+            self.emit_target(labels[0])
+            self.emit_target(labels[1])
+        elif op == 'guard':
+            self.emit(GUARD, self.slot(args[0]))
+            self.emit_target(labels[0])
+        elif op == 'ret':
+            if len(args) > 1:
+                return self.error('ret takes 0 or 1 argument(s); got {}'.format(
+                    len(args)))
+            self.emit(RET, self.slot(args[0]) if args else -1)
+        elif op == 'print':
+            self.emit(PRINT, len(args), *[self.slot(a) for a in args])
+        elif op == 'call':
+            self.compile_call(instr)
+        elif op == 'phi':
+            if len(labels) != len(args):
+                return self.error(
+                    'phi node has unequal numbers of labels and args')
+            words = [PHI, self.slot(dest), len(args)]
+            for label, arg in zip(labels, args):
+                words += [self.label_num(label), self.slot(arg)]
+            self.emit(*words)
+
+    def compile_call(self, instr):
+        name = instr['funcs'][0]
+        args = instr.get('args', [])
+        dest = instr.get('dest')
+        if name not in self.func_index:
+            return self.error('no function of name {} found'.format(name))
+        if name in self.duplicates:
+            return self.error(
+                'multiple functions of name {} found'.format(name))
+        callee = self.funcs[self.func_index[name]]
+        if len(callee.get('args', [])) != len(args):
+            return self.error('function expected {} arguments, got {}'.format(
+                len(callee.get('args', [])), len(args)))
+        if dest is not None and callee.get('type') is None:
+            return self.error('function with void return type used in '
+                              'value call')
+        self.emit(CALL, self.slot(dest) if dest is not None else -1,
+                  self.func_index[name], len(args),
+                  *[self.slot(a) for a in args])
+
+
+class Machine(object):
+    """Compile a Bril program to bytecode and run it, writing `print`
+    output to `out`.
+    """
+
+    def __init__(self, program, out=sys.stdout):
+        self.out = out
+        self.heap = Heap()
+        self.count = 0
+        funcs = program['functions']
+        names = [f['name'] for f in funcs]
+        self.func_index = {}
+        for i, name in enumerate(names):
+            self.func_index.setdefault(name, i)
+        self.duplicates = {n for n in names if names.count(n) > 1}
+        self.codes = [
+            Compiler(f, self.func_index, funcs, self.duplicates).compile()
+            for f in funcs
+        ]
+
+    def execute(self, fn, args):
+        """Run compiled function number `fn` on a list of argument values.
+        Return its return value, or None.
+        """
+        func = self.codes[fn]
+        code = func.code
+        consts = func.consts
+        regs = list(args)
+        regs.extend([None] * (func.nslots - len(args)))
+        storage = self.heap.storage
+        n = 0
+        pc = 0
+        cur = last = -1
+        spec = []
+        try:
+            while True:
+                op = code[pc]
+                if op == ID:
+                    regs[code[pc + 1]] = regs[code[pc + 2]]
+                    pc += 3
+                    n += 1
+                elif op == CONST:
+                    regs[code[pc + 1]] = consts[code[pc + 2]]
+                    pc += 3
+                    n += 1
+                elif op == ADD:
+                    v = regs[code[pc + 2]] + regs[code[pc + 3]]
+                    if v > INT_MAX or v < INT_MIN:
+                        v = wrap(v)
+                    regs[code[pc + 1]] = v
+                    pc += 4
+                    n += 1
+                elif op == SUB:
+                    v = regs[code[pc + 2]] - regs[code[pc + 3]]
+                    if v > INT_MAX or v < INT_MIN:
+                        v = wrap(v)
+                    regs[code[pc + 1]] = v
+                    pc += 4
+                    n += 1
+                elif op == MUL:
+                    v = regs[code[pc + 2]] * regs[code[pc + 3]]
+                    if v > INT_MAX or v < INT_MIN:
+                        v = wrap(v)
+                    regs[code[pc + 1]] = v
+                    pc += 4
+                    n += 1
+                elif op == JMP:
+                    pc = code[pc + 1]
+                    n += 1
+                elif op <= EQ_BR:
+                    if op == BR:
+                        pc = code[pc + 2] if regs[code[pc + 1]] \
+                            else code[pc + 3]
+                        n += 1
+                        continue
+                    a = regs[code[pc + 2]]
+                    b = regs[code[pc + 3]]
+                    if op == LT_BR:
+                        c = a < b
+                    elif op == LE_BR:
+                        c = a <= b
+                    elif op == GT_BR:
+                        c = a > b
+                    elif op == GE_BR:
+                        c = a >= b
+                    else:
+                        c = a == b
+                    regs[code[pc + 1]] = c
+                    pc = code[pc + 4] if c else code[pc + 5]
+                    n += 2
+                elif op == DIV:
+                    v = trunc_div(regs[code[pc + 2]], regs[code[pc + 3]])
+                    if v > INT_MAX:
+                        v = wrap(v)
+                    regs[code[pc + 1]] = v
+                    pc += 4
+                    n += 1
+                elif op <= OR:
+                    a = regs[code[pc + 2]]
+                    if op == NOT:
+                        regs[code[pc + 1]] = not a
+                        pc += 3
+                        n += 1
+                        continue
+                    b = regs[code[pc + 3]]
+                    if op == LT:
+                        c = a < b
+                    elif op == LE:
+                        c = a <= b
+                    elif op == GT:
+                        c = a > b
+                    elif op == GE:
+                        c = a >= b
+                    elif op == EQ:
+                        c = a == b
+                    elif op == AND:
+                        c = a and b
+                    else:
+                        c = a or b
+                    regs[code[pc + 1]] = c
+                    pc += 4
+                    n += 1
+                elif op == LOAD:
+                    p = regs[code[pc + 2]]
+                    data = storage.get(p.base)
+                    if data is None or not 0 <= p.offset < len(data):
+                        self.heap.data(p)  # Raises an error.
+                    v = data[p.offset]
+                    if v is None:
+                        raise BrilError(
+                            'Pointer {} points to uninitialized data'.format(
+                                func.slot_names[code[pc + 2]]))
+                    regs[code[pc + 1]] = v
+                    pc += 3
+                    n += 1
+                elif op == STORE:
+                    p = regs[code[pc + 1]]
+                    data = storage.get(p.base)
+                    if data is None or not 0 <= p.offset < len(data):
+                        self.heap.data(p)  # Raises an error.
+                    data[p.offset] = regs[code[pc + 2]]
+                    pc += 3
+                    n += 1
+                elif op == PTRADD:
+                    p = regs[code[pc + 2]]
+                    regs[code[pc + 1]] = Pointer(
+                        p.base, p.offset + regs[code[pc + 3]])
+                    pc += 4
+                    n += 1
+                elif op == CALL:
+                    if spec:
+                        raise BrilError('call not allowed during '
+                                        'speculation')
+                    dest = code[pc + 1]
+                    nargs = code[pc + 3]
+                    vals = [regs[r] for r in code[pc + 4:pc + 4 + nargs]]
+                    self.count += n + 1
+                    n = 0
+                    v = self.execute(code[pc + 2], vals)
+                    if dest < 0:
+                        if v is not None:
+                            raise BrilError('unexpected value returned '
+                                            'without destination')
+                    elif v is None:
+                        raise BrilError(
+                            "non-void function (type: {}) doesn't return "
+                            "anything".format(
+                                self.codes[code[pc + 2]].type))
+                    else:
+                        regs[dest] = v
+                    pc += 4 + nargs
+                elif op == RET:
+                    n += 1
+                    if spec:
+                        raise BrilError('ret not allowed during speculation')
+                    r = code[pc + 1]
+                    return regs[r] if r >= 0 else None
+                elif op == PRINT:
+                    nargs = code[pc + 1]
+                    self.out.write(' '.join([
+                        format_value(regs[r])
+                        for r in code[pc + 2:pc + 2 + nargs]
+                    ]) + '\n')
+                    pc += 2 + nargs
+                    n += 1
+                elif op == PHI:
+                    if last < 0:
+                        raise BrilError('phi node executed with no last '
+                                        'label')
+                    nargs = code[pc + 2]
+                    v = None
+                    for i in range(pc + 3, pc + 3 + 2 * nargs, 2):
+                        if code[i] == last:
+                            v = regs[code[i + 1]]
+                            break
+                    regs[code[pc + 1]] = v
+                    pc += 3 + 2 * nargs
+                    n += 1
+                elif op == LABEL:
+                    last = cur
+                    cur = code[pc + 1]
+                    pc += 2
+                elif op <= FEQ:
+                    a = regs[code[pc + 2]]
+                    b = regs[code[pc + 3]]
+                    if op == FADD:
+                        c = a + b
+                    elif op == FSUB:
+                        c = a - b
+                    elif op == FMUL:
+                        c = a * b
+                    elif op == FDIV:
+                        c = float_div(a, b)
+                    elif op == FLT:
+                        c = a < b
+                    elif op == FLE:
+                        c = a <= b
+                    elif op == FGT:
+                        c = a > b
+                    elif op == FGE:
+                        c = a >= b
+                    else:
+                        c = a == b
+                    regs[code[pc + 1]] = c
+                    pc += 4
+                    n += 1
+                elif op == ALLOC:
+                    regs[code[pc + 1]] = self.heap.alloc(regs[code[pc + 2]])
+                    pc += 3
+                    n += 1
+                elif op == FREE:
+                    self.heap.free(regs[code[pc + 1]])
+                    pc += 2
+                    n += 1
+                elif op == NOP:
+                    pc += 1
+                    n += 1
+                elif op <= CGE:
+                    a = regs[code[pc + 2]]
+                    b = regs[code[pc + 3]]
+                    if op == CEQ:
+                        c = a == b
+                    elif op == CLT:
+                        c = _utf16(a) < _utf16(b)
+                    elif op == CLE:
+                        c = _utf16(a) <= _utf16(b)
+                    elif op == CGT:
+                        c = _utf16(a) > _utf16(b)
+                    else:
+                        c = _utf16(a) >= _utf16(b)
+                    regs[code[pc + 1]] = c
+                    pc += 4
+                    n += 1
+                elif op == CHAR2INT:
+                    regs[code[pc + 1]] = ord(regs[code[pc + 2]])
+                    pc += 3
+                    n += 1
+                elif op == INT2CHAR:
+                    regs[code[pc + 1]] = int2char(regs[code[pc + 2]])
+                    pc += 3
+                    n += 1
+                elif op == SPECULATE:
+                    spec.append((list(regs), cur, last))
+                    pc += 1
+                    n += 1
+                elif op == COMMIT:
+                    if not spec:
+                        raise BrilError('commit in non-speculative state')
+                    del spec[:]
+                    pc += 1
+                    n += 1
+                elif op == GUARD:
+                    n += 1
+                    if regs[code[pc + 1]]:
+                        pc += 3
+                        continue
+                    if not spec:
+                        raise BrilError('abort in non-speculative state')
+                    saved, cur, last = spec.pop()
+                    regs[:] = saved
+                    pc = code[pc + 2]
+                elif op == ERROR:
+                    raise BrilError(consts[code[pc + 1]])
+                elif op == CHECK:
+                    if regs[code[pc + 1]] is None:
+                        raise BrilError(consts[code[pc + 2]])
+                    pc += 3
+                else:  # END
+                    if spec:
+                        raise BrilError('implicit return in speculative '
+                                        'state')
+                    return None
+        finally:
+            self.count += n
+
+    def run(self, args):
+        """Run the `main` function with a list of arguments (strings or
+        Python values). Return the number of dynamic instructions
+        executed.
+        """
+        if 'main' not in self.func_index:
+            print('no main function defined, doing nothing', file=sys.stderr)
+            return 0
+        if 'main' in self.duplicates:
+            raise BrilError('multiple functions of name main found')
+        fn = self.func_index['main']
+        main = self.codes[fn]
+        if len(args) != main.nparams:
+            raise BrilError(
+                'mismatched main argument arity: expected {}; got {}'.format(
+                    main.nparams, len(args)))
+        values = [parse_arg(arg, type)
+                  for arg, type in zip(args, main.param_types)]
+        try:
+            self.execute(fn, values)
+        except (TypeError, AttributeError, KeyError) as exc:
+            # We do not check types or definedness, so ill-formed programs
+            # end up here.
+            raise BrilError('type error: {}'.format(exc))
+        if self.heap.storage:
+            raise BrilError('Some memory locations have not been freed by '
+                            'end of execution.')
+        return self.count
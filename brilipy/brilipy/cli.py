@@ -0,0 +1,116 @@
+"""The `brilipy` command, a drop-in replacement for `brili`.
+"""
+import json
+import sys
+import time
+from io import StringIO
+
+from . import BACKENDS, BrilError, Profiler, deep_stack
+
+
+def main():
+    """Run a Bril program from standard input, like `brili`: command-line
+    arguments go to `main`, and `-p` reports the dynamic instruction count.
+    Choose a backend other than the default with `--backend=NAME`.
+
+    With `--batch=FILE`, run the program once for each line of arguments
+    in FILE, all at once (see `simt.py`), and print one JSON object per
+    run. Add `--compare` to also time separate runs with the backend.
+
+    With `--profile=FILE`, write a block, edge, and call-site profile of
+    the run to FILE as JSON (see `profile.py`).
+    """
+    args = sys.argv[1:]
+    profiling = '-p' in args
+    if profiling:
+        args.remove('-p')
+    compare = '--compare' in args
+    if compare:
+        args.remove('--compare')
+    backend = 'closure'
+    batch = None
+    profile = None
+    for arg in list(args):
+        if arg.startswith('--backend='):
+            backend = arg.split('=', 1)[1]
+            args.remove(arg)
+        elif arg.startswith('--batch='):
+            batch = arg.split('=', 1)[1]
+            args.remove(arg)
+        elif arg.startswith('--profile='):
+            profile = arg.split('=', 1)[1]
+            args.remove(arg)
+    if backend not in BACKENDS:
+        print('error: unknown backend {}; choose from {}'.format(
+            backend, ', '.join(sorted(BACKENDS))), file=sys.stderr)
+        sys.exit(1)
+    program = json.load(sys.stdin)
+
+    status = []
+
+    def interpret():
+        if batch is not None:
+            with open(batch) as f:
+                arg_sets = [line.split() for line in f if line.strip()]
+            run_batch(program, arg_sets, backend if compare else None)
+            status.append(0)
+            return
+        interp = Profiler(program) if profile is not None \
+            else BACKENDS[backend](program)
+        try:
+            count = interp.run(args)
+        except BrilError as exc:
+            sys.stdout.flush()
+            print('error: {}'.format(exc), file=sys.stderr)
+            status.append(2)
+            return
+        if profiling:
+            print('total_dyn_inst: {}'.format(count), file=sys.stderr)
+        if profile is not None:
+            with open(profile, 'w') as f:
+                json.dump(interp.result(), f, indent=2, sort_keys=True)
+        status.append(0)
+
+    deep_stack(interpret)
+    sys.exit(status[0] if status else 1)
+
+
+def run_batch(program, arg_sets, backend=None):
+    """Run a program on many argument lists at once and print the results
+    as JSON lines, with the throughput on standard error. If `backend` is
+    given, compare the throughput with running each list separately.
+    """
+    from .simt import run_batch as simt_run  # Needs NumPy.
+
+    start = time.perf_counter()
+    results = simt_run(program, arg_sets)
+    elapsed = time.perf_counter() - start
+    for args, (out, counts, error) in zip(arg_sets, results):
+        print(json.dumps({
+            'args': args,
+            'output': out,
+            'total_dyn_inst': counts['total_dyn_inst'],
+            'error': error,
+        }))
+    print('batch: {} input sets in {:.3f}s ({:.1f} sets/s)'.format(
+        len(arg_sets), elapsed, len(arg_sets) / elapsed), file=sys.stderr)
+
+    if backend is not None:
+        start = time.perf_counter()
+        mismatches = 0
+        for args, (out, counts, error) in zip(arg_sets, results):
+            expected = BACKENDS[backend](program, StringIO())
+            try:
+                count, expected_error = expected.run(list(args)), None
+            except BrilError as exc:
+                count, expected_error = None, exc
+            ok = (expected_error is None) == (error is None) and \
+                expected.out.getvalue() == out
+            if ok and error is None:
+                ok = count == counts['total_dyn_inst']
+            mismatches += not ok
+        separate = time.perf_counter() - start
+        print('{}: {} separate runs in {:.3f}s ({:.1f} sets/s); batch is '
+              '{:.1f}x faster; {} mismatches'.format(
+                  backend, len(arg_sets), separate, len(arg_sets) / separate,
+                  separate / elapsed, mismatches), file=sys.stderr)
@@ -0,0 +1,749 @@
+"""A Bril interpreter in Python.
+
+The interpreter follows `brili` for the core, floating point, character,
+memory, SSA, and speculation extensions. It assumes that programs are
+well-typed (see `brilck`), so it does not check operand types at run
+time.
+
+Before anything runs, every function is decoded into a list of
+*segments*. A segment is a straight-line run of instructions, each
+turned into a Python closure over its variable names, followed by an
+optional control-flow closure that picks the next segment. Executing a
+segment is then just a loop over closures that read and write the
+environment dictionary.
+"""
+import math
+import operator
+import sys
+from collections import namedtuple
+from decimal import Decimal, Context, ROUND_HALF_UP
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+# Control-flow closures return the index of the next segment or `RETURN`.
+RETURN = -1
+
+# Keys in the environment that cannot clash with Bril variable names: the
+# return value, the current and previous labels (for phi-nodes), and the
+# saved state during speculation.
+_RET = ('ret',)
+_CUR = ('cur',)
+_LAST = ('last',)
+_SPEC = ('spec',)
+
+
+class BrilError(Exception):
+    """An error in the Bril program being interpreted.
+    """
+
+
+# A pointer is an allocation number plus an offset into that allocation.
+Pointer = namedtuple('Pointer', ['base', 'offset'])
+
+
+def wrap(val):
+    """Wrap an integer to the signed 64-bit range.
+    """
+    return (val - INT_MIN) % 2 ** 64 + INT_MIN
+
+
+def trunc_div(lhs, rhs):
+    """Integer division that rounds toward zero, like `BigInt` division.
+    """
+    if rhs == 0:
+        raise BrilError('division by zero')
+    quot = abs(lhs) // abs(rhs)
+    return -quot if (lhs < 0) != (rhs < 0) else quot
+
+
+def float_div(lhs, rhs):
+    """IEEE 754 division, which Python refuses to do for zero divisors.
+    """
+    try:
+        return lhs / rhs
+    except ZeroDivisionError:
+        if lhs == 0 or math.isnan(lhs):
+            return math.nan
+        return math.copysign(math.inf, lhs) * math.copysign(1.0, rhs)
+
+
+def _utf16(c):
+    # JavaScript compares strings by UTF-16 code unit.
+    return c.encode('utf-16-be')
+
+
+_FIXED = Decimal('1e-17')
+_FIXED_CONTEXT = Context(prec=60)
+
+
+def format_float(val):
+    """Format a float like JavaScript's `toFixed(17)`.
+    """
+    if val == 0 and math.copysign(1.0, val) < 0:
+        return '-0.00000000000000000'
+    if math.isnan(val):
+        return 'NaN'
+    if math.isinf(val):
+        return 'Infinity' if val > 0 else '-Infinity'
+    if abs(val) >= 1e21:
+        return repr(val)  # JavaScript uses exponential notation here.
+    fixed = Decimal(val).quantize(_FIXED, rounding=ROUND_HALF_UP,
+                                  context=_FIXED_CONTEXT)
+    return format(fixed, 'f')
+
+
+FORMATTERS = {
+    bool: lambda v: 'true' if v else 'false',
+    int: str,
+    float: format_float,
+    str: lambda v: v,
+    Pointer: lambda v: '[object Object]',
+}
+
+
+def format_value(val):
+    return FORMATTERS[type(val)](val)
+
+
+class Heap(object):
+    """Memory for the memory extension: a map from allocation numbers to
+    lists of values (or None where nothing has been stored).
+    """
+
+    def __init__(self):
+        self.storage = {}
+        self.count = 0
+
+    def alloc(self, amt):
+        if amt <= 0:
+            raise BrilError(
+                'must allocate a positive amount of memory: '
+                '{} <= 0'.format(amt)
+            )
+        base = self.count
+        self.count += 1
+        self.storage[base] = [None] * amt
+        return Pointer(base, 0)
+
+    def free(self, ptr):
+        if ptr.base in self.storage and ptr.offset == 0:
+            del self.storage[ptr.base]
+        else:
+            raise BrilError(
+                'Tried to free illegal memory location base: {}, '
+                'offset: {}. Offset must be 0.'.format(ptr.base, ptr.offset)
+            )
+
+    def data(self, ptr):
+        """Get the list that holds the value at `ptr`, checking that the
+        access is legal.
+        """
+        data = self.storage.get(ptr.base)
+        if data is None or not 0 <= ptr.offset < len(data):
+            raise BrilError(
+                'Uninitialized heap location {} and/or illegal '
+                'offset {}'.format(ptr.base, ptr.offset)
+            )
+        return data
+
+
+# Argument counts for checked operations (`None` means any number).
+ARG_COUNTS = {
+    'add': 2, 'mul': 2, 'sub': 2, 'div': 2, 'id': 1,
+    'lt': 2, 'le': 2, 'gt': 2, 'ge': 2, 'eq': 2,
+    'not': 1, 'and': 2, 'or': 2,
+    'fadd': 2, 'fmul': 2, 'fsub': 2, 'fdiv': 2,
+    'flt': 2, 'fle': 2, 'fgt': 2, 'fge': 2, 'feq': 2,
+    'print': None, 'br': 1, 'jmp': 0, 'ret': None, 'nop': 0, 'call': None,
+    'alloc': 1, 'free': 1, 'store': 2, 'load': 1, 'ptradd': 2,
+    'phi': None, 'speculate': 0, 'guard': 1, 'commit': 0,
+    'ceq': 2, 'clt': 2, 'cle': 2, 'cgt': 2, 'cge': 2,
+    'char2int': 1, 'int2char': 1,
+}
+
+# Integer arithmetic that needs wrapping to 64 bits.
+INT_OPS = {
+    'add': operator.add,
+    'mul': operator.mul,
+    'sub': operator.sub,
+    'div': trunc_div,
+}
+
+# Everything else that computes a value from two arguments.
+BINARY_OPS = {
+    'lt': operator.lt, 'le': operator.le, 'gt': operator.gt,
+    'ge': operator.ge, 'eq': operator.eq,
+    'and': operator.and_, 'or': operator.or_,
+    'fadd': operator.add, 'fmul': operator.mul, 'fsub': operator.sub,
+    'fdiv': float_div,
+    'flt': operator.lt, 'fle': operator.le, 'fgt': operator.gt,
+    'fge': operator.ge, 'feq': operator.eq,
+    'ceq': operator.eq,
+    'clt': lambda a, b: _utf16(a) < _utf16(b),
+    'cle': lambda a, b: _utf16(a) <= _utf16(b),
+    'cgt': lambda a, b: _utf16(a) > _utf16(b),
+    'cge': lambda a, b: _utf16(a) >= _utf16(b),
+}
+
+
+def int2char(val):
+    if val > 1114111 or val < 0 or 55295 < val < 57344:
+        raise BrilError('value {} cannot be converted to char'.format(val))
+    return chr(val)
+
+
+UNARY_OPS = {
+    'not': operator.not_,
+    'char2int': ord,
+    'int2char': int2char,
+}
+
+# Instructions that end a segment, and how many labels they take.
+CONTROL_OPS = {'jmp', 'br', 'ret', 'guard'}
+LABEL_COUNTS = {'jmp': 1, 'br': 2, 'guard': 1}
+
+
+def _failing(message):
+    """Make a closure that reports an error when it is executed, for
+    problems `brili` would only notice at run time.
+    """
+    def run(env):
+        raise BrilError(message)
+    return run
+
+
+def const_value(instr):
+    value = instr['value']
+    if isinstance(value, bool):
+        return value
+    elif isinstance(value, (int, float)):
+        if instr.get('type') == 'float':
+            return float(value)
+        return int(math.floor(value))
+    elif isinstance(value, str):
+        if len(value) != 1:
+            raise BrilError('char must have one character')
+        return value
+    return value
+
+
+def split_blocks(instrs):
+    """Split a function's instructions at labels and control-flow
+    instructions. Return a list of (label, instructions) pairs, leaving
+    out code that cannot run.
+    """
+    chunks = []
+    label = None
+    body = []
+    reachable = True
+    for instr in instrs:
+        if 'label' in instr:
+            if body or label is not None:
+                if reachable:
+                    chunks.append((label, body))
+            label = instr['label']
+            body = []
+            reachable = True
+        else:
+            body.append(instr)
+            if instr.get('op') in CONTROL_OPS:
+                if reachable:
+                    chunks.append((label, body))
+                # Code after a `guard` runs when the guard passes; code
+                # after other jumps needs a label to be reached.
+                reachable = instr['op'] == 'guard'
+                label = None
+                body = []
+    if reachable and (body or label is not None):
+        chunks.append((label, body))
+    return chunks
+
+
+def undefined_reads(func):
+    """Find the reads of variables that might not be defined yet, with a
+    forward "must be defined" analysis over a function's control flow.
+
+    Return a list with an entry for each instruction: the names of the
+    arguments it might read before they are defined. Phi-nodes read
+    nothing, because an undefined phi argument leaves the destination
+    undefined instead of being an error. A phi-node defines its
+    destination only if every predecessor is labeled and passes a
+    defined argument. In functions that speculate, every read counts.
+    """
+    instrs = func['instrs']
+    params = {a['name'] for a in func.get('args', [])}
+    reads = [[] if 'label' in i or i.get('op') == 'phi'
+             else list(i.get('args', [])) for i in instrs]
+    if any(i.get('op') == 'speculate' for i in instrs):
+        return reads
+
+    # Blocks of instruction indices, with their labels and successors.
+    blocks = []
+    label, body = None, []
+    for n, instr in enumerate(instrs):
+        if 'label' in instr:
+            if body or label is not None:
+                blocks.append((label, body))
+            label, body = instr['label'], []
+        else:
+            body.append(n)
+            if instr.get('op') in ('jmp', 'br', 'ret'):
+                blocks.append((label, body))
+                label, body = None, []
+    if body or label is not None or not blocks:
+        blocks.append((label, body))
+    index = {}
+    for b, (label, _) in enumerate(blocks):
+        if label is not None:
+            index.setdefault(label, b)
+    preds = [[] for _ in blocks]
+    for b, (_, body) in enumerate(blocks):
+        last = instrs[body[-1]] if body else {}
+        if last.get('op') in ('jmp', 'br'):
+            succs = [index[l] for l in last.get('labels', []) if l in index]
+        elif last.get('op') == 'ret':
+            succs = []
+        else:
+            succs = [b + 1] if b + 1 < len(blocks) else []
+        for s in succs:
+            preds[s].append(b)
+
+    every = set(params)
+    for instr in instrs:
+        if 'dest' in instr:
+            every.add(instr['dest'])
+    outs = [set(every) for _ in blocks]
+
+    def transfer(b, record):
+        defined = set(every)
+        for p in preds[b]:
+            defined &= outs[p]
+        if b == 0:
+            defined &= params
+        for n in blocks[b][1]:
+            instr = instrs[n]
+            if record:
+                reads[n] = [a for a in reads[n] if a not in defined]
+            if 'dest' not in instr:
+                continue
+            if instr.get('op') == 'phi':
+                incoming = dict(zip(instr.get('labels', []),
+                                    instr.get('args', [])))
+                if not preds[b] or not all(
+                    blocks[p][0] in incoming and
+                    incoming[blocks[p][0]] in outs[p]
+                    for p in preds[b]
+                ):
+                    continue
+            defined.add(instr['dest'])
+        return defined
+
+    changed = True
+    while changed:
+        changed = False
+        for b in range(len(blocks)):
+            defined = transfer(b, False)
+            if defined != outs[b]:
+                outs[b] = defined
+                changed = True
+    for b in range(len(blocks)):
+        transfer(b, True)
+    return reads
+
+
+class Function(object):
+    """A decoded Bril function.
+
+    `segments` is a list of (label, body, control, size) tuples. `label`
+    is the label at the start of the segment (or None), `body` is a tuple
+    of closures that each take the environment, `control` is None for a
+    segment that falls through to the next one or a closure that returns
+    the next segment's index (or `RETURN`), and `size` is the number of
+    Bril instructions the segment executes.
+    """
+
+    def __init__(self, func):
+        self.name = func['name']
+        self.params = [a['name'] for a in func.get('args', [])]
+        self.param_types = [a['type'] for a in func.get('args', [])]
+        self.type = func.get('type')
+        self.instrs = func['instrs']
+        self.segments = None
+        self.track_labels = any(i.get('op') == 'phi' for i in self.instrs)
+
+
+class Interpreter(object):
+    """Run a Bril program, writing `print` output to `out`.
+    """
+
+    def __init__(self, program, out=sys.stdout):
+        self.out = out
+        self.heap = Heap()
+        self.count = 0
+        self.funcs = {}
+        for func in program['functions']:
+            if func['name'] in self.funcs:
+                self.funcs[func['name']] = None  # Reported when called.
+            else:
+                self.funcs[func['name']] = Function(func)
+        for func in self.funcs.values():
+            if func is not None:
+                self.decode(func)
+
+    # Decoding.
+
+    def decode(self, func):
+        """Split a function into segments and turn its instructions into
+        closures.
+        """
+        chunks = split_blocks(func.instrs)
+
+        labels = {}
+        for i, (label, _) in enumerate(chunks):
+            if label is not None and label not in labels:
+                labels[label] = i
+
+        segments = []
+        for i, (label, instrs) in enumerate(chunks):
+            control = None
+            if instrs and instrs[-1]['op'] in CONTROL_OPS:
+                control = self.decode_control(instrs[-1], labels, i + 1)
+                instrs = instrs[:-1]
+                size = len(instrs) + 1
+            else:
+                size = len(instrs)
+            decoded = tuple(self.decode_instr(instr, func)
+                            for instr in instrs)
+            segments.append((label, decoded, control, size))
+        func.segments = segments
+
+    def decode_control(self, instr, labels, next_index):
+        op = instr['op']
+        args = instr.get('args', [])
+        targets = []
+        for label in instr.get('labels', []):
+            if label not in labels:
+                return _failing('label {} not found'.format(label))
+            targets.append(labels[label])
+        expected = LABEL_COUNTS.get(op, 0)
+        if len(targets) != expected:
+            return _failing('expecting {} labels; found {}'.format(
+                expected, len(targets)))
+        count = ARG_COUNTS[op]
+        if count is not None and len(args) != count:
+            return _failing('{} takes {} argument(s); got {}'.format(
+                op, count, len(args)))
+
+        if op == 'jmp':
+            target, = targets
+
+            def run(env):
+                return target
+        elif op == 'br':
+            cond, = args
+            then_target, else_target = targets
+
+            def run(env):
+                return then_target if env[cond] else else_target
+        elif op == 'ret':
+            if len(args) > 1:
+                return _failing('ret takes 0 or 1 argument(s); got {}'.format(
+                    len(args)))
+
+            def run(env):
+                if _SPEC in env:
+                    raise BrilError('ret not allowed during speculation')
+                if args:
+                    env[_RET] = env[args[0]]
+                return RETURN
+        elif op == 'guard':
+            cond, = args
+            target, = targets
+
+            def run(env):
+                if env[cond]:
+                    return next_index
+                parent = env.get(_SPEC)
+                if parent is None:
+                    raise BrilError('abort in non-speculative state')
+                env.clear()
+                env.update(parent)
+                return target
+        return run
+
+    def decode_instr(self, instr, func):
+        op = instr['op']
+        args = instr.get('args', [])
+        dest = instr.get('dest')
+
+        if op != 'const':
+            if op not in ARG_COUNTS:
+                return _failing('unknown opcode {}'.format(op))
+            count = ARG_COUNTS[op]
+            if count is not None and len(args) != count:
+                return _failing('{} takes {} argument(s); got {}'.format(
+                    op, count, len(args)))
+
+        if op == 'const':
+            try:
+                value = const_value(instr)
+            except BrilError as exc:
+                return _failing(str(exc))
+
+            def run(env):
+                env[dest] = value
+        elif op == 'id':
+            src, = args
+
+            def run(env):
+                env[dest] = env[src]
+        elif op in INT_OPS:
+            fn = INT_OPS[op]
+            lhs, rhs = args
+
+            def run(env):
+                val = fn(env[lhs], env[rhs])
+                env[dest] = val if INT_MIN <= val <= INT_MAX else wrap(val)
+        elif op in BINARY_OPS:
+            fn = BINARY_OPS[op]
+            lhs, rhs = args
+
+            def run(env):
+                env[dest] = fn(env[lhs], env[rhs])
+        elif op in UNARY_OPS:
+            fn = UNARY_OPS[op]
+            src, = args
+
+            def run(env):
+                env[dest] = fn(env[src])
+        elif op == 'print':
+            write = self.out.write
+
+            def run(env):
+                write(' '.join([format_value(env[a]) for a in args]) + '\n')
+        elif op == 'nop':
+            def run(env):
+                pass
+        elif op == 'call':
+            return self.decode_call(instr)
+        elif op == 'alloc':
+            return self.decode_alloc(instr)
+        elif op in ('free', 'store', 'load', 'ptradd'):
+            return self.decode_mem(instr)
+        elif op == 'phi':
+            return self.decode_phi(instr)
+        elif op == 'speculate':
+            def run(env):
+                env[_SPEC] = dict(env)
+        elif op == 'commit':
+            def run(env):
+                if _SPEC not in env:
+                    raise BrilError('commit in non-speculative state')
+                del env[_SPEC]
+        return run
+
+    def decode_call(self, instr):
+        name = instr['funcs'][0]
+        args = instr.get('args', [])
+        dest = instr.get('dest')
+        if name not in self.funcs:
+            return _failing('no function of name {} found'.format(name))
+        callee = self.funcs[name]
+        if callee is None:
+            return _failing('multiple functions of name {} found'.format(
+                name))
+        if len(callee.params) != len(args):
+            return _failing('function expected {} arguments, got {}'.format(
+                len(callee.params), len(args)))
+        if dest is not None and callee.type is None:
+            return _failing('function with void return type used in '
+                            'value call')
+        call = self.call
+
+        def run(env):
+            if _SPEC in env:
+                raise BrilError('call not allowed during speculation')
+            val = call(callee, [env[a] for a in args])
+            if dest is None:
+                if val is not None:
+                    raise BrilError(
+                        'unexpected value returned without destination')
+            elif val is None:
+                raise BrilError("non-void function (type: {}) doesn't "
+                                "return anything".format(callee.type))
+            else:
+                env[dest] = val
+        return run
+
+    def decode_alloc(self, instr):
+        dest = instr['dest']
+        amt, = instr['args']
+        if not isinstance(instr.get('type'), dict):
+            return _failing('cannot allocate non-pointer type {}'.format(
+                instr.get('type')))
+        alloc = self.heap.alloc
+
+        def run(env):
+            env[dest] = alloc(env[amt])
+        return run
+
+    def decode_mem(self, instr):
+        op = instr['op']
+        args = instr['args']
+        dest = instr.get('dest')
+        data = self.heap.data
+
+        if op == 'free':
+            ptr, = args
+            free = self.heap.free
+
+            def run(env):
+                free(env[ptr])
+        elif op == 'store':
+            ptr, src = args
+
+            def run(env):
+                p = env[ptr]
+                data(p)[p.offset] = env[src]
+        elif op == 'load':
+            ptr, = args
+
+            def run(env):
+                p = env[ptr]
+                val = data(p)[p.offset]
+                if val is None:
+                    raise BrilError(
+                        'Pointer {} points to uninitialized data'.format(ptr))
+                env[dest] = val
+        elif op == 'ptradd':
+            ptr, off = args
+
+            def run(env):
+                p = env[ptr]
+                env[dest] = Pointer(p.base, p.offset + env[off])
+        return run
+
+    def decode_phi(self, instr):
+        dest = instr['dest']
+        labels = instr.get('labels', [])
+        args = instr.get('args', [])
+        if len(labels) != len(args):
+            return _failing('phi node has unequal numbers of labels and args')
+        sources = {}
+        for label, arg in zip(labels, args):
+            sources.setdefault(label, arg)
+
+        def run(env):
+            last = env.get(_LAST)
+            if last is None:
+                raise BrilError('phi node executed with no last label')
+            src = sources.get(last)
+            if src is not None and src in env:
+                env[dest] = env[src]
+            else:
+                env.pop(dest, None)  # Leave it undefined.
+        return run
+
+    # Execution.
+
+    def call(self, func, args):
+        """Run a function on a list of argument values. Return its return
+        value, or None.
+        """
+        env = dict(zip(func.params, args))
+        segments = func.segments
+        track_labels = func.track_labels
+        end = len(segments)
+        count = 0
+        i = 0
+        try:
+            while i < end:
+                label, body, control, size = segments[i]
+                if track_labels and label is not None:
+                    env[_LAST] = env.get(_CUR)
+                    env[_CUR] = label
+                for run in body:
+                    run(env)
+                count += size
+                if control is None:
+                    i += 1
+                else:
+                    i = control(env)
+                    if i == RETURN:
+                        break
+            else:
+                if _SPEC in env:
+                    raise BrilError('implicit return in speculative state')
+        finally:
+            self.count += count
+        return env.get(_RET)
+
+    def run(self, args):
+        """Run the `main` function with a list of arguments, which may be
+        strings (as on the command line) or Python values. Return the
+        number of dynamic instructions executed.
+        """
+        if 'main' not in self.funcs:
+            print('no main function defined, doing nothing', file=sys.stderr)
+            return 0
+        main = self.funcs['main']
+        if main is None:
+            raise BrilError('multiple functions of name main found')
+        if len(args) != len(main.params):
+            raise BrilError(
+                'mismatched main argument arity: expected {}; got {}'.format(
+                    len(main.params), len(args)))
+        values = [parse_arg(arg, type)
+                  for arg, type in zip(args, main.param_types)]
+
+        try:
+            self.call(main, values)
+        except KeyError as exc:
+            raise BrilError('undefined variable {}'.format(exc.args[0]))
+        except (TypeError, AttributeError) as exc:
+            # We do not check types, so ill-typed programs end up here.
+            raise BrilError('type error: {}'.format(exc))
+
+        if self.heap.storage:
+            raise BrilError('Some memory locations have not been freed by '
+                            'end of execution.')
+        return self.count
+
+
+def parse_arg(arg, type):
+    """Convert a command-line argument to a value of the given type.
+    """
+    if not isinstance(arg, str):
+        return arg
+    if type == 'int':
+        try:
+            return wrap(int(arg))
+        except ValueError:
+            val = float(arg)
+            if not val.is_integer():
+                raise BrilError('int argument to main must be an integer; '
+                                'got {}'.format(arg))
+            return int(val)
+    elif type == 'float':
+        try:
+            val = float(arg)
+        except ValueError:
+            val = math.nan
+        if math.isnan(val):
+            raise BrilError("float argument to main must not be 'NaN'; "
+                            "got {}".format(arg))
+        return val
+    elif type == 'bool':
+        if arg == 'true':
+            return True
+        elif arg == 'false':
+            return False
+        raise BrilError("boolean argument to main must be 'true'/'false'; "
+                        "got {}".format(arg))
+    elif type == 'char':
+        if len(arg) != 1:
+            raise BrilError('char argument to main must have one character; '
+                            'got {}'.format(arg))
+        return arg
+    raise BrilError('unknown type {}'.format(type))
@@ -0,0 +1,171 @@
+"""A profiling interpreter that counts how often each basic block, each
+control-flow edge, and each call site executes.
+
+The profile is a JSON-friendly dictionary keyed by function name:
+
+    {"main": {"blocks": {"b1": 1, "loop": 10, ...},
+              "edges": {"b1": {"loop": 1}, "loop": {"body": 9, ...}},
+              "calls": {"body": {"helper": 9}}}}
+
+Blocks have the names that `form_blocks` and `cfg.block_map` in the
+`examples` directory give them: a block's label if it has one, or a
+fresh name like `b1` if it does not. So passes that build a CFG with
+those helpers can look up their blocks directly. `calls` maps each block
+to the functions it calls and how often each call ran.
+"""
+import sys
+from collections import defaultdict
+
+from .interp import (
+    Interpreter, BrilError, RETURN, split_blocks, _CUR, _LAST, _RET, _SPEC,
+)
+
+# Instructions that end a block in `form_blocks`.
+TERMINATORS = ('br', 'jmp', 'ret')
+
+
+def block_names(instrs):
+    """Name the basic blocks of a function like `cfg.block_map` does.
+    Return a map from the `id` of each instruction to its block's name
+    and a set holding the `id`s of the instructions that start a block.
+    """
+    names = {}
+    starts = set()
+    taken = set()
+    block = []
+
+    def finish(label=None):
+        if label is None:
+            i = 1
+            while 'b{}'.format(i) in taken:
+                i += 1
+            label = 'b{}'.format(i)
+        taken.add(label)
+        for instr in block:
+            names[id(instr)] = label
+        if block:
+            starts.add(id(block[0]))
+
+    label = None
+    for instr in instrs:
+        if 'op' in instr:
+            block.append(instr)
+            if instr['op'] in TERMINATORS:
+                finish(label)
+                label = None
+                block = []
+        else:
+            if block or label is not None:
+                finish(label)
+            label = instr['label']
+            block = []
+    if block or label is not None:
+        finish(label)
+    return names, starts
+
+
+class Profiler(Interpreter):
+    """An `Interpreter` that also records a block, edge, and call-site
+    profile in `profile`.
+    """
+
+    def __init__(self, program, out=sys.stdout):
+        super(Profiler, self).__init__(program, out)
+        self.profile = {}
+        self.current = []  # The running block in each active call.
+
+        # For each function, a (name, starts block) pair per segment.
+        self.segment_blocks = {}
+        for func in program['functions']:
+            decoded = self.funcs.get(func['name'])
+            if decoded is None or decoded.instrs is not func['instrs']:
+                continue
+            names, starts = block_names(func['instrs'])
+            info = []
+            name = None
+            # These are the same chunks the interpreter's segments use.
+            for label, body in split_blocks(func['instrs']):
+                if label is not None:
+                    info.append((label, True))
+                    name = label
+                elif body:
+                    first = id(body[0])
+                    if first in starts or name is None:
+                        name = names[first]
+                        info.append((name, True))
+                    else:
+                        # A block split by a `guard` in the interpreter.
+                        info.append((name, False))
+            self.segment_blocks[func['name']] = info
+
+    def func_profile(self, name):
+        if name not in self.profile:
+            self.profile[name] = {
+                'blocks': defaultdict(int),
+                'edges': defaultdict(lambda: defaultdict(int)),
+                'calls': defaultdict(lambda: defaultdict(int)),
+            }
+        return self.profile[name]
+
+    def call(self, func, args):
+        """Run a function like `Interpreter.call`, counting blocks, edges,
+        and the call site.
+        """
+        if self.current:
+            caller, block = self.current[-1]
+            self.func_profile(caller)['calls'][block][func.name] += 1
+
+        prof = self.func_profile(func.name)
+        blocks = prof['blocks']
+        edges = prof['edges']
+        info = self.segment_blocks[func.name]
+        frame = [func.name, None]
+        self.current.append(frame)
+
+        env = dict(zip(func.params, args))
+        segments = func.segments
+        track_labels = func.track_labels
+        end = len(segments)
+        count = 0
+        i = 0
+        prev = None
+        try:
+            while i < end:
+                name, starts = info[i]
+                if starts:
+                    blocks[name] += 1
+                    if prev is not None:
+                        edges[prev][name] += 1
+                    prev = frame[1] = name
+                label, body, control, size = segments[i]
+                if track_labels and label is not None:
+                    env[_LAST] = env.get(_CUR)
+                    env[_CUR] = label
+                for run in body:
+                    run(env)
+                count += size
+                if control is None:
+                    i += 1
+                else:
+                    i = control(env)
+                    if i == RETURN:
+                        break
+            else:
+                if _SPEC in env:
+                    raise BrilError('implicit return in speculative state')
+        finally:
+            self.count += count
+            self.current.pop()
+        return env.get(_RET)
+
+    def result(self):
+        """Get the profile as plain dictionaries, ready for `json.dump`.
+        """
+        return {
+            name: {
+                'blocks': dict(prof['blocks']),
+                'edges': {a: dict(b) for a, b in prof['edges'].items()},
+                'calls': {a: dict(b) for a, b in prof['calls'].items()},
+            }
+            for name, prof in self.profile.items()
+        }
@@ -0,0 +1,481 @@
+"""A backend for the Python Bril interpreter that translates Bril
+functions to Python source code.
+
+Each Bril function becomes one Python function. Bril variables become
+Python locals, basic blocks become the leaves of a binary decision tree
+on a `state` variable inside a `while True` loop, and `call` becomes an
+ordinary Python call to the translated callee. Integer arithmetic wraps
+to 64 bits exactly where `interp.py` does.
+
+Translation is the expensive part, so the compiled code objects are
+cached by a hash of each function's JSON (and the signatures of the
+functions it calls). The generated code refers to the program's heap and
+output stream through globals, so the same code object works for every
+program that contains the same function.
+
+The semantics are the same as `interp.py`'s, including the dynamic
+instruction count, which each block adds to in one step.
+"""
+import hashlib
+import json
+import sys
+
+from .interp import (
+    BrilError, Heap, Pointer, ARG_COUNTS, CONTROL_OPS, INT_MIN, INT_MAX,
+    wrap, trunc_div, float_div, format_value, const_value, int2char,
+    parse_arg, split_blocks, undefined_reads, _utf16,
+)
+
+LABEL_COUNTS = {'jmp': 1, 'br': 2, 'guard': 1}
+
+# Operators that translate directly to a Python expression on the
+# (translated) arguments.
+EXPRESSIONS = {
+    'id': '{0}',
+    'not': 'not {0}',
+    'and': '{0} and {1}',
+    'or': '{0} or {1}',
+    'lt': '{0} < {1}', 'le': '{0} <= {1}', 'gt': '{0} > {1}',
+    'ge': '{0} >= {1}', 'eq': '{0} == {1}',
+    'fadd': '{0} + {1}', 'fsub': '{0} - {1}', 'fmul': '{0} * {1}',
+    'fdiv': '_fdiv({0}, {1})',
+    'flt': '{0} < {1}', 'fle': '{0} <= {1}', 'fgt': '{0} > {1}',
+    'fge': '{0} >= {1}', 'feq': '{0} == {1}',
+    'ceq': '{0} == {1}',
+    'clt': '_utf16({0}) < _utf16({1})',
+    'cle': '_utf16({0}) <= _utf16({1})',
+    'cgt': '_utf16({0}) > _utf16({1})',
+    'cge': '_utf16({0}) >= _utf16({1})',
+    'char2int': 'ord({0})',
+    'int2char': '_int2char({0})',
+    'ptradd': '_Pointer({0}.base, {0}.offset + {1})',
+    'alloc': '_alloc({0})',
+}
+
+# Integer arithmetic, which needs wrapping to 64 bits.
+INT_EXPRESSIONS = {
+    'add': '{0} + {1}',
+    'sub': '{0} - {1}',
+    'mul': '{0} * {1}',
+}
+
+# Compiled code objects, keyed by `cache_key`.
+_CODE_CACHE = {}
+
+
+def mangle(prefix, name):
+    """Turn a Bril name into a Python identifier. Every character other
+    than an ASCII letter or digit is escaped, so distinct names stay
+    distinct.
+    """
+    return prefix + ''.join(
+        c if c.isascii() and c.isalnum() else '_{:x}_'.format(ord(c))
+        for c in name
+    )
+
+
+def signature(func):
+    """The parts of a function that its callers' translations depend on.
+    """
+    return [len(func.get('args', [])), func.get('type')]
+
+
+class Translator(object):
+    """Translate one Bril function to the source code of a Python
+    function.
+
+    `signatures` maps the name of every function in the program to its
+    `signature`, or to None if the name is defined more than once.
+    """
+
+    def __init__(self, func, signatures):
+        self.func = func
+        self.signatures = signatures
+        self.lines = []
+        self.blocks = split_blocks(func['instrs'])
+        self.targets = {}
+        for i, (label, _) in enumerate(self.blocks):
+            if label is not None:
+                self.targets.setdefault(label, i)
+        self.label_nums = {}
+        instrs = func['instrs']
+        self.has_phi = any(i.get('op') == 'phi' for i in instrs)
+        self.has_spec = any(i.get('op') in ('speculate', 'commit', 'guard')
+                            for i in instrs)
+        self.unsafe = {id(i): names for i, names
+                       in zip(instrs, undefined_reads(func)) if names}
+
+        params = [a['name'] for a in func.get('args', [])]
+        names = []
+        for instr in instrs:
+            for name in [instr.get('dest')] + instr.get('args', []):
+                if name is not None and name not in params and \
+                        name not in names:
+                    names.append(name)
+        self.params = [mangle('v_', p) for p in params]
+        self.locals = [mangle('v_', n) for n in names]
+
+    def line(self, depth, text):
+        self.lines.append('    ' * depth + text)
+
+    def label_num(self, name):
+        return self.label_nums.setdefault(name, len(self.label_nums))
+
+    def state_vars(self):
+        """The variables that speculation saves and restores, as an
+        assignment target.
+        """
+        names = self.params + self.locals
+        if self.has_phi:
+            names += ['cur', 'last']
+        return '[{}]'.format(', '.join(names))
+
+    def error(self, depth, message):
+        self.line(depth, 'raise BrilError({!r})'.format(message))
+
+    def translate(self):
+        """Return the source code of the translated function.
+        """
+        self.line(0, 'def {}({}):'.format(
+            mangle('f_', self.func['name']), ', '.join(self.params)))
+        # Undefined variables hold None. Reads that might see one are
+        # checked (see `defined`).
+        if self.locals:
+            self.line(1, '{} = None'.format(' = '.join(self.locals)))
+        if not self.blocks:
+            self.line(1, 'return None')
+            return '\n'.join(self.lines) + '\n'
+        self.line(1, 'n = 0')
+        self.line(1, 'state = 0')
+        if self.has_phi:
+            self.line(1, 'cur = last = -1')
+        if self.has_spec:
+            self.line(1, 'spec = []')
+        self.line(1, 'try:')
+        self.line(2, 'while True:')
+        self.dispatch(3, 0, len(self.blocks))
+        self.line(1, 'finally:')
+        self.line(2, '_rt.count += n')
+        return '\n'.join(self.lines) + '\n'
+
+    def dispatch(self, depth, lo, hi):
+        """Emit a binary search on `state` for blocks `lo` to `hi`.
+        """
+        if hi - lo == 1:
+            self.block(depth, lo)
+            return
+        mid = (lo + hi) // 2
+        self.line(depth, 'if state < {}:'.format(mid))
+        self.dispatch(depth + 1, lo, mid)
+        self.line(depth, 'else:')
+        self.dispatch(depth + 1, mid, hi)
+
+    def block(self, depth, index):
+        label, instrs = self.blocks[index]
+        if instrs:
+            self.line(depth, 'n += {}'.format(len(instrs)))
+        if self.has_phi and label is not None:
+            self.line(depth, 'last = cur')
+            self.line(depth, 'cur = {}'.format(self.label_num(label)))
+        for instr in instrs[:-1]:
+            self.instr(depth, instr)
+        last = instrs[-1] if instrs else None
+        if last is not None and last['op'] in CONTROL_OPS:
+            self.control(depth, last, index + 1)
+        else:
+            if last is not None:
+                self.instr(depth, last)
+            self.goto(depth, index + 1)
+
+    def goto(self, depth, index):
+        """Continue with block `index`, or fall off the end of the
+        function.
+        """
+        if index < len(self.blocks):
+            self.line(depth, 'state = {}'.format(index))
+        else:
+            if self.has_spec:
+                self.line(depth, 'if spec:')
+                self.error(depth + 1, 'implicit return in speculative state')
+            self.line(depth, 'return None')
+
+    def check(self, depth, instr):
+        """Emit an error and return False if an instruction is malformed.
+        """
+        op = instr['op']
+        args = instr.get('args', [])
+        if op != 'const':
+            if op not in ARG_COUNTS:
+                self.error(depth, 'unknown opcode {}'.format(op))
+                return False
+            count = ARG_COUNTS[op]
+            if count is not None and len(args) != count:
+                self.error(depth, '{} takes {} argument(s); got {}'.format(
+                    op, count, len(args)))
+                return False
+        labels = instr.get('labels', [])
+        if op in LABEL_COUNTS and len(labels) != LABEL_COUNTS[op]:
+            self.error(depth, 'expecting {} labels; found {}'.format(
+                LABEL_COUNTS[op], len(labels)))
+            return False
+        for label in labels if op != 'phi' else []:
+            if label not in self.targets:
+                self.error(depth, 'label {} not found'.format(label))
+                return False
+        return True
+
+    def defined(self, depth, instr):
+        """Emit checks for the arguments that `undefined_reads` says
+        might be undefined.
+        """
+        for name in self.unsafe.get(id(instr), []):
+            self.line(depth, 'if {} is None:'.format(mangle('v_', name)))
+            self.error(depth + 1, 'undefined variable {}'.format(name))
+
+    def control(self, depth, instr, next_index):
+        if not self.check(depth, instr):
+            return
+        self.defined(depth, instr)
+        op = instr['op']
+        args = [mangle('v_', a) for a in instr.get('args', [])]
+        targets = [self.targets[l] for l in instr.get('labels', [])]
+        if op == 'jmp':
+            self.line(depth, 'state = {}'.format(targets[0]))
+        elif op == 'br':
+            self.line(depth, 'state = {} if {} else {}'.format(
+                targets[0], args[0], targets[1]))
+        elif op == 'ret':
+            if len(args) > 1:
+                return self.error(
+                    depth, 'ret takes 0 or 1 argument(s); got {}'.format(
+                        len(args)))
+            if self.has_spec:
+                self.line(depth, 'if spec:')
+                self.error(depth + 1, 'ret not allowed during speculation')
+            self.line(depth, 'return {}'.format(args[0] if args else 'None'))
+        elif op == 'guard':
+            self.line(depth, 'if {}:'.format(args[0]))
+            self.goto(depth + 1, next_index)
+            self.line(depth, 'else:')
+            self.line(depth + 1, 'if not spec:')
+            self.error(depth + 2, 'abort in non-speculative state')
+            self.line(depth + 1, '{} = spec.pop()'.format(self.state_vars()))
+            self.line(depth + 1, 'state = {}'.format(targets[0]))
+
+    def instr(self, depth, instr):
+        if not self.check(depth, instr):
+            return
+        self.defined(depth, instr)
+        op = instr['op']
+        args = [mangle('v_', a) for a in instr.get('args', [])]
+        dest = mangle('v_', instr['dest']) if 'dest' in instr else None
+
+        if op == 'const':
+            try:
+                value = const_value(instr)
+            except BrilError as exc:
+                return self.error(depth, str(exc))
+            if isinstance(value, float) and value != value or \
+                    value in (float('inf'), float('-inf')):
+                text = 'float({!r})'.format(repr(value))
+            else:
+                text = repr(value)
+            self.line(depth, '{} = {}'.format(dest, text))
+        elif op in INT_EXPRESSIONS:
+            self.line(depth, '{} = {}'.format(
+                dest, INT_EXPRESSIONS[op].format(*args)))
+            self.line(depth, 'if {0} > {1} or {0} < {2}:'.format(
+                dest, INT_MAX, INT_MIN))
+            self.line(depth + 1, '{0} = _wrap({0})'.format(dest))
+        elif op == 'div':
+            self.line(depth, '{} = _div({}, {})'.format(dest, *args))
+            self.line(depth, 'if {} > {}:'.format(dest, INT_MAX))
+            self.line(depth + 1, '{0} = _wrap({0})'.format(dest))
+        elif op in EXPRESSIONS:
+            if op == 'alloc' and not isinstance(instr.get('type'), dict):
+                return self.error(
+                    depth, 'cannot allocate non-pointer type {}'.format(
+                        instr.get('type')))
+            self.line(depth, '{} = {}'.format(
+                dest, EXPRESSIONS[op].format(*args)))
+        elif op == 'print':
+            if len(args) == 1:
+                text = '_fmt({})'.format(args[0])
+            else:
+                text = "' '.join([{}])".format(
+                    ', '.join('_fmt({})'.format(a) for a in args))
+            self.line(depth, "_write({} + '\\n')".format(text))
+        elif op == 'nop':
+            self.line(depth, 'pass')
+        elif op == 'free':
+            self.line(depth, '_free({})'.format(args[0]))
+        elif op in ('load', 'store'):
+            self.mem(depth, op, args, dest, instr['args'][0])
+        elif op == 'call':
+            self.call(depth, instr, args, dest)
+        elif op == 'phi':
+            self.phi(depth, instr, args, dest)
+        elif op == 'speculate':
+            self.line(depth, 'spec.append({})'.format(self.state_vars()))
+        elif op == 'commit':
+            self.line(depth, 'if not spec:')
+            self.error(depth + 1, 'commit in non-speculative state')
+            self.line(depth, 'del spec[:]')
+
+    def mem(self, depth, op, args, dest, ptr_name):
+        ptr = args[0]
+        self.line(depth, '_data = _storage.get({}.base)'.format(ptr))
+        self.line(depth, 'if _data is None or not 0 <= {0}.offset < '
+                         'len(_data):'.format(ptr))
+        self.line(depth + 1, '_heap.data({})  # Raises an error.'.format(ptr))
+        if op == 'store':
+            self.line(depth, '_data[{}.offset] = {}'.format(ptr, args[1]))
+        else:
+            self.line(depth, '{} = _data[{}.offset]'.format(dest, ptr))
+            self.line(depth, 'if {} is None:'.format(dest))
+            self.error(depth + 1, 'Pointer {} points to uninitialized '
+                                  'data'.format(ptr_name))
+
+    def call(self, depth, instr, args, dest):
+        name = instr['funcs'][0]
+        if name not in self.signatures:
+            return self.error(depth, 'no function of name {} found'.format(
+                name))
+        sig = self.signatures[name]
+        if sig is None:
+            return self.error(
+                depth, 'multiple functions of name {} found'.format(name))
+        nparams, type = sig
+        if nparams != len(args):
+            return self.error(
+                depth, 'function expected {} arguments, got {}'.format(
+                    nparams, len(args)))
+        if dest is not None and type is None:
+            return self.error(
+                depth, 'function with void return type used in value call')
+        if self.has_spec:
+            self.line(depth, 'if spec:')
+            self.error(depth + 1, 'call not allowed during speculation')
+        text = '{}({})'.format(mangle('f_', name), ', '.join(args))
+        if dest is None:
+            # A void function can still return a value.
+            self.line(depth, 'if {} is not None:'.format(text))
+            self.error(depth + 1, 'unexpected value returned without '
+                                  'destination')
+        else:
+            self.line(depth, '{} = {}'.format(dest, text))
+            self.line(depth, 'if {} is None:'.format(dest))
+            self.error(depth + 1, "non-void function (type: {}) doesn't "
+                                  "return anything".format(type))
+
+    def phi(self, depth, instr, args, dest):
+        labels = instr.get('labels', [])
+        if len(labels) != len(args):
+            return self.error(
+                depth, 'phi node has unequal numbers of labels and args')
+        seen = set()
+        keyword = 'if'
+        for label, arg in zip(labels, args):
+            if label in seen:
+                continue
+            seen.add(label)
+            self.line(depth, '{} last == {}:'.format(
+                keyword, self.label_num(label)))
+            self.line(depth + 1, '{} = {}'.format(dest, arg))
+            keyword = 'elif'
+        if keyword == 'elif':
+            self.line(depth, 'else:')
+            depth += 1
+        self.line(depth, 'if last < 0:')
+        self.error(depth + 1, 'phi node executed with no last label')
+        self.line(depth, '{} = None'.format(dest))
+
+
+def cache_key(func, signatures):
+    """Hash a function together with the signatures of its callees.
+    """
+    callees = sorted({i['funcs'][0] for i in func['instrs']
+                      if i.get('op') == 'call' and i.get('funcs')})
+    data = json.dumps([func, [[c, signatures.get(c, 'missing')]
+                              for c in callees]], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def compile_function(func, signatures):
+    """Translate and compile a Bril function, or fetch it from the cache.
+    Return a code object that defines the function when executed.
+    """
+    key = cache_key(func, signatures)
+    code = _CODE_CACHE.get(key)
+    if code is None:
+        source = Translator(func, signatures).translate()
+        code = compile(source, '<bril @{}>'.format(func['name']), 'exec')
+        _CODE_CACHE[key] = code
+    return code
+
+
+class Program(object):
+    """Translate a Bril program to Python and run it, writing `print`
+    output to `out`.
+    """
+
+    def __init__(self, program, out=sys.stdout):
+        self.out = out
+        self.heap = Heap()
+        self.count = 0
+        self.signatures = {}
+        funcs = {}
+        for func in program['functions']:
+            if func['name'] in self.signatures:
+                self.signatures[func['name']] = None
+            else:
+                self.signatures[func['name']] = signature(func)
+                funcs[func['name']] = func
+        self.namespace = {
+            '_rt': self,
+            '_heap': self.heap,
+            '_storage': self.heap.storage,
+            '_alloc': self.heap.alloc,
+            '_free': self.heap.free,
+            '_write': out.write,
+            '_fmt': format_value,
+            '_wrap': wrap,
+            '_div': trunc_div,
+            '_fdiv': float_div,
+            '_utf16': _utf16,
+            '_int2char': int2char,
+            '_Pointer': Pointer,
+            'BrilError': BrilError,
+        }
+        for func in funcs.values():
+            exec(compile_function(func, self.signatures), self.namespace)
+        self.funcs = funcs
+
+    def run(self, args):
+        """Run the `main` function with a list of arguments (strings or
+        Python values). Return the number of dynamic instructions
+        executed.
+        """
+        if 'main' not in self.signatures:
+            print('no main function defined, doing nothing', file=sys.stderr)
+            return 0
+        if self.signatures['main'] is None:
+            raise BrilError('multiple functions of name main found')
+        main = self.funcs['main']
+        params = main.get('args', [])
+        if len(args) != len(params):
+            raise BrilError(
+                'mismatched main argument arity: expected {}; got {}'.format(
+                    len(params), len(args)))
+        values = [parse_arg(arg, param['type'])
+                  for arg, param in zip(args, params)]
+        try:
+            self.namespace[mangle('f_', 'main')](*values)
+        except (TypeError, AttributeError, KeyError) as exc:
+            # We do not check types or definedness, so ill-formed programs
+            # end up here.
+            raise BrilError('type error: {}'.format(exc))
+        if self.heap.storage:
+            raise BrilError('Some memory locations have not been freed by '
+                            'end of execution.')
+        return self.count
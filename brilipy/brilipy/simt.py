@@ -0,0 +1,754 @@
+"""Run one Bril program on many inputs at once, SIMT style, with NumPy.
+
+Each *lane* is one run of the program with its own arguments. Every
+variable holds a NumPy array with one element per lane: `int64` for
+`int`, `float64` for `float`, `bool` for `bool`, and `uint32` code points
+for `char`. Pointers are pairs of `int64` arrays. An instruction executes
+for all the lanes that are currently *active* at once.
+
+Control flow uses the classic reconvergence stack. Each stack entry is a
+block to run, a mask of lanes that run it, and the block where those
+lanes reconverge with the rest. When a `br` sends active lanes different
+ways, the lanes split into one entry per target, and they join up again
+at the branch's immediate post-dominator. Lanes leave when they return
+(or hit an error); a `call` runs the callee for all active lanes
+together.
+
+Each lane gets its own `print` output, dynamic instruction count, and
+error, so the results match separate runs of `brili`. Speculation is not
+supported.
+
+This module needs NumPy, which the rest of `brilipy` does not.
+"""
+import sys
+
+import numpy as np
+
+from .interp import (
+    BrilError, Pointer, ARG_COUNTS, const_value, format_value, parse_arg,
+    split_blocks, undefined_reads,
+)
+
+# The "block" after the end of a function.
+EXIT = -1
+
+# Keys in the environment for each lane's current and previous labels
+# (for phi-nodes), which cannot clash with Bril variable names.
+_CUR = ('cur',)
+_LAST = ('last',)
+
+
+def _defined(name):
+    """The environment key for the mask of lanes where a variable is
+    defined. Only variables that might be undefined get one.
+    """
+    return ('defined', name)
+
+DTYPES = {
+    'int': np.int64,
+    'float': np.float64,
+    'bool': np.bool_,
+    'char': np.uint32,
+}
+
+LABEL_COUNTS = {'jmp': 1, 'br': 2}
+
+
+class Ptr(object):
+    """Pointers for every lane: allocation numbers and offsets.
+    """
+    __slots__ = ('base', 'offset')
+
+    def __init__(self, base, offset):
+        self.base = base
+        self.offset = offset
+
+
+def select(mask, new, old):
+    """Take `new` in the lanes in `mask` and `old` elsewhere.
+    """
+    if old is None:
+        return new
+    if isinstance(new, Ptr):
+        return Ptr(np.where(mask, new.base, old.base),
+                   np.where(mask, new.offset, old.offset))
+    return np.where(mask, new, old)
+
+
+def empty(type, shape):
+    """Make an array (or pair of arrays) to hold values of a Bril type.
+    """
+    if isinstance(type, dict):
+        return Ptr(np.zeros(shape, np.int64), np.zeros(shape, np.int64))
+    return np.zeros(shape, DTYPES[type])
+
+
+def lane_value(val, lane):
+    """Get one lane's value as the Python value `interp.py` would use.
+    """
+    if isinstance(val, Ptr):
+        return Pointer(val.base[lane], val.offset[lane])
+    item = val[lane].item()
+    if val.dtype == np.uint32:
+        return chr(item)
+    return item
+
+
+def utf16_key(chars):
+    """Map code points to integers that sort in UTF-16 code unit order,
+    the way JavaScript compares strings.
+    """
+    chars = chars.astype(np.int64)
+    astral = chars >= 0x10000
+    high = (chars >= 0xe000) & ~astral
+    return np.where(astral, 0xd800 + (chars - 0x10000),
+                    np.where(high, chars + 0x100000, chars))
+
+
+def _compare(fn):
+    return lambda a, b: fn(utf16_key(a), utf16_key(b))
+
+
+BINARY_OPS = {
+    'add': np.add, 'sub': np.subtract, 'mul': np.multiply,
+    'lt': np.less, 'le': np.less_equal, 'gt': np.greater,
+    'ge': np.greater_equal, 'eq': np.equal,
+    'and': np.logical_and, 'or': np.logical_or,
+    'fadd': np.add, 'fsub': np.subtract, 'fmul': np.multiply,
+    'fdiv': np.divide,
+    'flt': np.less, 'fle': np.less_equal, 'fgt': np.greater,
+    'fge': np.greater_equal, 'feq': np.equal,
+    'ceq': np.equal,
+    'clt': _compare(np.less), 'cle': _compare(np.less_equal),
+    'cgt': _compare(np.greater), 'cge': _compare(np.greater_equal),
+}
+
+UNARY_OPS = {
+    'id': lambda a: a,
+    'not': np.logical_not,
+    'char2int': lambda a: a.astype(np.int64),
+}
+
+
+class Region(object):
+    """One `alloc` executed by a set of lanes. Each lane has its own
+    object of its own size, stored as a row of `values`.
+    """
+
+    def __init__(self, type, sizes, live, numbers):
+        width = int(sizes[live].max())
+        self.values = empty(type, (len(sizes), width))
+        self.init = np.zeros((len(sizes), width), np.bool_)
+        self.sizes = sizes
+        self.live = live
+        self.numbers = numbers  # Each lane's allocation number.
+
+
+def _failing(message):
+    """Make a closure that reports an error for the active lanes when it
+    is executed, for problems `brili` would only notice at run time.
+    """
+    def run(env, active):
+        raise BrilError(message)
+    return run
+
+
+class Function(object):
+    """A decoded Bril function.
+
+    `blocks` is a list of (label, body, control, size) tuples, as in
+    `interp.py`: `label` is the block's label number (or None), `body` is
+    a tuple of closures that each take the environment and the mask of
+    active lanes, `control` is the block's final `jmp`, `br`, or `ret`
+    (or None), and `size` is the number of Bril instructions in the block.
+    `ipdom` holds each block's immediate post-dominator (or `EXIT`).
+
+    Variables that `undefined_reads` says might be read before they are
+    defined are `tracked`: the body keeps a mask of the lanes where each
+    is defined, and checks it before those reads.
+    """
+
+    def __init__(self, func, interp):
+        self.name = func['name']
+        self.params = [a['name'] for a in func.get('args', [])]
+        self.type = func.get('type')
+        self.has_phi = any(i.get('op') == 'phi' for i in func['instrs'])
+        chunks = split_blocks(func['instrs'])
+        self.label_index = {}
+        for i, (label, _) in enumerate(chunks):
+            if label is not None:
+                self.label_index.setdefault(label, i)
+        self.label_nums = {}
+
+        unsafe = {id(i): names for i, names
+                  in zip(func['instrs'], undefined_reads(func)) if names}
+        self.tracked = {n for names in unsafe.values() for n in names}
+        changed = True
+        while changed:  # A tracked phi's arguments need tracking, too.
+            changed = False
+            for instr in func['instrs']:
+                if instr.get('op') == 'phi' and \
+                        instr.get('dest') in self.tracked and \
+                        not self.tracked.issuperset(instr.get('args', [])):
+                    self.tracked.update(instr.get('args', []))
+                    changed = True
+
+        self.blocks = []
+        for label, instrs in chunks:
+            control = None
+            if instrs and instrs[-1]['op'] in ('jmp', 'br', 'ret'):
+                control = self.decode_control(instrs[-1])
+            body = []
+            for instr in instrs:
+                if id(instr) in unsafe:
+                    body.append(interp.decode_check(unsafe[id(instr)]))
+                if control is not None and instr is instrs[-1]:
+                    break
+                body.append(interp.decode(instr, self))
+                if instr.get('dest') in self.tracked:
+                    body.append(interp.decode_track(instr, self))
+            self.blocks.append((
+                self.label_num(label) if label is not None else None,
+                tuple(body),
+                control,
+                len(instrs),
+            ))
+        self.succs = [self.successors(i) for i in range(len(self.blocks))]
+        self.ipdom = self.post_dominators()
+
+    def label_num(self, name):
+        return self.label_nums.setdefault(name, len(self.label_nums))
+
+    def decode_control(self, instr):
+        """Turn a `jmp`, `br`, or `ret` into a tuple of the opcode and its
+        operands, or an ('error', message) pair if it is malformed.
+        """
+        op = instr['op']
+        args = instr.get('args', [])
+        labels = instr.get('labels', [])
+        if op in LABEL_COUNTS and len(labels) != LABEL_COUNTS[op]:
+            return ('error', 'expecting {} labels; found {}'.format(
+                LABEL_COUNTS[op], len(labels)))
+        for label in labels:
+            if label not in self.label_index:
+                return ('error', 'label {} not found'.format(label))
+        count = ARG_COUNTS[op]
+        if count is not None and len(args) != count:
+            return ('error', '{} takes {} argument(s); got {}'.format(
+                op, count, len(args)))
+        if op == 'ret' and len(args) > 1:
+            return ('error', 'ret takes 0 or 1 argument(s); got {}'.format(
+                len(args)))
+        targets = [self.label_index[l] for l in labels]
+        return (op,) + tuple(args) + tuple(targets)
+
+    def successors(self, index):
+        control = self.blocks[index][2]
+        if control is None:
+            return [index + 1] if index + 1 < len(self.blocks) else []
+        elif control[0] == 'jmp':
+            return [control[1]]
+        elif control[0] == 'br':
+            return [control[2], control[3]]
+        return []
+
+    def post_dominators(self):
+        """Find each block's immediate post-dominator (or `EXIT`).
+        """
+        nodes = set(range(len(self.blocks)))
+        pdom = {i: set(nodes) for i in nodes}
+        changed = True
+        while changed:
+            changed = False
+            for i in reversed(range(len(self.blocks))):
+                succs = self.succs[i]
+                new = set.intersection(*[pdom[s] for s in succs]) \
+                    if succs else set()
+                new = new | {i}
+                if new != pdom[i]:
+                    pdom[i] = new
+                    changed = True
+
+        # Blocks in infinite loops keep every block as a post-dominator.
+        # Their lanes can only reconverge at the exit.
+        reach = {i for i in nodes if not self.succs[i]}
+        changed = True
+        while changed:
+            changed = False
+            for i in nodes - reach:
+                if any(s in reach for s in self.succs[i]):
+                    reach.add(i)
+                    changed = True
+
+        ipdom = []
+        for i in range(len(self.blocks)):
+            strict = pdom[i] - {i}
+            if not strict or i not in reach:
+                ipdom.append(EXIT)
+            else:
+                ipdom.append(max(strict, key=lambda d: len(pdom[d])))
+        return ipdom
+
+
+class BatchInterpreter(object):
+    """Run a Bril program on `nlanes` sets of arguments at once.
+    """
+
+    def __init__(self, program, nlanes):
+        self.n = nlanes
+        self.funcs = {}
+        for func in program['functions']:
+            if func['name'] in self.funcs:
+                self.funcs[func['name']] = None  # Reported when called.
+            else:
+                self.funcs[func['name']] = func
+        self.decoded = {}
+        self.alive = np.ones(nlanes, np.bool_)
+        self.failures = 0
+        self.outputs = [[] for _ in range(nlanes)]
+        self.counts = np.zeros(nlanes, np.int64)
+        self.errors = [None] * nlanes
+        self.regions = {}
+        self.alloc_counts = np.zeros(nlanes, np.int64)
+
+    def function(self, name):
+        if name not in self.decoded:
+            self.decoded[name] = Function(self.funcs[name], self)
+        return self.decoded[name]
+
+    def fail(self, lanes, message):
+        """Stop the given lanes with an error. `message` is a string or a
+        function from a lane number to a string.
+        """
+        lanes = lanes & self.alive
+        for lane in np.flatnonzero(lanes):
+            self.errors[lane] = message if isinstance(message, str) \
+                else message(lane)
+        self.alive &= ~lanes
+        self.failures += 1
+
+    # Decoding.
+
+    def decode(self, instr, func):
+        """Turn an instruction into a closure that executes it for the
+        active lanes.
+        """
+        op = instr['op']
+        args = instr.get('args', [])
+        dest = instr.get('dest')
+        n = self.n
+
+        if op != 'const':
+            if op not in ARG_COUNTS:
+                return _failing('unknown opcode {}'.format(op))
+            count = ARG_COUNTS[op]
+            if count is not None and len(args) != count:
+                return _failing('{} takes {} argument(s); got {}'.format(
+                    op, count, len(args)))
+
+        if op == 'const':
+            try:
+                value = const_value(instr)
+            except BrilError as exc:
+                return _failing(str(exc))
+            if isinstance(value, str):
+                value = ord(value)
+            val = np.full(n, value, DTYPES[instr['type']])
+
+            def run(env, active):
+                old = env.get(dest)
+                env[dest] = val if old is None else np.where(active, val, old)
+        elif op in BINARY_OPS:
+            fn = BINARY_OPS[op]
+            lhs, rhs = args
+
+            def run(env, active):
+                val = fn(env[lhs], env[rhs])
+                old = env.get(dest)
+                env[dest] = val if old is None else np.where(active, val, old)
+        elif op in UNARY_OPS or op == 'ptradd':
+            if op == 'ptradd':
+                def fn(ptr, off):
+                    return Ptr(ptr.base, ptr.offset + off)
+            else:
+                fn = UNARY_OPS[op]
+
+            def run(env, active):
+                env[dest] = select(active, fn(*[env[a] for a in args]),
+                                   env.get(dest))
+        elif op == 'div':
+            return self.decode_div(instr)
+        elif op == 'int2char':
+            src, = args
+
+            def run(env, active):
+                val = env[src]
+                bad = active & ((val < 0) | (val > 1114111) |
+                                ((val > 55295) & (val < 57344)))
+                if bad.any():
+                    self.fail(bad, lambda lane: 'value {} cannot be '
+                                                'converted to char'.format(
+                                                    val[lane]))
+                env[dest] = select(active, val.astype(np.uint32),
+                                   env.get(dest))
+        elif op == 'print':
+            outputs = self.outputs
+
+            def run(env, active):
+                vals = [env[a] for a in args]
+                for lane in np.flatnonzero(active):
+                    outputs[lane].append(' '.join(
+                        format_value(lane_value(v, lane)) for v in vals))
+        elif op == 'nop':
+            def run(env, active):
+                pass
+        elif op == 'call':
+            return self.decode_call(instr)
+        elif op == 'alloc':
+            return self.decode_alloc(instr)
+        elif op in ('load', 'store', 'free'):
+            def run(env, active):
+                self.memory(env, instr, [env[a] for a in args], active)
+        elif op == 'phi':
+            return self.decode_phi(instr, func)
+        else:
+            return _failing('speculation is not supported in batch mode')
+        return run
+
+    def decode_div(self, instr):
+        dest = instr['dest']
+        lhs, rhs = instr['args']
+
+        def run(env, active):
+            a = env[lhs]
+            b = env[rhs]
+            zero = active & (b == 0)
+            if zero.any():
+                self.fail(zero, 'division by zero')
+            b = np.where(b == 0, 1, b)
+            # Round toward zero, like `BigInt` division.
+            quot = a // b
+            quot = quot + (((a - quot * b) != 0) & ((a < 0) != (b < 0)))
+            env[dest] = select(active, quot, env.get(dest))
+        return run
+
+    def decode_call(self, instr):
+        name = instr['funcs'][0]
+        args = instr.get('args', [])
+        dest = instr.get('dest')
+        if name not in self.funcs:
+            return _failing('no function of name {} found'.format(name))
+        callee = self.funcs[name]
+        if callee is None:
+            return _failing('multiple functions of name {} found'.format(
+                name))
+        if len(callee.get('args', [])) != len(args):
+            return _failing('function expected {} arguments, got {}'.format(
+                len(callee.get('args', [])), len(args)))
+        if dest is not None and callee.get('type') is None:
+            return _failing('function with void return type used in value '
+                            'call')
+        novalue = "non-void function (type: {}) doesn't return " \
+                  "anything".format(callee.get('type'))
+
+        def run(env, active):
+            val, valued = self.execute(self.function(name),
+                                       [env[a] for a in args], active)
+            done = active & self.alive
+            if dest is None:
+                if (done & valued).any():
+                    self.fail(done & valued, 'unexpected value returned '
+                                             'without destination')
+            else:
+                if (done & ~valued).any():
+                    self.fail(done & ~valued, novalue)
+                if val is not None:
+                    env[dest] = select(done, val, env.get(dest))
+        return run
+
+    def decode_phi(self, instr, func):
+        dest = instr['dest']
+        labels = instr.get('labels', [])
+        args = instr.get('args', [])
+        if len(labels) != len(args):
+            return _failing('phi node has unequal numbers of labels and args')
+        sources = []
+        for label, arg in zip(labels, args):
+            if label not in [l for l, _ in sources]:
+                sources.append((label, arg))
+
+        def run(env, active):
+            last = env[_LAST]
+            if (active & (last < 0)).any():
+                self.fail(active & (last < 0), 'phi node executed with no '
+                                               'last label')
+            for label, arg in sources:
+                if label in func.label_nums and arg in env:
+                    lanes = active & (last == func.label_nums[label])
+                    if lanes.any():
+                        env[dest] = select(lanes, env[arg], env.get(dest))
+        return run
+
+    def decode_check(self, names):
+        """Make a closure that stops the active lanes where any of the
+        (tracked) variables `names` is undefined.
+        """
+        def run(env, active):
+            for name in names:
+                mask = env.get(_defined(name))
+                missing = active if mask is None else active & ~mask
+                if missing.any():
+                    self.fail(missing, 'undefined variable {}'.format(name))
+        return run
+
+    def decode_track(self, instr, func):
+        """Make a closure that updates the mask of lanes where a tracked
+        variable is defined, after the instruction that assigns it.
+        """
+        key = _defined(instr['dest'])
+        if instr['op'] != 'phi':
+            def run(env, active):
+                mask = env.get(key)
+                env[key] = active if mask is None else active | mask
+            return run
+
+        sources = []
+        for label, arg in zip(instr.get('labels', []), instr.get('args', [])):
+            if label in func.label_nums and \
+                    label not in [l for l, _ in sources]:
+                sources.append((func.label_nums[label], _defined(arg)))
+
+        def run(env, active):
+            last = env[_LAST]
+            new = np.zeros(self.n, np.bool_)
+            for num, arg_key in sources:
+                mask = env.get(arg_key)
+                if mask is not None:
+                    new |= active & (last == num) & mask
+            old = env.get(key)
+            env[key] = new if old is None else np.where(active, new, old)
+        return run
+
+    def decode_alloc(self, instr):
+        type = instr.get('type')
+        if not isinstance(type, dict):
+            return _failing('cannot allocate non-pointer type {}'.format(
+                type))
+        dest = instr['dest']
+        amt, = instr['args']
+
+        def run(env, active):
+            sizes = env[amt]
+            bad = active & (sizes <= 0)
+            if bad.any():
+                self.fail(bad, lambda lane: 'must allocate a positive amount '
+                                            'of memory: {} <= 0'.format(
+                                                sizes[lane]))
+            live = active & self.alive
+            if not live.any():
+                return
+            base = len(self.regions)
+            while base in self.regions:
+                base += 1
+            self.regions[base] = Region(type['ptr'], np.where(live, sizes, 0),
+                                        live, self.alloc_counts.copy())
+            self.alloc_counts[live] += 1
+            env[dest] = select(live, Ptr(np.full(self.n, base, np.int64),
+                                         np.zeros(self.n, np.int64)),
+                               env.get(dest))
+        return run
+
+    # Execution.
+
+    def execute(self, func, args, mask):
+        """Run a function for the lanes in `mask`. Return the return
+        values (or None if no lane returned a value) and the mask of
+        lanes that returned a value.
+        """
+        env = dict(zip(func.params, args))
+        for name in func.tracked.intersection(func.params):
+            env[_defined(name)] = np.ones(self.n, np.bool_)
+        retval = None
+        valued = np.zeros(self.n, np.bool_)
+        returned = np.zeros(self.n, np.bool_)
+        if func.has_phi:
+            env[_CUR] = np.full(self.n, -1, np.int64)
+            env[_LAST] = env[_CUR]
+        counts = self.counts
+        blocks = func.blocks
+        end = len(blocks)
+
+        stack = [[0, mask, EXIT]] if blocks else []
+        while stack:
+            entry = stack[-1]
+            index, emask, rpc = entry
+            if index == rpc:
+                stack.pop()
+                continue
+            active = emask & self.alive & ~returned
+            if not active.any():
+                stack.pop()
+                continue
+
+            label, body, control, size = blocks[index]
+            np.add(counts, size, out=counts, where=active)
+            if func.has_phi and label is not None:
+                env[_LAST] = np.where(active, env[_CUR], env[_LAST])
+                env[_CUR] = np.where(active, label, env[_CUR])
+
+            failures = self.failures
+            try:
+                for run in body:
+                    run(env, active)
+                    if self.failures != failures:
+                        failures = self.failures
+                        active = active & self.alive
+                op = control[0] if control is not None else None
+                if op == 'error':
+                    raise BrilError(control[1])
+                elif op == 'br' or op == 'ret' and len(control) > 1:
+                    val = env[control[1]]  # The condition or return value.
+            except BrilError as exc:
+                self.fail(active, str(exc))
+                continue
+            except KeyError as exc:
+                self.fail(active, 'undefined variable {}'.format(exc.args[0]))
+                continue
+            except (TypeError, AttributeError, ValueError) as exc:
+                self.fail(active, 'type error: {}'.format(exc))
+                continue
+
+            if op == 'jmp':
+                entry[0] = control[1]
+            elif op == 'br':
+                _, _, then_index, else_index = control
+                then_lanes = active & val
+                else_lanes = active & ~val
+                if not else_lanes.any():
+                    entry[0] = then_index
+                elif not then_lanes.any():
+                    entry[0] = else_index
+                else:
+                    # Diverge until the immediate post-dominator.
+                    stack.pop()
+                    join = func.ipdom[index]
+                    if join != rpc:
+                        stack.append([join, emask, rpc])
+                    for target, lanes in ((else_index, else_lanes),
+                                          (then_index, then_lanes)):
+                        if target != join:
+                            stack.append([target, lanes, join])
+            elif op == 'ret' or index + 1 == end:
+                if op == 'ret' and len(control) > 1:
+                    retval = select(active, val, retval)
+                    valued |= active
+                returned |= active
+                stack.pop()
+            else:
+                entry[0] = index + 1
+        return retval, valued
+
+    def memory(self, env, instr, args, active):
+        """Execute a `load`, `store`, or `free`, one allocation at a time.
+        """
+        op = instr['op']
+        ptr = args[0]
+        result = empty(instr['type'], self.n) if op == 'load' else None
+        for base in np.unique(ptr.base[active]):
+            lanes = active & (ptr.base == base)
+            region = self.regions.get(int(base))
+            if region is None:
+                self.fail(lanes, 'Uninitialized heap location {} and/or '
+                                 'illegal offset'.format(base))
+                continue
+            if op == 'free':
+                ok = lanes & region.live & (ptr.offset == 0)
+                self.fail(lanes & ~ok, lambda lane: (
+                    'Tried to free illegal memory location base: {}, '
+                    'offset: {}. Offset must be 0.').format(
+                        region.numbers[lane], ptr.offset[lane]))
+                region.live = region.live & ~ok
+                if not region.live.any():
+                    del self.regions[int(base)]
+                continue
+
+            ok = lanes & region.live & (ptr.offset >= 0) & \
+                (ptr.offset < region.sizes)
+            self.fail(lanes & ~ok, lambda lane: (
+                'Uninitialized heap location {} and/or illegal offset '
+                '{}').format(region.numbers[lane], ptr.offset[lane]))
+            idx = np.flatnonzero(ok)
+            offs = ptr.offset[idx]
+            if op == 'store':
+                val = args[1]
+                if isinstance(val, Ptr):
+                    region.values.base[idx, offs] = val.base[idx]
+                    region.values.offset[idx, offs] = val.offset[idx]
+                else:
+                    region.values[idx, offs] = val[idx]
+                region.init[idx, offs] = True
+            else:
+                uninit = np.zeros(self.n, np.bool_)
+                uninit[idx] = ~region.init[idx, offs]
+                self.fail(uninit, 'Pointer {} points to uninitialized '
+                                  'data'.format(instr['args'][0]))
+                if isinstance(result, Ptr):
+                    result.base[idx] = region.values.base[idx, offs]
+                    result.offset[idx] = region.values.offset[idx, offs]
+                else:
+                    result[idx] = region.values[idx, offs]
+        if op == 'load':
+            env[instr['dest']] = select(active, result,
+                                        env.get(instr['dest']))
+
+    def run(self, arg_sets):
+        """Run `main` once per lane, where `arg_sets` holds each lane's
+        arguments. Return a list with each lane's `print` output, counts
+        (as in `brilipy.run`), and error message (or None).
+        """
+        if 'main' not in self.funcs:
+            print('no main function defined, doing nothing', file=sys.stderr)
+            return [('', {'total_dyn_inst': 0}, None)] * self.n
+        main = self.funcs['main']
+        if main is None:
+            self.fail(self.alive, 'multiple functions of name main found')
+        else:
+            params = main.get('args', [])
+            columns = [empty(p['type'], self.n) for p in params]
+            for lane, args in enumerate(arg_sets):
+                lane_mask = np.arange(self.n) == lane
+                if len(args) != len(params):
+                    self.fail(lane_mask,
+                              'mismatched main argument arity: expected {}; '
+                              'got {}'.format(len(params), len(args)))
+                    continue
+                try:
+                    for column, arg, param in zip(columns, args, params):
+                        val = parse_arg(arg, param['type'])
+                        column[lane] = ord(val) if isinstance(val, str) \
+                            else val
+                except BrilError as exc:
+                    self.fail(lane_mask, str(exc))
+
+            with np.errstate(all='ignore'):
+                self.execute(self.function('main'), columns,
+                             self.alive.copy())
+            for region in self.regions.values():
+                self.fail(region.live, 'Some memory locations have not been '
+                                       'freed by end of execution.')
+
+        return [
+            (''.join(line + '\n' for line in self.outputs[lane]),
+             {'total_dyn_inst': int(self.counts[lane])},
+             self.errors[lane])
+            for lane in range(self.n)
+        ]
+
+
+def run_batch(program, arg_sets):
+    """Run a Bril program (as parsed JSON) once for each list of arguments
+    in `arg_sets`, all at the same time. Return a list of (output, counts,
+    error) triples, one per argument list, where `error` is None if the
+    run succeeded.
+    """
+    return BatchInterpreter(program, len(arg_sets)).run(list(arg_sets))
@@ -0,0 +1,267 @@
+"""Points-to and alias analysis for Bril's memory extension.
+
+Every `alloc` instruction is an allocation *site*. A pointer variable
+points to a set of abstract locations: a site plus a constant offset
+(tracked through `ptradd` when the offset is a known constant). Pointers
+passed in as arguments point to `ARG`: they existed before the function
+started, so they cannot alias anything it allocates. Other pointers we
+know nothing about (loaded pointers and call results) point to
+`UNKNOWN`, which may alias any site whose pointers escape the function.
+
+A site inside a loop stands for many objects at run time, so each
+location also records whether it refers to the most recent object
+allocated at its site. Only such "fresh" locations can must-alias.
+"""
+import json
+import sys
+from collections import namedtuple
+
+from cfg import block_map, add_entry, add_terminators
+from df import Analysis, df_worklist
+from form_blocks import form_blocks
+
+# An abstract memory location. `offset` is None when it is not a known
+# constant.
+Loc = namedtuple('Loc', ['site', 'offset', 'fresh'])
+
+UNKNOWN = Loc('?', None, False)
+ARG = Loc('arg', None, False)
+
+
+def is_ptr(type):
+    return isinstance(type, dict) and 'ptr' in type
+
+
+def _widen(locs):
+    """Forget the offsets of sites that appear with more than one offset,
+    so that pointers bumped around a loop reach a fixed point.
+    """
+    offsets = {}
+    for l in locs:
+        offsets.setdefault(l.site, set()).add(l.offset)
+    return frozenset(l._replace(offset=None)
+                     if len(offsets[l.site]) > 1 else l for l in locs)
+
+
+def pts_merge(states):
+    """Merge (pointer, constant) states: union the points-to sets and
+    keep only the constants that agree. `None` is a state we have not
+    computed yet.
+    """
+    states = [s for s in states if s is not None]
+    if not states:
+        return None
+    ptrs = {}
+    consts = dict(states[0][1])
+    for p, c in states:
+        for var, locs in p.items():
+            ptrs[var] = ptrs.get(var, frozenset()) | locs
+        consts = {v: n for v, n in consts.items() if c.get(v) == n}
+    return ({v: _widen(locs) for v, locs in ptrs.items()}, consts)
+
+
+def pts_step(state, instr, site):
+    """Apply one instruction to a (pointers, constants) state, in place.
+    `site` names the allocation site if `instr` is an `alloc`.
+    """
+    ptrs, consts = state
+    if 'dest' not in instr:
+        return
+    dest = instr['dest']
+    op = instr['op']
+    args = instr.get('args', [])
+
+    consts.pop(dest, None)
+    new = None
+    if op == 'const' and instr.get('type') == 'int':
+        consts[dest] = instr['value']
+    elif op == 'alloc':
+        # Older objects from this site are no longer the fresh one.
+        for var, locs in ptrs.items():
+            if any(l.site == site and l.fresh for l in locs):
+                ptrs[var] = frozenset(l._replace(fresh=False)
+                                      if l.site == site else l
+                                      for l in locs)
+        new = frozenset([Loc(site, 0, True)])
+    elif op == 'ptradd':
+        delta = consts.get(args[1])
+        new = frozenset(
+            l if l in (UNKNOWN, ARG) else l._replace(
+                offset=None if l.offset is None or delta is None
+                else l.offset + delta)
+            for l in ptrs.get(args[0], frozenset([UNKNOWN]))
+        )
+    elif op == 'id' and is_ptr(instr.get('type')):
+        new = ptrs.get(args[0], frozenset([UNKNOWN]))
+    elif op == 'id' and args[0] in consts:
+        consts[dest] = consts[args[0]]
+    elif op == 'phi' and is_ptr(instr.get('type')):
+        new = frozenset().union(
+            *(ptrs.get(a, frozenset([UNKNOWN])) for a in args))
+    elif is_ptr(instr.get('type')):
+        new = frozenset([UNKNOWN])  # A `load` or a `call`.
+
+    if new is None:
+        ptrs.pop(dest, None)
+    else:
+        ptrs[dest] = new
+
+
+class PointsTo(object):
+    """The result of the points-to analysis for one function.
+
+    `blocks` is the function's CFG (with an entry block and terminators
+    added); its instructions are the same objects as the function's.
+    Query the points-to set of a variable just before an instruction with
+    `pts(instr, var)` and test pairs of sets with `may_alias` and
+    `must_alias`.
+    """
+
+    def __init__(self, func):
+        self.blocks = block_map(form_blocks(func['instrs']))
+        add_entry(self.blocks)
+        add_terminators(self.blocks)
+
+        # Name the allocation sites.
+        self.sites = {}
+        for block in self.blocks.values():
+            for instr in block:
+                if instr.get('op') == 'alloc':
+                    self.sites[id(instr)] = 'alloc{}'.format(
+                        len(self.sites) + 1)
+
+        init_ptrs = {a['name']: frozenset([ARG])
+                     for a in func.get('args', []) if is_ptr(a['type'])}
+
+        def transfer(block, in_):
+            if in_ is None:
+                return None
+            state = (dict(in_[0]), dict(in_[1]))
+            for instr in block:
+                pts_step(state, instr, self.sites.get(id(instr)))
+            return state
+
+        def merge(states):
+            states = list(states)
+            if not states:  # The entry.
+                return (dict(init_ptrs), {})
+            return pts_merge(states)
+
+        in_, _ = df_worklist(self.blocks, Analysis(
+            True, init=None, merge=merge, transfer=transfer,
+        ))
+
+        # Record the state before every instruction.
+        self._before = {}
+        for name, block in self.blocks.items():
+            ptrs, consts = in_[name] or ({}, {})
+            state = (dict(ptrs), dict(consts))
+            for instr in block:
+                self._before[id(instr)] = state
+                state = (dict(state[0]), dict(state[1]))
+                pts_step(state, instr, self.sites.get(id(instr)))
+
+        self.escaping = self._find_escaping()
+
+    def pts(self, instr, var):
+        """The locations `var` may point to just before `instr`.
+        """
+        return self._before[id(instr)][0].get(var, frozenset([UNKNOWN]))
+
+    def const(self, instr, var):
+        """The constant integer value of `var` just before `instr`, or
+        None if it is not known.
+        """
+        return self._before[id(instr)][1].get(var)
+
+    def _find_escaping(self):
+        """Find the sites whose pointers leave the function: passed to a
+        call, returned, or stored into memory.
+        """
+        out = set()
+        for block in self.blocks.values():
+            for instr in block:
+                op = instr.get('op')
+                if op in ('call', 'ret'):
+                    leaked = instr.get('args', [])
+                elif op == 'store':
+                    leaked = instr['args'][1:]
+                else:
+                    continue
+                for var in leaked:
+                    out.update(l.site for l in self.pts(instr, var))
+        out.discard(UNKNOWN.site)
+        out.discard(ARG.site)
+        return out
+
+    def escapes(self, loc):
+        return loc in (UNKNOWN, ARG) or loc.site in self.escaping
+
+    def may_alias(self, a, b, offsets=True):
+        """Could pointers with these points-to sets refer to the same
+        memory? With `offsets=False`, ask whether they could point into
+        the same object instead.
+        """
+        for la in a:
+            for lb in b:
+                if la is ARG or lb is ARG:
+                    if la.site in ('arg', '?') and lb.site in ('arg', '?'):
+                        return True
+                elif la is UNKNOWN or lb is UNKNOWN:
+                    if self.escapes(la) and self.escapes(lb):
+                        return True
+                elif la.site == lb.site and (
+                        not offsets or
+                        la.offset is None or lb.offset is None or
+                        la.offset == lb.offset):
+                    return True
+        return False
+
+    def must_alias(self, a, b):
+        if len(a) != 1 or len(b) != 1:
+            return False
+        la, = a
+        lb, = b
+        return la == lb and la.offset is not None and la.fresh
+
+    def same_object(self, a, b):
+        """Do both sets definitely refer to the same allocation (at any
+        offsets)?
+        """
+        if len(a) != 1 or len(b) != 1:
+            return False
+        la, = a
+        lb, = b
+        return la.site == lb.site and la.fresh and lb.fresh
+
+
+def fmt_locs(locs):
+    return ', '.join(sorted(
+        '{}{}{}'.format(
+            l.site,
+            '+?' if l.offset is None else '+{}'.format(l.offset),
+            '' if l.fresh else '*',
+        ) for l in locs
+    ))
+
+
+def print_pts(bril):
+    """Print the points-to set of every pointer-typed destination just
+    after it is assigned.
+    """
+    for func in bril['functions']:
+        info = PointsTo(func)
+        print('@{}:'.format(func['name']))
+        for block in info.blocks.values():
+            for i, instr in enumerate(block[:-1]):
+                if 'dest' in instr and is_ptr(instr.get('type')):
+                    print('  {}: {}'.format(
+                        instr['dest'],
+                        fmt_locs(info.pts(block[i + 1], instr['dest'])),
+                    ))
+        print('  escaping: {}'.format(
+            ', '.join(sorted(info.escaping)) or '∅'))
+
+
+if __name__ == '__main__':
+    print_pts(json.load(sys.stdin))
@@ -1,17 +1,32 @@
 """Form a basic-block-based control-flow graph for a Bril function and
 emit a GraphViz file.
+
+With `--profile`, color each block by how often it ran and label each
+edge with how often it was taken, using a sidecar from `brilipy
+--profile`.
 """
 
+import argparse
 from form_blocks import form_blocks
 import json
 import sys
 from cfg import block_map, successors, add_terminators
+from util import load_profile
+
+def heat_color(count, hottest):
+    """Pick a fill color between white (never ran) and red (ran as often
+    as the hottest block).
+    """
+    frac = count / hottest if hottest else 0
+    other = int(255 * (1 - frac))
+    return '#ff{0:02x}{0:02x}'.format(other)
 
-def cfg_dot(bril, verbose):
+def cfg_dot(bril, verbose, profile=None):
     """Generate a GraphViz "dot" file showing the control flow graph for
     a Bril program.
 
-    In `verbose` mode, include the instructions in the vertices.
+    In `verbose` mode, include the instructions in the vertices. With a
+    `profile`, show block and edge counts.
     """
     for func in bril['functions']:
         print('digraph {} {{'.format(func['name']))
@@ -21,15 +36,37 @@ def cfg_dot(bril, verbose):
         # Insert terminators into blocks that don't have them.
         add_terminators(blocks)
 
+        heat = None
+        if profile is not None:
+            heat = profile.get(func['name'], {'blocks': {}, 'edges': {}})
+            hottest = max(heat['blocks'].values(), default=0)
+            hottest_edge = max(
+                (n for succs in heat['edges'].values() for n in succs.values()),
+                default=0,
+            )
+
         # Add the vertices.
         for name, block in blocks.items():
+            attrs = []
+            caption = name
+            if heat is not None:
+                count = heat['blocks'].get(name, 0)
+                caption = '{} ({})'.format(name, count)
+                attrs.append('style=filled')
+                attrs.append('fillcolor="{}"'.format(heat_color(count, hottest)))
             if verbose:
                 import briltxt
-                print(r'  {} [shape=box, xlabel="{}", label="{}\l"];'.format(
-                    quote_if_needed(name),
-                    name,
-                    r'\l'.join(briltxt.instr_to_string(i) for i in block),
-                ))
+                attrs += [
+                    'shape=box',
+                    'xlabel="{}"'.format(caption),
+                    r'label="{}\l"'.format(r'\l'.join(
+                        briltxt.instr_to_string(i) for i in block
+                    )),
+                ]
+            elif heat is not None:
+                attrs.append('label="{}"'.format(caption))
+            if attrs:
+                print('  {} [{}];'.format(quote_if_needed(name), ', '.join(attrs)))
             else:
                 print('  {};'.format(name))
 
@@ -37,7 +74,12 @@ def cfg_dot(bril, verbose):
         for i, (name, block) in enumerate(blocks.items()):
             succ = successors(block[-1])
             for label in succ:
-                print('  {} -> {};'.format(quote_if_needed(name), quote_if_needed(label)))
+                edge = '  {} -> {}'.format(quote_if_needed(name), quote_if_needed(label))
+                if heat is not None:
+                    count = heat['edges'].get(name, {}).get(label, 0)
+                    width = 1 + 4 * count / hottest_edge if hottest_edge else 1
+                    edge += ' [label="{}", penwidth={:.1f}]'.format(count, width)
+                print(edge + ';')
 
         print('}')
 
@@ -47,4 +89,13 @@ def quote_if_needed(s):
     return '"' + s + '"'
 
 if __name__ == '__main__':
-    cfg_dot(json.load(sys.stdin), '-v' in sys.argv[1:])
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='include instructions in the vertices')
+    parser.add_argument('--profile', help='block profile JSON sidecar')
+    opts = parser.parse_args()
+    cfg_dot(
+        json.load(sys.stdin),
+        opts.verbose,
+        load_profile(opts.profile) if opts.profile else None,
+    )
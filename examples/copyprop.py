@@ -0,0 +1,200 @@
+"""Global copy propagation for Bril.
+
+Rewrite every use of a variable that holds a copy (`x = id y`) to use the
+original source instead. Functions in SSA form take a fast path that
+follows copy chains directly; everything else uses an "available copies"
+data flow analysis. The copies themselves are left in place for dead
+code elimination (e.g., `tdce.py`) to clean up.
+"""
+import json
+import sys
+from collections import defaultdict
+
+from cfg import block_map, add_entry, add_terminators
+from df import Analysis, df_worklist
+from form_blocks import form_blocks
+
+
+def copies_merge(vals_list):
+    """Intersect the available copies (maps from destinations to
+    sources) from every predecessor. `None` stands for "every copy" (the
+    top of the lattice), which we use before a block has been visited.
+    """
+    vals_list = list(vals_list)
+    out = None
+    for vals in vals_list:
+        if vals is None:
+            continue
+        if out is None:
+            out = dict(vals)
+        else:
+            out = {d: s for d, s in out.items() if vals.get(d) == s}
+    if out is None and not vals_list:
+        return {}  # No predecessors: the entry (or unreachable code).
+    return out
+
+
+def _sources(copies):
+    """Index a set of available copies by source variable.
+    """
+    by_src = defaultdict(set)
+    for d, s in copies.items():
+        by_src[s].add(d)
+    return by_src
+
+
+def copies_step(copies, by_src, instr):
+    """Update the available copies, and the index produced by `_sources`,
+    in place for a single instruction.
+    """
+    if 'dest' not in instr:
+        return
+    dest = instr['dest']
+
+    # Writing a variable invalidates copies to it and copies from it.
+    if dest in copies:
+        by_src[copies.pop(dest)].discard(dest)
+    for d in by_src.pop(dest, ()):
+        del copies[d]
+
+    if instr['op'] == 'id':
+        src = instr['args'][0]
+        if src != dest:
+            copies[dest] = src
+            by_src[src].add(dest)
+
+
+def copies_transfer(block, in_vals):
+    if in_vals is None:
+        return None
+    out_vals = dict(in_vals)
+    by_src = _sources(out_vals)
+    for instr in block:
+        copies_step(out_vals, by_src, instr)
+    return out_vals
+
+
+# Available copies: a forward analysis whose values map each copied
+# variable to the variable it is a copy of, on every path.
+AVAILABLE_COPIES = Analysis(
+    True,
+    init=None,
+    merge=copies_merge,
+    transfer=copies_transfer,
+)
+
+
+def is_ssa_func(func):
+    """Check whether every variable in the function (including its
+    arguments) is assigned at most once.
+    """
+    assigned = {arg['name'] for arg in func.get('args', [])}
+    for instr in func['instrs']:
+        if 'dest' in instr:
+            if instr['dest'] in assigned:
+                return False
+            assigned.add(instr['dest'])
+    return True
+
+
+def _phi_dests(block):
+    return {i['dest'] for i in block if i.get('op') == 'phi'}
+
+
+def _phi_safe(old_args, new_args, phi_dests):
+    """Undo phi argument rewrites that would read a variable assigned by
+    a phi-node in the same block. Interpreters like `brili` execute the
+    phi-nodes in a block one at a time, so such a read could observe the
+    new value instead of the one from the end of the predecessor.
+    """
+    return [old if new in phi_dests else new
+            for old, new in zip(old_args, new_args)]
+
+
+def copyprop_ssa(func):
+    """Copy propagation for SSA functions. Every copy holds everywhere its
+    destination is in scope, so we can just follow chains of `id`s to
+    their roots. Return the number of arguments rewritten.
+    """
+    copy_of = {}
+    for instr in func['instrs']:
+        if instr.get('op') == 'id':
+            copy_of[instr['dest']] = instr['args'][0]
+
+    def root(var):
+        path = []
+        while var in copy_of and var not in path:
+            path.append(var)
+            var = copy_of[var]
+        for p in path:  # Compress the chain for later lookups.
+            copy_of[p] = var
+        return var
+
+    count = 0
+    for block in form_blocks(func['instrs']):
+        phi_dests = _phi_dests(block)
+        for instr in block:
+            if 'args' in instr:
+                new_args = [root(a) for a in instr['args']]
+                if instr['op'] == 'phi':
+                    new_args = _phi_safe(instr['args'], new_args, phi_dests)
+                count += sum(a != b for a, b in zip(new_args, instr['args']))
+                instr['args'] = new_args
+    return count
+
+
+def copyprop_df(func):
+    """Copy propagation using the available copies analysis. Return the
+    number of arguments rewritten.
+
+    The blocks share instruction objects with `func`, so we rewrite them
+    in place and leave the function's layout alone.
+    """
+    blocks = block_map(form_blocks(func['instrs']))
+    if not blocks:
+        return 0
+    add_entry(blocks)
+    add_terminators(blocks)
+    in_, out = df_worklist(blocks, AVAILABLE_COPIES)
+
+    count = 0
+    for name, block in blocks.items():
+        copies = dict(in_[name] or {})
+        by_src = _sources(copies)
+        phi_dests = _phi_dests(block)
+        for instr in block:
+            if 'args' in instr:
+                if instr['op'] == 'phi':
+                    # Phi arguments are read at the end of the
+                    # corresponding predecessor.
+                    new_args = [(out.get(l) or {}).get(a, a)
+                                for l, a in zip(instr['labels'],
+                                                instr['args'])]
+                    new_args = _phi_safe(instr['args'], new_args, phi_dests)
+                else:
+                    new_args = [copies.get(a, a) for a in instr['args']]
+                count += sum(a != b for a, b in zip(new_args, instr['args']))
+                instr['args'] = new_args
+            copies_step(copies, by_src, instr)
+
+    return count
+
+
+def copyprop(bril):
+    """Propagate copies in every function. Return the total number of
+    arguments rewritten.
+    """
+    count = 0
+    for func in bril['functions']:
+        if is_ssa_func(func):
+            count += copyprop_ssa(func)
+        else:
+            count += copyprop_df(func)
+    return count
+
+
+if __name__ == '__main__':
+    bril = json.load(sys.stdin)
+    count = copyprop(bril)
+    print('rewrote {} uses'.format(count), file=sys.stderr)
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,265 @@
+"""Function inlining for Bril.
+
+Build a call graph from `call` instructions, then inline small,
+non-recursive callees into their callers. Functions are processed
+bottom-up (callees before callers), so a callee has already absorbed its
+own callees by the time it is copied somewhere else.
+"""
+import argparse
+import json
+import sys
+
+from cfg import block_map
+from form_blocks import form_blocks
+from util import fresh, load_profile
+
+
+def call_graph(bril):
+    """Map every function name to the set of function names it calls.
+    """
+    graph = {func['name']: set() for func in bril['functions']}
+    for func in bril['functions']:
+        for instr in func['instrs']:
+            if instr.get('op') == 'call':
+                graph[func['name']].update(instr['funcs'])
+    return graph
+
+
+def sccs(graph):
+    """Find the strongly connected components of a graph with Tarjan's
+    algorithm.
+
+    The components come out in reverse topological order: every
+    component appears after all the components it has edges into. For a
+    call graph, that means callees come before their callers. Edges to
+    nodes that are not in the graph (e.g., calls to functions that have
+    not been linked in) are ignored.
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    out = []
+
+    def visit(node):
+        index[node] = lowlink[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+
+        for succ in sorted(graph[node]):
+            if succ not in graph:
+                continue
+            if succ not in index:
+                visit(succ)
+                lowlink[node] = min(lowlink[node], lowlink[succ])
+            elif succ in on_stack:
+                lowlink[node] = min(lowlink[node], index[succ])
+
+        # A root node pops its whole component off the stack.
+        if lowlink[node] == index[node]:
+            scc = []
+            while True:
+                member = stack.pop()
+                on_stack.remove(member)
+                scc.append(member)
+                if member == node:
+                    break
+            out.append(scc)
+
+    for node in graph:
+        if node not in index:
+            visit(node)
+    return out
+
+
+def recursive_funcs(graph):
+    """Get the set of functions that can (transitively) call themselves.
+    """
+    out = set()
+    for scc in sccs(graph):
+        if len(scc) > 1 or scc[0] in graph[scc[0]]:
+            out.update(scc)
+    return out
+
+
+def func_size(func):
+    """The size of a function, in instructions (not counting labels).
+    """
+    return sum(1 for instr in func['instrs'] if 'op' in instr)
+
+
+def _prefixes(func):
+    """Get the set of leading name components (the part before the first
+    `.`) used by any variable or label in a function.
+    """
+    names = {arg['name'] for arg in func.get('args', [])}
+    for instr in func['instrs']:
+        if 'label' in instr:
+            names.add(instr['label'])
+        names.update(instr.get('labels', []))
+        names.update(instr.get('args', []))
+        if 'dest' in instr:
+            names.add(instr['dest'])
+    return {name.split('.')[0] for name in names}
+
+
+def _rename(instr, prefix):
+    """Copy a callee instruction, putting all of its variable and label
+    names into the `prefix` namespace.
+    """
+    instr = dict(instr)
+    if 'label' in instr:
+        instr['label'] = '{}.{}'.format(prefix, instr['label'])
+    if 'dest' in instr:
+        instr['dest'] = '{}.{}'.format(prefix, instr['dest'])
+    if 'args' in instr:
+        instr['args'] = ['{}.{}'.format(prefix, a) for a in instr['args']]
+    if 'labels' in instr:
+        instr['labels'] = ['{}.{}'.format(prefix, l)
+                           for l in instr['labels']]
+    return instr
+
+
+def inline_call(call, callee, prefix):
+    """Produce the instructions that replace `call` with the body of
+    `callee`.
+
+    Callee names are renamed into the `prefix` namespace. Parameters
+    become copies from the call's arguments, and every `ret` becomes a
+    copy into the call's destination followed by a jump to a
+    continuation block labeled `prefix`, which ends the list.
+    """
+    out = []
+    for param, arg in zip(callee.get('args', []), call.get('args', [])):
+        out.append({
+            'op': 'id',
+            'dest': '{}.{}'.format(prefix, param['name']),
+            'type': param['type'],
+            'args': [arg],
+        })
+
+    body = callee['instrs']
+    for i, instr in enumerate(body):
+        if instr.get('op') == 'ret':
+            if 'dest' in call and instr.get('args'):
+                out.append({
+                    'op': 'id',
+                    'dest': call['dest'],
+                    'type': call['type'],
+                    'args': ['{}.{}'.format(prefix, instr['args'][0])],
+                })
+            # A `ret` at the very end can fall through to the
+            # continuation instead of jumping there.
+            if i != len(body) - 1:
+                out.append({'op': 'jmp', 'labels': [prefix]})
+        else:
+            out.append(_rename(instr, prefix))
+
+    out.append({'label': prefix})
+    return out
+
+
+def inline_func(func, funcs, should_inline):
+    """Inline calls in `func` wherever `should_inline` approves.
+
+    `funcs` maps names to the functions that may be inlined, and
+    `should_inline` takes the callee and the name of the block containing
+    the call site. Return the number of call sites inlined.
+    """
+    blocks = list(form_blocks(func['instrs']))
+    taken = _prefixes(func)
+
+    instrs = []
+    moved = {}  # Block name -> label of the block now holding its tail.
+    count = 0
+    for name, block in zip(block_map(blocks), blocks):
+        tail = name
+        for instr in block:
+            if instr.get('op') == 'call' and \
+               instr['funcs'][0] in funcs and \
+               should_inline(funcs[instr['funcs'][0]], name):
+                prefix = fresh('inl', taken)
+                taken.add(prefix)
+                instrs += inline_call(instr, funcs[instr['funcs'][0]],
+                                      prefix)
+                tail = prefix
+                count += 1
+            else:
+                instrs.append(instr)
+        moved[name] = tail
+
+    if not count:
+        return 0
+
+    # The end of a block that we split now lives in its continuation
+    # block, so phi-nodes must name that block as the predecessor.
+    for instr in instrs:
+        if instr.get('op') == 'phi':
+            instr['labels'] = [moved.get(l, l) for l in instr['labels']]
+
+    func['instrs'] = instrs
+    return count
+
+
+def inline(bril, size=20, profile=None, hot=1000, hot_size=80):
+    """Inline small, non-recursive functions everywhere in the program.
+
+    Without a profile, callees of at most `size` instructions are
+    inlined at every call site. With a `profile` (see
+    `util.load_profile`), call sites that never executed are left alone
+    and call sites that executed at least `hot` times accept callees of
+    up to `hot_size` instructions.
+    Return the number of call sites inlined.
+    """
+    graph = call_graph(bril)
+    recursive = recursive_funcs(graph)
+    funcs = {func['name']: func for func in bril['functions']
+             if func['name'] not in recursive}
+
+    count = 0
+    by_name = {func['name']: func for func in bril['functions']}
+    for scc in sccs(graph):
+        for name in scc:
+            blocks_heat = calls_heat = None
+            if profile is not None:
+                blocks_heat = profile.get(name, {}).get('blocks', {})
+                calls_heat = profile.get(name, {}).get('calls', {})
+
+            def should_inline(callee, block):
+                limit = size
+                if blocks_heat is not None:
+                    # Prefer the call-site count; older profiles only
+                    # count blocks.
+                    heat = calls_heat.get(block, {}).get(
+                        callee['name'], blocks_heat.get(block, 0))
+                    if not heat:
+                        return False
+                    if heat >= hot:
+                        limit = hot_size
+                return func_size(callee) <= limit
+
+            count += inline_func(by_name[name], funcs, should_inline)
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-s', '--size', type=int, default=20,
+                        help='largest callee to inline (instructions)')
+    parser.add_argument('--profile', help='block profile JSON sidecar')
+    parser.add_argument('--hot', type=int, default=1000,
+                        help='execution count that makes a call site hot')
+    parser.add_argument('--hot-size', type=int, default=80,
+                        help='largest callee to inline at hot call sites')
+    opts = parser.parse_args()
+
+    bril = json.load(sys.stdin)
+    count = inline(
+        bril,
+        size=opts.size,
+        profile=load_profile(opts.profile) if opts.profile else None,
+        hot=opts.hot,
+        hot_size=opts.hot_size,
+    )
+    print('inlined {} call sites'.format(count), file=sys.stderr)
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,405 @@
+"""Whole-program interprocedural optimization for Bril.
+
+Starting from `main`, remove functions that can never be called, then
+move constants across calls: a parameter that receives the same constant
+at every call site becomes a constant in the callee, and a function that
+always returns the same constant hands it to its callers directly. Call
+sites that pass constants to a parameter that is not constant everywhere
+can get their own specialized clone of the callee, as long as the clones
+fit in a budget of extra instructions.
+
+This pass only moves the constants; run `lvn.py -p -f` and `tdce.py`
+afterward to fold the function bodies.
+"""
+import argparse
+import copy
+import json
+import sys
+
+from cfg import block_map, add_terminators
+from df import Analysis, df_worklist
+from form_blocks import form_blocks
+from inline import call_graph, func_size
+from lvn import FOLDABLE_OPS
+from util import fresh, load_profile
+
+# Besides ordinary constants, the analysis has two lattice values:
+# `TOP` means no value has reached a variable yet (e.g., a parameter of a
+# function that no analyzed call site has called) and `UNKNOWN` means the
+# variable is not constant.
+TOP = object()
+UNKNOWN = object()
+
+# A pseudo-operation that sets a parameter's value in the entry block the
+# analysis adds to every function.
+PARAM = '_param'
+
+
+def is_const(val):
+    return val is not TOP and val is not UNKNOWN
+
+
+def meet(a, b):
+    if a is TOP:
+        return b
+    if b is TOP:
+        return a
+    # Compare types too: in Python, `1 == True`.
+    if is_const(a) and is_const(b) and type(a) is type(b) and a == b:
+        return a
+    return UNKNOWN
+
+
+def _value(instr, env, returns):
+    """Get the value an instruction assigns to its destination."""
+    op = instr['op']
+    if op == 'const' or op == PARAM:
+        return instr['value']
+    elif op == 'id':
+        return env.get(instr['args'][0], UNKNOWN)
+    elif op == 'call' and instr['funcs'][0] in returns:
+        return returns[instr['funcs'][0]]
+    return UNKNOWN
+
+
+def const_analysis(returns):
+    """A forward constant propagation that follows copies and knows the
+    results of calls to functions that always return the same constant
+    (`returns` maps their names to those constants).
+    """
+    def transfer(block, in_vals):
+        out_vals = dict(in_vals)
+        for instr in block:
+            if 'dest' in instr:
+                out_vals[instr['dest']] = _value(instr, out_vals, returns)
+        return out_vals
+
+    def merge(vals_list):
+        out_vals = {}
+        for vals in vals_list:
+            for name, val in vals.items():
+                out_vals[name] = meet(out_vals.get(name, TOP), val)
+        return out_vals
+
+    return Analysis(True, init={}, merge=merge, transfer=transfer)
+
+
+def _walk(func, seeds, returns):
+    """Run the constant analysis on a function whose parameters have the
+    values in `seeds`. Generate a (block name, instruction, argument
+    values) triple for every instruction.
+    """
+    blocks = block_map(form_blocks(func['instrs']))
+    add_terminators(blocks)
+
+    # Add an entry block that assigns the parameters.
+    start = [
+        {'op': PARAM, 'dest': arg['name'],
+         'value': seeds.get(arg['name'], TOP)}
+        for arg in func.get('args', [])
+    ]
+    if blocks:
+        start.append({'op': 'jmp', 'labels': [next(iter(blocks))]})
+    else:
+        start.append({'op': 'ret', 'args': []})
+    entry = fresh('entry', blocks)
+    all_blocks = {entry: start}
+    all_blocks.update(blocks)
+
+    in_, _ = df_worklist(all_blocks, const_analysis(returns))
+
+    for name, block in blocks.items():
+        env = dict(in_[name])
+        for instr in block:
+            yield name, instr, [env.get(a, UNKNOWN)
+                                for a in instr.get('args', [])]
+            if 'dest' in instr:
+                env[instr['dest']] = _value(instr, env, returns)
+
+
+def analyze_func(func, seeds, returns):
+    """Find the constants at a function's calls and returns, given the
+    values of its parameters in `seeds`.
+
+    Return a list of (block name, instruction, argument values) triples
+    for the function's calls and a list of the values it can return.
+    """
+    calls = []
+    rets = []
+    for name, instr, args in _walk(func, seeds, returns):
+        if instr['op'] == 'call':
+            calls.append((name, instr, args))
+        elif instr['op'] == 'ret':
+            rets.append(args[0] if args else UNKNOWN)
+    return calls, rets
+
+
+def foldable_params(func, seeds, returns):
+    """Get the names of the parameters that `seeds` makes worth binding:
+    those that some branch or foldable instruction uses when all of its
+    arguments are constants. Binding a parameter costs a `const` on every
+    call, so a constant that cannot fold anything only slows the program
+    down.
+    """
+    params = {arg['name'] for arg in func.get('args', [])}
+    out = set()
+    for _, instr, args in _walk(func, seeds, returns):
+        if instr['op'] in FOLDABLE_OPS or instr['op'] == 'br':
+            if args and all(is_const(a) for a in args):
+                out.update(params.intersection(instr['args']))
+    return out
+
+
+def analyze(bril):
+    """Find the constants that flow across calls in the whole program.
+
+    Return three dictionaries keyed by function name: `params` maps each
+    parameter to its value over all call sites, `returns` holds the
+    functions that always return the same constant, and `calls` lists
+    each function's calls as returned by `analyze_func`.
+    """
+    by_name = {func['name']: func for func in bril['functions']}
+    returns = {}
+    while True:
+        # Iterate to a fixed point, starting optimistically from `TOP`
+        # for every parameter except `main`'s, which come from outside.
+        params = {name: {} for name in by_name}
+        if 'main' in by_name:
+            params['main'] = {arg['name']: UNKNOWN
+                              for arg in by_name['main'].get('args', [])}
+        while True:
+            calls = {}
+            rets = {}
+            new = {name: {} for name in by_name}
+            if 'main' in by_name:
+                new['main'] = params['main']
+            for name, func in by_name.items():
+                calls[name], rets[name] = \
+                    analyze_func(func, params[name], returns)
+                for _, instr, vals in calls[name]:
+                    callee = by_name.get(instr['funcs'][0])
+                    if callee is None or callee['name'] == 'main':
+                        continue
+                    seen = new[callee['name']]
+                    for arg, val in zip(callee.get('args', []), vals):
+                        seen[arg['name']] = meet(seen.get(arg['name'], TOP),
+                                                 val)
+            if new == params:
+                break
+            params = new
+
+        new_returns = {}
+        for name, vals in rets.items():
+            val = TOP
+            for v in vals:
+                val = meet(val, v)
+            if is_const(val) and name != 'main':
+                new_returns[name] = val
+        if new_returns == returns:
+            return params, returns, calls
+        returns = new_returns
+
+
+def remove_dead_functions(bril):
+    """Remove the functions that `main` cannot reach through calls.
+    Return the number of functions removed.
+    """
+    graph = call_graph(bril)
+    if 'main' not in graph:
+        return 0  # A library: anything could be called.
+
+    reachable = set()
+    stack = ['main']
+    while stack:
+        name = stack.pop()
+        if name in reachable or name not in graph:
+            continue
+        reachable.add(name)
+        stack += graph[name]
+
+    before = len(bril['functions'])
+    bril['functions'] = [func for func in bril['functions']
+                         if func['name'] in reachable]
+    return before - len(bril['functions'])
+
+
+def bind_params(func, values):
+    """Turn some of a function's parameters into constants.
+
+    `values` maps parameter indices to constants. The parameters are
+    removed from the signature and assigned at the top of the body.
+    """
+    args = func.get('args', [])
+    consts = [
+        {'op': 'const', 'dest': arg['name'], 'type': arg['type'],
+         'value': values[i]}
+        for i, arg in enumerate(args) if i in values
+    ]
+    func['args'] = [arg for i, arg in enumerate(args) if i not in values]
+    if not func['args']:
+        del func['args']
+    func['instrs'] = consts + func['instrs']
+
+
+def _drop_args(instr, indices):
+    instr['args'] = [a for i, a in enumerate(instr.get('args', []))
+                     if i not in indices]
+    if not instr['args']:
+        del instr['args']
+
+
+def _pattern_key(pattern):
+    # Include the type so that `1` and `true` stay apart.
+    return tuple((i, type(v).__name__, v) for i, v in sorted(pattern.items()))
+
+
+def specialize(bril, params, returns, calls, budget, profile=None):
+    """Clone functions for the constant arguments their call sites pass.
+
+    A call site is a candidate when it passes a constant that would be
+    worth binding (see `foldable_params`) to a parameter that is not
+    constant at every call site. Candidates that pass the
+    same constants to the same function share a clone. The clones for the
+    hottest patterns come first, measured by call counts from `profile`
+    or, without one, by the number of call sites; each clone costs the
+    size of the function it copies, and cloning stops adding clones that
+    do not fit in `budget` instructions. Return the number of clones.
+    """
+    by_name = {func['name']: func for func in bril['functions']}
+
+    patterns = {}  # (callee, key) -> [weight, pattern, call instrs]
+    for caller, sites in calls.items():
+        heat = None
+        if profile is not None:
+            heat = profile.get(caller, {}).get('calls', {})
+        for block, instr, vals in sites:
+            callee = by_name.get(instr['funcs'][0])
+            if callee is None or callee['name'] == 'main':
+                continue
+            args = callee.get('args', [])
+            seeds = dict(params[callee['name']])
+            pattern = {}
+            for i, (arg, val) in enumerate(zip(args, vals)):
+                if is_const(val) and not is_const(seeds.get(arg['name'], TOP)):
+                    pattern[i] = seeds[arg['name']] = val
+            useful = foldable_params(callee, seeds, returns)
+            pattern = {i: val for i, val in pattern.items()
+                       if args[i]['name'] in useful}
+            if not pattern:
+                continue
+            weight = 1 if heat is None else \
+                heat.get(block, {}).get(callee['name'], 0)
+            entry = patterns.setdefault(
+                (callee['name'], _pattern_key(pattern)), [0, pattern, []],
+            )
+            entry[0] += weight
+            entry[2].append(instr)
+
+    count = 0
+    ranked = sorted(patterns.items(), key=lambda p: (-p[1][0], p[0]))
+    for (name, _), (weight, pattern, instrs) in ranked:
+        cost = func_size(by_name[name])
+        if weight == 0 or cost > budget:
+            continue
+        budget -= cost
+
+        clone = copy.deepcopy(by_name[name])
+        clone['name'] = fresh('{}.spec'.format(name), by_name)
+        bind_params(clone, pattern)
+        by_name[clone['name']] = clone
+        bril['functions'].append(clone)
+        for instr in instrs:
+            instr['funcs'] = [clone['name']]
+            _drop_args(instr, pattern)
+        count += 1
+    return count
+
+
+def _var_names(func):
+    names = {arg['name'] for arg in func.get('args', [])}
+    for instr in func['instrs']:
+        if 'dest' in instr:
+            names.add(instr['dest'])
+    return names
+
+
+def propagate(bril, params, returns):
+    """Rewrite the program to use the constants that `analyze` found,
+    binding the parameters that `foldable_params` picks. Return the number of parameters and return values replaced.
+    """
+    dropped = {}  # Function name -> indices of parameters now bound.
+    for func in bril['functions']:
+        if func['name'] == 'main':
+            continue
+        seen = params.get(func['name'], {})
+        useful = foldable_params(func, seen, returns)
+        values = {i: seen[arg['name']]
+                  for i, arg in enumerate(func.get('args', []))
+                  if arg['name'] in useful}
+        if values:
+            bind_params(func, values)
+            dropped[func['name']] = values
+
+        # A function that always returns the same constant becomes a
+        # `void` function; its callers get the constant instead.
+        if func['name'] in returns:
+            del func['type']
+            for instr in func['instrs']:
+                if instr.get('op') == 'ret':
+                    instr.pop('args', None)
+
+    for func in bril['functions']:
+        instrs = []
+        for instr in func['instrs']:
+            instrs.append(instr)
+            if instr.get('op') != 'call':
+                continue
+            callee = instr['funcs'][0]
+            if callee in dropped:
+                _drop_args(instr, dropped[callee])
+            if callee in returns and 'dest' in instr:
+                instrs.append({
+                    'op': 'const',
+                    'dest': instr.pop('dest'),
+                    'type': instr.pop('type'),
+                    'value': returns[callee],
+                })
+        func['instrs'] = instrs
+
+    return sum(len(v) for v in dropped.values()), len(returns)
+
+
+def ipo(bril, budget=100, profile=None):
+    """Optimize the whole program. Return a dictionary of statistics.
+    """
+    stats = {'removed': remove_dead_functions(bril)}
+
+    params, returns, calls = analyze(bril)
+    stats['cloned'] = specialize(bril, params, returns, calls,
+                                 budget, profile)
+    if stats['cloned']:
+        params, returns, calls = analyze(bril)
+    stats['params'], stats['returns'] = propagate(bril, params, returns)
+
+    # Clones can leave the functions they copied without callers.
+    stats['removed'] += remove_dead_functions(bril)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-b', '--budget', type=int, default=100,
+                        help='most instructions to add by cloning')
+    parser.add_argument('--profile', help='block profile JSON sidecar')
+    opts = parser.parse_args()
+
+    bril = json.load(sys.stdin)
+    stats = ipo(
+        bril,
+        budget=opts.budget,
+        profile=load_profile(opts.profile) if opts.profile else None,
+    )
+    print('removed {removed} functions, cloned {cloned}, bound {params} '
+          'parameters and {returns} return values'.format(**stats),
+          file=sys.stderr)
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
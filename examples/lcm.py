@@ -0,0 +1,325 @@
+"""Partial redundancy elimination for Bril via lazy code motion.
+
+This follows the formulation in the Dragon Book (section 9.5): four data
+flow analyses (anticipated, available, postponable, and used
+expressions) decide where to compute each expression so that no path
+computes it more often than before, and so that the computation happens
+as late as possible. Every expression gets a temporary; we insert
+`tmp = expr` where the analyses say to and replace redundant
+computations with copies of `tmp`.
+
+The analyses run on whole basic blocks using the `df.py` framework.
+Because the Dragon Book's equations are stated for single instructions,
+we then refine each block's result by walking its instructions.
+
+Functions with phi-nodes are left alone; run this before `to_ssa.py` or
+after `from_ssa.py`.
+"""
+import json
+import sys
+
+from cfg import block_map, add_entry, add_terminators, edges, reassemble
+from df import Analysis, df_worklist
+from form_blocks import form_blocks
+from lvn import Value, _canonicalize
+from simplify_cfg import simplify_func
+from util import fresh
+
+# Side-effect-free value operations that are worth moving around.
+PURE_OPS = {
+    'add', 'mul', 'sub', 'div',
+    'eq', 'lt', 'gt', 'le', 'ge',
+    'not', 'and', 'or',
+    'fadd', 'fmul', 'fsub', 'fdiv',
+    'feq', 'flt', 'fle', 'fgt', 'fge',
+    'ceq', 'clt', 'cle', 'cgt', 'cge', 'char2int', 'int2char',
+    'ptradd',
+}
+
+
+def expr(instr):
+    """Get the expression (a `Value` whose arguments are variable names)
+    computed by an instruction, or None if it is not a candidate.
+    """
+    if instr.get('op') in PURE_OPS and 'dest' in instr:
+        return _canonicalize(Value(instr['op'], tuple(instr['args'])))
+    return None
+
+
+def e_use(instr):
+    e = expr(instr)
+    return {e} if e is not None else set()
+
+
+def e_kill(instr, universe):
+    if 'dest' not in instr:
+        return set()
+    return {e for e in universe if instr['dest'] in e.args}
+
+
+def intersect_or(default):
+    """Make a merge function that intersects sets, producing `default`
+    when there is nothing to merge (at the entry or the exits).
+    """
+    def merge(sets):
+        sets = list(sets)
+        if not sets:
+            return set(default)
+        out = set(sets[0])
+        for s in sets[1:]:
+            out &= s
+        return out
+    return merge
+
+
+def union(sets):
+    out = set()
+    for s in sets:
+        out.update(s)
+    return out
+
+
+def split_critical_edges(blocks):
+    """Insert an empty block on every edge from a block with several
+    successors to a block with several predecessors. Return the names of
+    the new blocks.
+    """
+    preds, succs = edges(blocks)
+    new = []
+    for name in list(blocks):
+        if len(set(succs[name])) < 2:
+            continue
+        # Copy the terminator: the original belongs to the function.
+        term = dict(blocks[name][-1])
+        term['labels'] = list(term['labels'])
+        blocks[name][-1] = term
+        for i, succ in enumerate(term['labels']):
+            if len(preds[succ]) < 2:
+                continue
+            edge = fresh('lcm.edge.', blocks)
+            blocks[edge] = [{'op': 'jmp', 'labels': [succ]}]
+            term['labels'][i] = edge
+            new.append(edge)
+    return new
+
+
+def walk_backward(block, out, step):
+    """Compute a backward analysis result just before each instruction,
+    given the result at the end of the block and a per-instruction
+    transfer function. Return a list parallel to `block`.
+    """
+    vals = [None] * len(block)
+    val = out
+    for i in reversed(range(len(block))):
+        val = step(block[i], val)
+        vals[i] = val
+    return vals
+
+
+def walk_forward(block, in_, step):
+    """Like `walk_backward`, but for forward analyses: produce the result
+    just *before* each instruction, given the result at the start of the
+    block.
+    """
+    vals = []
+    val = in_
+    for instr in block:
+        vals.append(val)
+        val = step(instr, val)
+    return vals
+
+
+def lcm_func(func):
+    """Apply lazy code motion to one function. Return the number of
+    expression computations that were replaced with a temporary.
+    """
+    if any(i.get('op') == 'phi' for i in func['instrs']):
+        return 0
+    blocks = block_map(form_blocks(func['instrs']))
+    if not blocks:
+        return 0
+    add_entry(blocks)
+    add_terminators(blocks)
+    split_critical_edges(blocks)
+    _, succs = edges(blocks)
+
+    universe = set()
+    types = {}
+    for block in blocks.values():
+        for instr in block:
+            e = expr(instr)
+            if e is not None:
+                universe.add(e)
+                types[e] = instr['type']
+    if not universe:
+        return 0
+
+    kills = {}
+
+    def kill(instr):
+        key = id(instr)
+        if key not in kills:
+            kills[key] = e_kill(instr, universe)
+        return kills[key]
+
+    # Anticipated expressions: computed on every path from here before
+    # any operand changes.
+    def ant_step(instr, out):
+        return e_use(instr) | (out - kill(instr))
+
+    anticipated = Analysis(
+        False,
+        init=set(universe),
+        merge=intersect_or(set()),
+        transfer=lambda block, out: walk_backward(block, out, ant_step)[0],
+    )
+    _, ant_out = df_worklist(blocks, anticipated)
+    ant_in = {name: walk_backward(block, ant_out[name], ant_step)
+              for name, block in blocks.items()}
+    ant_in_of = {}
+    for name, block in blocks.items():
+        for instr, val in zip(block, ant_in[name]):
+            ant_in_of[id(instr)] = val
+
+    # "Will-be-available" expressions: available here if we computed
+    # everything as early as the anticipated analysis allows.
+    def avail_step(instr, in_):
+        return (ant_in_of[id(instr)] | in_) - kill(instr)
+
+    available = Analysis(
+        True,
+        init=set(universe),
+        merge=intersect_or(set()),
+        transfer=lambda block, in_: _last(block, in_, avail_step),
+    )
+    avail_in, _ = df_worklist(blocks, available)
+    earliest = {}
+    for name, block in blocks.items():
+        avail = walk_forward(block, avail_in[name], avail_step)
+        for instr, val in zip(block, avail):
+            earliest[id(instr)] = ant_in_of[id(instr)] - val
+
+    # Postponable expressions: we could compute them later than the
+    # earliest point without losing anything.
+    def post_step(instr, in_):
+        return (earliest[id(instr)] | in_) - e_use(instr)
+
+    postponable = Analysis(
+        True,
+        init=set(universe),
+        merge=intersect_or(set()),
+        transfer=lambda block, in_: _last(block, in_, post_step),
+    )
+    post_in, _ = df_worklist(blocks, postponable)
+    post_in_of = {}
+    for name, block in blocks.items():
+        post = walk_forward(block, post_in[name], post_step)
+        for instr, val in zip(block, post):
+            post_in_of[id(instr)] = val
+
+    # Latest: the last point where we can place each expression before
+    # it is needed.
+    def placeable(instr):
+        return earliest[id(instr)] | post_in_of[id(instr)]
+
+    latest = {}
+    for name, block in blocks.items():
+        for i, instr in enumerate(block):
+            if i + 1 < len(block):
+                next_instrs = [block[i + 1]]
+            else:
+                next_instrs = [blocks[s][0] for s in succs[name]]
+            everywhere_later = intersect_or(set())(
+                placeable(n) for n in next_instrs
+            )
+            latest[id(instr)] = placeable(instr) & \
+                (e_use(instr) | (universe - everywhere_later))
+
+    # Used expressions: the temporary is read at some later point.
+    def used_step(instr, out):
+        return (e_use(instr) | out) - latest[id(instr)]
+
+    used = Analysis(
+        False,
+        init=set(),
+        merge=union,
+        transfer=lambda block, out: walk_backward(block, out, used_step)[0],
+    )
+    _, used_out = df_worklist(blocks, used)
+
+    # Rewrite the code.
+    names = _names(func)
+    temps = {}
+
+    def temp(e):
+        if e not in temps:
+            temps[e] = fresh('lcm.', names)
+            names.add(temps[e])
+        return temps[e]
+
+    count = 0
+    changed = False
+    for name, block in blocks.items():
+        used_after = walk_backward(block, used_out[name], used_step)[1:] + \
+            [used_out[name]]
+        new_block = []
+        for instr, u_out in zip(block, used_after):
+            late = latest[id(instr)]
+            for e in sorted(late & u_out, key=str):
+                new_block.append({
+                    'op': e.op,
+                    'dest': temp(e),
+                    'type': types[e],
+                    'args': list(e.args),
+                })
+                changed = True
+            e = expr(instr)
+            if e is not None and not (e in late and e not in u_out):
+                new_block.append({
+                    'op': 'id',
+                    'dest': instr['dest'],
+                    'type': instr['type'],
+                    'args': [temp(e)],
+                })
+                count += 1
+                changed = True
+            else:
+                new_block.append(instr)
+        block[:] = new_block
+
+    if changed:
+        func['instrs'] = reassemble(blocks)
+        simplify_func(func)
+    return count
+
+
+def _last(block, in_, step):
+    """Run a forward per-instruction transfer function over a block.
+    """
+    val = in_
+    for instr in block:
+        val = step(instr, val)
+    return val
+
+
+def _names(func):
+    names = {arg['name'] for arg in func.get('args', [])}
+    for instr in func['instrs']:
+        names.update(instr.get('args', []))
+        if 'dest' in instr:
+            names.add(instr['dest'])
+    return names
+
+
+def lcm(bril):
+    """Apply lazy code motion to every function. Return the number of
+    computations replaced.
+    """
+    return sum(lcm_func(func) for func in bril['functions'])
+
+
+if __name__ == '__main__':
+    bril = json.load(sys.stdin)
+    count = lcm(bril)
+    print('replaced {} computations'.format(count), file=sys.stderr)
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
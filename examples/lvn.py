@@ -5,6 +5,7 @@ import sys
 from collections import namedtuple
 
 from form_blocks import form_blocks
+from purity import READONLY, EFFECTFUL, instr_effect, function_effects
 from util import flatten
 
 # A Value uniquely represents a computation in terms of sub-values.
@@ -64,7 +65,7 @@ def read_first(instrs):
     return read
 
 
-def lvn_block(block, lookup, canonicalize, fold):
+def lvn_block(block, lookup, canonicalize, fold, effects={}):
     """Use local value numbering to optimize a basic block. Modify the
     instructions in place.
 
@@ -77,6 +78,12 @@ def lvn_block(block, lookup, canonicalize, fold):
       a canonical form.
     - `fold`. Arguments: a number-to-constant map  and a value. Return a
       new constant if it can be computed directly (or None otherwise).
+
+    `effects` maps function names to their classes from the `purity`
+    module. Calls to pure functions are values like any other, and calls
+    to read-only functions (like `load`s) are values until the next
+    instruction that might change memory. Calls to any other function
+    are never reused.
     """
     # The current value of every defined variable. We'll update this
     # every time a variable is modified. Different variables can have
@@ -101,6 +108,10 @@ def lvn_block(block, lookup, canonicalize, fold):
     # Track constant values for values assigned with `const`.
     num2const = {}
 
+    # A counter that goes up whenever memory might change. Values that
+    # read memory include it, so they are not reused across a change.
+    memory = 0
+
     # Initialize the table with numbers for input variables. These
     # variables are their own canonical source.
     for var in read_first(block):
@@ -125,14 +136,23 @@ def lvn_block(block, lookup, canonicalize, fold):
                 if instr['dest'] in rhs:
                     rhs.remove(instr['dest'])
 
-        # Non-call value operations are candidates for replacement. (We
-        # could conceivably include calls to pure functions as values,
-        # but determining purity would require an interprocedural
-        # analysis.)
+        # Value operations without side effects are candidates for
+        # replacement. A call is a value when its callee is pure or
+        # read-only (see the `purity` module).
+        effect = instr_effect(instr, effects)
+        if effect == EFFECTFUL:
+            memory += 1
+
         val = None
-        if 'dest' in instr and 'args' in instr and instr['op'] != 'call':
+        if 'dest' in instr and effect != EFFECTFUL and \
+           ('args' in instr or instr['op'] == 'call'):
             # Construct a Value for this computation.
-            val = canonicalize(Value(instr['op'], argnums))
+            op = instr['op']
+            if op == 'call':
+                op = (op, instr['funcs'][0])
+            if effect == READONLY:
+                op = (op, memory)
+            val = canonicalize(Value(op, argnums))
 
             # Is this value already available?
             num = lookup(value2num, val)
@@ -141,12 +161,13 @@ def lvn_block(block, lookup, canonicalize, fold):
                 var2num[instr['dest']] = num
 
                 # Replace the instruction with a copy or a constant.
+                instr.pop('funcs', None)
                 if num in num2const:  # Value is a constant.
                     instr.update({
                         'op': 'const',
                         'value': num2const[num],
                     })
-                    del instr['args']
+                    instr.pop('args', None)
                 else:  # Value is in a variable.
                     instr.update({
                         'op': 'id',
@@ -260,10 +281,12 @@ def _canonicalize(value):
         return value
 
 
-def lvn(bril, prop=False, canon=False, fold=False):
+def lvn(bril, prop=False, canon=False, fold=False, pure=False):
     """Apply the local value numbering optimization to every basic block
-    in every function.
+    in every function. With `pure`, reuse calls to functions that the
+    `purity` analysis says are pure or read-only.
     """
+    effects = function_effects(bril) if pure else {}
     for func in bril['functions']:
         blocks = list(form_blocks(func['instrs']))
         for block in blocks:
@@ -272,11 +295,13 @@ def lvn(bril, prop=False, canon=False, fold=False):
                 lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
                 canonicalize=_canonicalize if canon else lambda v: v,
                 fold=_fold if fold else lambda n2c, v: None,
+                effects=effects,
             )
         func['instrs'] = flatten(blocks)
 
 
 if __name__ == '__main__':
     bril = json.load(sys.stdin)
-    lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv)
+    lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv,
+        '-i' in sys.argv)
     json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,228 @@
+"""Memory optimizations for Bril, built on the alias analysis in
+`alias.py`.
+
+- `rle`: Redundant load elimination and store-to-load forwarding. A
+  forward "available memory values" analysis tracks pairs (p, v) meaning
+  "the memory p points to holds the value of v". A `load` from p (or from
+  a pointer that must alias p) becomes `id v`.
+- `dse`: Dead store elimination. A backward analysis finds stores that
+  are overwritten, freed, or (for memory that never escapes the function)
+  simply never read again.
+
+Rewritten loads and deleted stores leave the CFG alone, so the passes
+edit instructions in place. Run `tdce.py` afterward to clean up the
+copies. Pass the optimizations to run as arguments (default: both).
+"""
+import json
+import sys
+
+from alias import PointsTo
+from df import Analysis, df_worklist
+
+
+def intersect(vals):
+    """Intersect sets, ignoring `None` (not yet computed).
+    """
+    out = None
+    for val in vals:
+        if val is None:
+            continue
+        out = set(val) if out is None else out & val
+    return out
+
+
+def rle_step(info, facts, instr):
+    """Update the available memory values in place for one instruction.
+    """
+    op = instr.get('op')
+    args = instr.get('args', [])
+
+    if op in ('store', 'free'):
+        pts = info.pts(instr, args[0])
+        facts -= {(p, v) for p, v in facts
+                  if info.may_alias(info.pts(instr, p), pts)}
+    elif op == 'call':
+        # The callee may write any memory it can reach.
+        facts -= {(p, v) for p, v in facts
+                  if any(info.escapes(l) for l in info.pts(instr, p))}
+
+    if 'dest' in instr:
+        dest = instr['dest']
+        facts -= {(p, v) for p, v in facts if dest in (p, v)}
+
+    if op == 'store' and args[0] != args[1]:
+        facts.add((args[0], args[1]))
+    elif op == 'load' and instr['dest'] != args[0]:
+        facts.add((args[0], instr['dest']))
+
+
+def available(info, facts, instr):
+    """Find a variable holding the value `instr` (a `load`) would read, or
+    None.
+    """
+    ptr = instr['args'][0]
+    pts = info.pts(instr, ptr)
+    for p, v in sorted(facts):
+        if p == ptr or info.must_alias(info.pts(instr, p), pts):
+            return v
+    return None
+
+
+def rle_func(func):
+    """Replace redundant loads in a function with copies. Return the
+    number of loads replaced.
+    """
+    if not any(i.get('op') == 'load' for i in func['instrs']):
+        return 0
+    info = PointsTo(func)
+
+    def transfer(block, in_):
+        if in_ is None:
+            return None
+        facts = set(in_)
+        for instr in block:
+            rle_step(info, facts, instr)
+        return facts
+
+    def merge(vals):
+        vals = list(vals)
+        if not vals:
+            return set()  # The entry.
+        return intersect(vals)
+
+    in_, _ = df_worklist(info.blocks, Analysis(
+        True, init=None, merge=merge, transfer=transfer,
+    ))
+
+    count = 0
+    for name, block in info.blocks.items():
+        facts = set(in_[name] or ())
+        for instr in block:
+            if instr.get('op') == 'load':
+                var = available(info, facts, instr)
+                if var is not None:
+                    ptr = instr['args'][0]
+                    instr['op'] = 'id'
+                    instr['args'] = [var]
+                    count += 1
+                    # Keep the fact for the pointer we read through.
+                    rle_step(info, facts, instr)
+                    if instr['dest'] != ptr:
+                        facts.add((ptr, instr['dest']))
+                    continue
+            rle_step(info, facts, instr)
+    return count
+
+
+def dse_step(info, dead, instr):
+    """Update the "dead memory" facts in place, going backward over one
+    instruction. The facts are:
+
+    - ('store', p): the memory p points to is overwritten later, before
+      anything could read it.
+    - ('free', p): the object p points into is freed later, before
+      anything could read it.
+    - ('site', s): no object allocated at site s is read later.
+    """
+    op = instr.get('op')
+    args = instr.get('args', [])
+
+    if 'dest' in instr:
+        dest = instr['dest']
+        dead -= {('store', dest), ('free', dest)}
+
+    if op == 'load':
+        pts = info.pts(instr, args[0])
+        for fact in list(dead):
+            kind, x = fact
+            if kind == 'store':
+                gone = info.may_alias(info.pts(instr, x), pts)
+            elif kind == 'free':
+                gone = info.may_alias(info.pts(instr, x), pts,
+                                      offsets=False)
+            else:
+                gone = any(l.site == x for l in pts)
+            if gone:
+                dead.discard(fact)
+    elif op == 'call':
+        # The callee may read any memory it can reach.
+        for fact in list(dead):
+            kind, x = fact
+            if kind != 'site' and \
+                    any(info.escapes(l) for l in info.pts(instr, x)):
+                dead.discard(fact)
+    elif op == 'store':
+        dead.add(('store', args[0]))
+    elif op == 'free':
+        dead.add(('free', args[0]))
+
+
+def is_dead_store(info, dead, instr):
+    """Given the facts just after a `store`, can we delete it?
+    """
+    pts = info.pts(instr, instr['args'][0])
+    for kind, x in dead:
+        if kind == 'store' and (x == instr['args'][0] or
+                                info.must_alias(info.pts(instr, x), pts)):
+            return True
+        if kind == 'free' and info.same_object(info.pts(instr, x), pts):
+            return True
+    sites = {x for kind, x in dead if kind == 'site'}
+    return all(l.site in sites for l in pts)
+
+
+def dse_func(func):
+    """Delete dead stores from a function. Return the number deleted.
+    """
+    if not any(i.get('op') == 'store' for i in func['instrs']):
+        return 0
+    info = PointsTo(func)
+
+    # Nothing reads memory that does not escape once we return.
+    at_exit = {('site', s) for s in set(info.sites.values())
+               if s not in info.escaping}
+
+    def transfer(block, out):
+        if out is None:
+            return None
+        dead = set(out)
+        for instr in reversed(block):
+            dse_step(info, dead, instr)
+        return dead
+
+    def merge(vals):
+        vals = list(vals)
+        if not vals:
+            return set(at_exit)
+        return intersect(vals)
+
+    _, out = df_worklist(info.blocks, Analysis(
+        False, init=None, merge=merge, transfer=transfer,
+    ))
+
+    doomed = set()
+    for name, block in info.blocks.items():
+        dead = set(out[name] or ())
+        for instr in reversed(block):
+            if instr.get('op') == 'store' and \
+                    is_dead_store(info, dead, instr):
+                doomed.add(id(instr))
+            dse_step(info, dead, instr)
+
+    func['instrs'] = [i for i in func['instrs'] if id(i) not in doomed]
+    return len(doomed)
+
+
+OPTS = {
+    'rle': (rle_func, 'replaced {} loads'),
+    'dse': (dse_func, 'deleted {} stores'),
+}
+
+
+if __name__ == '__main__':
+    bril = json.load(sys.stdin)
+    for opt in sys.argv[1:] or ['rle', 'dse']:
+        func_opt, msg = OPTS[opt]
+        count = sum(func_opt(func) for func in bril['functions'])
+        print(msg.format(count), file=sys.stderr)
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
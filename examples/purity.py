@@ -0,0 +1,80 @@
+"""Purity analysis for Bril functions.
+
+Every function gets one of three classes:
+
+- `pure`: no side effects and no reads from memory. Two calls with the
+  same arguments always produce the same result.
+- `readonly`: reads memory with `load` but never changes it, so two calls
+  with the same arguments agree unless memory changes in between.
+- `effectful`: anything else, i.e., functions that `print`, `store`,
+  `alloc`, `free`, or speculate, directly or through the functions they
+  call.
+
+Calls to functions that are not in the program are effectful. Recursion
+on its own does not make a function effectful.
+"""
+import json
+import sys
+
+from inline import call_graph, sccs
+
+PURE = 'pure'
+READONLY = 'readonly'
+EFFECTFUL = 'effectful'
+
+# The classes in order from least to most effectful.
+ORDER = (PURE, READONLY, EFFECTFUL)
+
+# Operations that change the state of the program (other than the
+# variable they assign).
+EFFECT_OPS = {'print', 'store', 'alloc', 'free',
+              'speculate', 'commit', 'guard'}
+
+
+def join(a, b):
+    """The more effectful of two classes."""
+    return max(a, b, key=ORDER.index)
+
+
+def instr_effect(instr, effects):
+    """Classify one instruction. `effects` maps function names to their
+    classes.
+    """
+    op = instr.get('op')
+    if op in EFFECT_OPS:
+        return EFFECTFUL
+    elif op == 'load':
+        return READONLY
+    elif op == 'call':
+        return effects.get(instr['funcs'][0], EFFECTFUL)
+    return PURE
+
+
+def function_effects(bril):
+    """Classify every function in the program. Return a dictionary
+    mapping function names to classes.
+    """
+    graph = call_graph(bril)
+    by_name = {func['name']: func for func in bril['functions']}
+
+    effects = {}
+    # Callees come before their callers. The members of a recursive
+    # component share a class, so calls within the component are
+    # assumed pure while we compute it.
+    for scc in sccs(graph):
+        for name in scc:
+            effects[name] = PURE
+        effect = PURE
+        for name in scc:
+            for instr in by_name[name]['instrs']:
+                effect = join(effect, instr_effect(instr, effects))
+        for name in scc:
+            effects[name] = effect
+    return effects
+
+
+if __name__ == '__main__':
+    bril = json.load(sys.stdin)
+    effects = function_effects(bril)
+    for func in bril['functions']:
+        print('{}: {}'.format(func['name'], effects[func['name']]))
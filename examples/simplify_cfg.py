@@ -0,0 +1,335 @@
+"""Clean up the control-flow graph of Bril functions.
+
+Passes like `to_ssa`/`from_ssa` and `cfg.add_terminators` leave behind
+empty blocks and `jmp`s to the very next block. This pass repeatedly:
+
+- folds `br` instructions whose two targets are the same,
+- threads jumps through empty blocks that only contain a `jmp`,
+- removes unreachable blocks, and
+- merges blocks with their unique successor when that successor has no
+  other predecessors,
+
+and then lays out the blocks so that as many `jmp`s as possible become
+fall-throughs (and can be deleted) before reassembling the function.
+
+With `--profile` (a sidecar from `brilipy --profile`), the layout turns
+the most frequently taken `jmp`s into fall-throughs first and moves
+blocks that never ran to the end of the function.
+"""
+import argparse
+import json
+import sys
+
+from cfg import block_map, successors, add_terminators, edges
+from form_blocks import form_blocks
+from util import load_profile
+
+
+def _phis(block):
+    return [i for i in block if i.get('op') == 'phi']
+
+
+def _rename_phi_preds(block, old, new):
+    """Make the phi-nodes in `block` refer to predecessor `new` instead of
+    `old`.
+    """
+    for phi in _phis(block):
+        phi['labels'] = [new if l == old else l for l in phi['labels']]
+
+
+def fold_branches(blocks):
+    """Turn `br` instructions with identical targets into `jmp`s.
+    """
+    changed = False
+    for block in blocks.values():
+        term = block[-1]
+        if term['op'] == 'br' and term['labels'][0] == term['labels'][1]:
+            block[-1] = {'op': 'jmp', 'labels': [term['labels'][0]]}
+            changed = True
+    return changed
+
+
+def _is_forwarder(block):
+    """Is this block just a `jmp` to somewhere else?
+    """
+    return len(block) == 1 and block[0]['op'] == 'jmp'
+
+
+def thread_jumps(blocks, entry):
+    """Redirect control-flow edges that lead to an empty, jump-only block
+    straight to that block's (ultimate) target.
+
+    We do not thread into blocks that begin with phi-nodes, which would
+    need their predecessor lists rewritten to tell the edges apart.
+    """
+    def final_target(name):
+        seen = set()
+        while _is_forwarder(blocks[name]) and name not in seen:
+            seen.add(name)
+            name = blocks[name][0]['labels'][0]
+        return name
+
+    changed = False
+    for block in blocks.values():
+        term = block[-1]
+        if term['op'] not in ('jmp', 'br'):
+            continue
+        new_labels = []
+        for label in term['labels']:
+            target = final_target(label)
+            if target != label and not _phis(blocks[target]):
+                new_labels.append(target)
+                changed = True
+            else:
+                new_labels.append(label)
+        term['labels'] = new_labels
+    return changed
+
+
+def remove_unreachable(blocks, entry):
+    """Delete blocks that cannot be reached from the entry.
+    """
+    reachable = set()
+    stack = [entry]
+    while stack:
+        name = stack.pop()
+        if name in reachable:
+            continue
+        reachable.add(name)
+        stack += successors(blocks[name][-1])
+
+    dead = [name for name in blocks if name not in reachable]
+    for name in dead:
+        del blocks[name]
+
+    # Drop phi inputs that came from deleted blocks.
+    if dead:
+        for block in blocks.values():
+            for phi in _phis(block):
+                pairs = [(l, a) for l, a in zip(phi['labels'], phi['args'])
+                         if l in reachable]
+                phi['labels'] = [l for l, _ in pairs]
+                phi['args'] = [a for _, a in pairs]
+    return bool(dead)
+
+
+def defined_vars(blocks, entry, params=()):
+    """Find the variables that are definitely defined at the end of each
+    block, with a forward "must" analysis. A phi-node defines its
+    destination only if its argument is defined along every incoming
+    edge; otherwise (for example, with an `__undefined` argument) the
+    destination may be left undefined.
+    """
+    preds, _ = edges(blocks)
+    every = set(params)
+    for block in blocks.values():
+        every.update(i['dest'] for i in block if 'dest' in i)
+    out = {name: set(every) for name in blocks}
+
+    changed = True
+    while changed:
+        changed = False
+        for name, block in blocks.items():
+            defined = set(every)
+            for p in preds[name]:
+                defined &= out[p]
+            if name == entry:
+                defined &= set(params)
+            for instr in block:
+                if 'dest' not in instr:
+                    continue
+                if instr.get('op') == 'phi':
+                    incoming = dict(zip(instr['labels'], instr['args']))
+                    if not preds[name] or not all(
+                        p in incoming and incoming[p] in out[p]
+                        for p in preds[name]
+                    ):
+                        continue
+                defined.add(instr['dest'])
+            if defined != out[name]:
+                out[name] = defined
+                changed = True
+    return out
+
+
+def merge_blocks(blocks, entry, params=()):
+    """Merge each block that ends in a `jmp` with its target when the
+    block is the target's only predecessor.
+
+    The target's phi-nodes become copies, so we only merge when each of
+    their arguments is definitely defined: a phi-node with an undefined
+    argument leaves its destination undefined, but an `id` of it fails.
+    """
+    changed = False
+    preds, _ = edges(blocks)
+    defined = defined_vars(blocks, entry, params)
+    for name in list(blocks):
+        if name not in blocks:
+            continue  # Already merged into a predecessor.
+        while True:
+            block = blocks[name]
+            term = block[-1]
+            if term['op'] != 'jmp':
+                break
+            succ = term['labels'][0]
+            if succ == name or succ == entry or preds[succ] != [name]:
+                break
+            if any(arg not in defined[name]
+                   for phi in _phis(blocks[succ])
+                   for l, arg in zip(phi['labels'], phi['args'])
+                   if l == name):
+                break
+
+            # With a single predecessor, every phi-node is just a copy.
+            body = []
+            for instr in blocks[succ]:
+                if instr.get('op') == 'phi':
+                    if name not in instr['labels']:
+                        continue  # Undefined on the only incoming edge.
+                    arg = instr['args'][instr['labels'].index(name)]
+                    body.append({
+                        'op': 'id',
+                        'dest': instr['dest'],
+                        'type': instr['type'],
+                        'args': [arg],
+                    })
+                else:
+                    body.append(instr)
+
+            # The merged block takes over `succ`'s outgoing edges.
+            for s in successors(body[-1]):
+                _rename_phi_preds(blocks[s], succ, name)
+
+            block[-1:] = body
+            del blocks[succ]
+            preds, _ = edges(blocks)
+            defined = defined_vars(blocks, entry, params)
+            changed = True
+    return changed
+
+
+def layout(blocks, entry, profile=None):
+    """Choose an order for the blocks that turns as many `jmp`s as
+    possible into fall-throughs.
+
+    Greedily chain each block that ends in a `jmp` to its target (unless
+    the target already has a chain predecessor or the link would close a
+    cycle), then emit the chains, starting with the entry's. Other chains
+    keep their original relative order.
+
+    With a `profile` for the function, consider the hottest jumps first
+    and emit the chains in order of their first block's execution count.
+    """
+    edge_heat = profile.get('edges', {}) if profile else {}
+    block_heat = profile.get('blocks', {}) if profile else {}
+
+    names = list(blocks)
+    next_in_chain = {}
+    prev_in_chain = {}
+    chain_head = {name: name for name in names}
+
+    def head(name):
+        while chain_head[name] != name:
+            name = chain_head[name]
+        return name
+
+    # Consider the jumps that already go to the next block first, so we
+    # keep the existing fall-throughs when there is a choice.
+    jumps = []
+    for i, name in enumerate(names):
+        term = blocks[name][-1]
+        if term['op'] == 'jmp':
+            adjacent = i + 1 < len(names) and \
+                term['labels'][0] == names[i + 1]
+            heat = edge_heat.get(name, {}).get(term['labels'][0], 0)
+            jumps.append((-heat, not adjacent, i, name,
+                          term['labels'][0]))
+
+    for _, _, _, name, succ in sorted(jumps):
+        if succ == entry or succ in prev_in_chain or \
+                head(succ) == head(name):
+            continue
+        next_in_chain[name] = succ
+        prev_in_chain[succ] = name
+        chain_head[succ] = head(name)
+
+    order = []
+    heads = [n for n in names if n != entry and n not in prev_in_chain]
+    if profile:
+        heads.sort(key=lambda n: -block_heat.get(n, 0))
+    heads = [entry] + heads
+    for name in heads:
+        while name is not None:
+            order.append(name)
+            name = next_in_chain.get(name)
+    return order
+
+
+def reassemble_layout(blocks, order, func_type):
+    """Flatten the blocks in the given order, omitting `jmp`s to the next
+    block, a final `ret` with no value, and labels nobody refers to.
+    """
+    referenced = set()
+    for block in blocks.values():
+        for instr in block:
+            referenced.update(instr.get('labels', []))
+
+    instrs = []
+    for i, name in enumerate(order):
+        block = list(blocks[name])
+        if name in referenced:
+            instrs.append({'label': name})
+
+        term = block[-1]
+        is_last = i == len(order) - 1
+        if term['op'] == 'jmp' and not is_last and \
+                term['labels'][0] == order[i + 1]:
+            block.pop()
+        elif term['op'] == 'ret' and is_last and not term.get('args') \
+                and func_type is None:
+            block.pop()
+        instrs += block
+    return instrs
+
+
+def simplify_func(func, profile=None):
+    """Simplify the CFG of a function in place, using its `profile`
+    (if any) for the layout.
+    """
+    blocks = block_map(form_blocks(func['instrs']))
+    if not blocks:
+        return
+    add_terminators(blocks)
+    entry = next(iter(blocks))
+
+    while True:
+        changed = fold_branches(blocks)
+        changed |= thread_jumps(blocks, entry)
+        changed |= remove_unreachable(blocks, entry)
+        changed |= merge_blocks(
+            blocks, entry, [a['name'] for a in func.get('args', [])]
+        )
+        if not changed:
+            break
+
+    order = layout(blocks, entry, profile)
+    func['instrs'] = reassemble_layout(blocks, order, func.get('type'))
+
+
+def simplify_cfg(bril, profile=None):
+    for func in bril['functions']:
+        simplify_func(func, profile.get(func['name']) if profile else None)
+    return bril
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--profile', help='block profile JSON sidecar')
+    opts = parser.parse_args()
+
+    bril = json.load(sys.stdin)
+    simplify_cfg(
+        bril,
+        profile=load_profile(opts.profile) if opts.profile else None,
+    )
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,153 @@
+"""Scalar replacement of small allocations for Bril.
+
+Find `alloc` sites with a small constant size whose pointers never
+escape the function (see `alias.py`) and whose every access uses a known
+constant offset into the most recently allocated object. Replace each
+element of such an allocation with an ordinary variable: `store`s become
+copies into the variable, `load`s become copies out of it, and the
+`alloc`, its `free`s, and the pointer arithmetic disappear.
+
+The new variables may be assigned more than once; run `to_ssa.py`
+afterward to get SSA form.
+"""
+import argparse
+import json
+import sys
+
+from alias import PointsTo
+from util import fresh
+
+
+def _sites(locs):
+    return {l.site for l in locs}
+
+
+def candidates(info, max_size):
+    """Find the sites in a function that we can replace with variables.
+    Return a map from each site to its `alloc` instruction.
+    """
+    allocs = {}
+    for block in info.blocks.values():
+        for instr in block:
+            if instr.get('op') != 'alloc':
+                continue
+            site = info.sites[id(instr)]
+            size = info.const(instr, instr['args'][0])
+            if site not in info.escaping and size is not None and \
+                    0 < size <= max_size:
+                allocs[site] = instr
+
+    # Every access must go to a known element of the current object.
+    for block in info.blocks.values():
+        for instr in block:
+            op = instr.get('op')
+            args = instr.get('args', [])
+            if op in ('load', 'store'):
+                locs = info.pts(instr, args[0])
+                if len(locs) == 1:
+                    loc, = locs
+                    alloc = allocs.get(loc.site)
+                    if alloc is not None and loc.fresh and \
+                            loc.offset is not None and \
+                            0 <= loc.offset < info.const(alloc,
+                                                         alloc['args'][0]):
+                        continue
+                bad = _sites(locs)
+            elif op == 'free':
+                locs = info.pts(instr, args[0])
+                if len(_sites(locs)) == 1:
+                    continue
+                bad = _sites(locs)
+            elif op in ('alloc', 'ptradd', 'id', 'phi'):
+                continue
+            else:
+                # Any other use of a pointer (e.g., printing it).
+                bad = set()
+                for arg in args:
+                    bad |= _sites(info.pts(instr, arg))
+            for site in bad:
+                allocs.pop(site, None)
+    return allocs
+
+
+def sroa_func(func, max_size=8):
+    """Replace small, non-escaping allocations in a function with
+    variables. Return the number of `alloc` sites replaced.
+    """
+    if not any(i.get('op') == 'alloc' for i in func['instrs']):
+        return 0
+    info = PointsTo(func)
+    allocs = candidates(info, max_size)
+    if not allocs:
+        return 0
+
+    names = {a['name'] for a in func.get('args', [])}
+    for instr in func['instrs']:
+        if 'dest' in instr:
+            names.add(instr['dest'])
+
+    elements = {}
+
+    def element(loc):
+        if (loc.site, loc.offset) not in elements:
+            alloc = allocs[loc.site]
+            name = '{}.{}'.format(alloc['dest'], loc.offset)
+            if name in names:
+                name = fresh(name + '.', names)
+            names.add(name)
+            elements[loc.site, loc.offset] = name
+        return elements[loc.site, loc.offset]
+
+    def replaced(instr, var):
+        locs = info.pts(instr, var)
+        return bool(locs) and _sites(locs) <= set(allocs)
+
+    new_instrs = []
+    for instr in func['instrs']:
+        op = instr.get('op')
+        args = instr.get('args', [])
+        if op == 'alloc' and info.sites.get(id(instr)) in allocs:
+            continue
+        elif op in ('ptradd', 'id', 'free') and replaced(instr, args[0]):
+            continue
+        elif op == 'phi' and all(replaced(instr, a) for a in args):
+            continue
+        elif op == 'load' and replaced(instr, args[0]):
+            loc, = info.pts(instr, args[0])
+            new_instrs.append({
+                'op': 'id',
+                'dest': instr['dest'],
+                'type': instr['type'],
+                'args': [element(loc)],
+            })
+        elif op == 'store' and replaced(instr, args[0]):
+            loc, = info.pts(instr, args[0])
+            new_instrs.append({
+                'op': 'id',
+                'dest': element(loc),
+                'type': allocs[loc.site]['type']['ptr'],
+                'args': [args[1]],
+            })
+        else:
+            new_instrs.append(instr)
+    func['instrs'] = new_instrs
+    return len(allocs)
+
+
+def sroa(bril, max_size=8):
+    """Apply scalar replacement to every function. Return the number of
+    allocation sites replaced.
+    """
+    return sum(sroa_func(func, max_size) for func in bril['functions'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-s', '--max-size', type=int, default=8,
+                        help='largest allocation to replace (elements)')
+    opts = parser.parse_args()
+
+    bril = json.load(sys.stdin)
+    count = sroa(bril, opts.max_size)
+    print('replaced {} allocations'.format(count), file=sys.stderr)
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,131 @@
+"""Turn self tail calls into loops.
+
+A call to the current function that is immediately followed by a `ret`
+of its result (or by a bare `ret`, for `void` calls) does not need a new
+stack frame: we can assign the call's arguments to the parameters and
+jump back to the top of the function.
+"""
+import json
+import sys
+
+from util import fresh
+
+
+def is_tail_call(func, instr, next_instr):
+    """Check whether `instr`, followed by `next_instr`, is a self tail
+    call in `func`.
+    """
+    if instr.get('op') != 'call' or instr['funcs'] != [func['name']]:
+        return False
+    if next_instr is None or next_instr.get('op') != 'ret':
+        return False
+    ret_args = next_instr.get('args', [])
+    if 'dest' in instr:
+        return ret_args == [instr['dest']]
+    else:
+        return not ret_args
+
+
+def sequentialize(moves, fresh_var):
+    """Order a set of parallel copies so they can run one at a time.
+
+    `moves` is a list of (destination, source) pairs that should all
+    happen "at once." Produce a list of pairs that has the same effect
+    when executed in order, using temporaries from `fresh_var` (a
+    function that generates new variable names) to break cycles.
+    """
+    moves = [(d, s) for d, s in moves if d != s]
+    out = []
+    while moves:
+        sources = {s for _, s in moves}
+        for i, (d, s) in enumerate(moves):
+            # This destination is safe to overwrite: no pending copy
+            # still needs to read it.
+            if d not in sources:
+                out.append((d, s))
+                del moves[i]
+                break
+        else:
+            # Every pending destination is still needed as a source, so
+            # the copies form cycles. Save one value to break a cycle.
+            d, _ = moves[0]
+            tmp = fresh_var()
+            out.append((tmp, d))
+            moves = [(d2, tmp if s2 == d else s2) for d2, s2 in moves]
+    return out
+
+
+def tailrec_func(func):
+    """Rewrite the self tail calls in a function into jumps to a new loop
+    header at the top of the function. Return the number of calls
+    rewritten.
+
+    The header becomes the function's first block, so it has in-edges;
+    `cfg.add_entry` (used by `to_ssa`, for example) puts a fresh entry
+    block in front of it.
+    """
+    instrs = func['instrs']
+    params = func.get('args', [])
+    types = {p['name']: p['type'] for p in params}
+
+    # Collect the names we must not clash with.
+    labels = set()
+    variables = set(types)
+    for instr in instrs:
+        if 'label' in instr:
+            labels.add(instr['label'])
+        labels.update(instr.get('labels', []))
+        variables.update(instr.get('args', []))
+        if 'dest' in instr:
+            variables.add(instr['dest'])
+    header = fresh('tailrec', labels)
+
+    def fresh_var():
+        var = fresh('tailrec.', variables)
+        variables.add(var)
+        return var
+
+    out = []
+    count = 0
+    i = 0
+    while i < len(instrs):
+        instr = instrs[i]
+        next_instr = instrs[i + 1] if i + 1 < len(instrs) else None
+        if not is_tail_call(func, instr, next_instr):
+            out.append(instr)
+            i += 1
+            continue
+
+        # Reassign the parameters, then loop back to the top. Temporaries
+        # introduced to break cycles take the type of the parameter they
+        # save.
+        moves = [(p['name'], a) for p, a in zip(params, instr.get('args', []))]
+        for dest, src in sequentialize(moves, fresh_var):
+            if dest not in types:
+                types[dest] = types[src]
+            out.append({
+                'op': 'id',
+                'dest': dest,
+                'type': types[dest],
+                'args': [src],
+            })
+        out.append({'op': 'jmp', 'labels': [header]})
+        count += 1
+        i += 2  # Skip the `ret` too.
+
+    if count:
+        func['instrs'] = [{'label': header}] + out
+    return count
+
+
+def tailrec(bril):
+    """Eliminate self tail calls in every function of a program. Return
+    the total number of calls rewritten.
+    """
+    return sum(tailrec_func(func) for func in bril['functions'])
+
+
+if __name__ == '__main__':
+    bril = json.load(sys.stdin)
+    tailrec(bril)
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,39 @@
+{
+  "main": {
+    "blocks": {
+      "b1": 1,
+      "body": 10,
+      "check": 3,
+      "done": 1,
+      "loop": 11
+    },
+    "calls": {
+      "body": {
+        "sq": 10
+      }
+    },
+    "edges": {
+      "b1": {
+        "loop": 1
+      },
+      "body": {
+        "check": 3,
+        "loop": 7
+      },
+      "check": {
+        "loop": 3
+      },
+      "loop": {
+        "body": 10,
+        "done": 1
+      }
+    }
+  },
+  "sq": {
+    "blocks": {
+      "b1": 10
+    },
+    "calls": {},
+    "edges": {}
+  }
+}
\ No newline at end of file
@@ -0,0 +1,32 @@
+{
+  "main": {
+    "blocks": {
+      "b1": 1,
+      "common": 16,
+      "done": 1,
+      "loop": 20,
+      "next": 20,
+      "rare": 4
+    },
+    "calls": {},
+    "edges": {
+      "b1": {
+        "loop": 1
+      },
+      "common": {
+        "next": 16
+      },
+      "loop": {
+        "common": 16,
+        "rare": 4
+      },
+      "next": {
+        "done": 1,
+        "loop": 19
+      },
+      "rare": {
+        "next": 4
+      }
+    }
+  }
+}
\ No newline at end of file
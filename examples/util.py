@@ -1,4 +1,5 @@
 import itertools
+import json
 
 
 def flatten(ll):
@@ -16,3 +17,16 @@ def fresh(seed, names):
         if name not in names:
             return name
         i += 1
+
+
+def load_profile(path):
+    """Load a profile sidecar, as written by `brilipy --profile`: a JSON
+    object mapping function names to objects with these keys, all using
+    the block names from `cfg.block_map`:
+
+    - `blocks`: block name -> execution count
+    - `edges`: block name -> successor name -> times the edge was taken
+    - `calls`: block name -> callee name -> times the call executed
+    """
+    with open(path) as f:
+        return json.load(f)